@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.0/ref/settings/
 """
 
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -41,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, to measure the whole request (only used when METRICS_ENABLED)
+    'motogp.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -70,6 +73,8 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'gpstats.wsgi.application'
 
+TEST_RUNNER = 'gpstats.test_runner.TestRunner'
+
 
 # Database
 # https://docs.djangoproject.com/en/2.0/ref/settings/#databases
@@ -82,6 +87,34 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.0/topics/cache/
+# File based so the data version bumped by the update commands is seen by the web server: both need the same
+# GPSTATS_CACHE_DIR. Tests use an in-memory cache instead (see gpstats.test_runner).
+# Pages fill the default cache up to MAX_ENTRIES, past which entries are culled at random. The data version and the
+# metrics, which must survive, have a cache of their own holding a handful of entries.
+
+CACHE_DIR = os.environ.get('GPSTATS_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'gpstats_view_cache'))
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(CACHE_DIR, 'pages'),
+        'TIMEOUT': 60 * 60 * 24 * 7,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    'state': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(CACHE_DIR, 'state'),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000000,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
 
@@ -121,3 +154,32 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
+
+
+# Scraper
+# Raw pages fetched from motogp.com, reused by forced re-scrapes and by updatescrapeddata --replay
+
+SCRAPER_CACHE_DIR = os.path.join(BASE_DIR, 'scrape_cache')
+SCRAPER_CACHE_TTL = 60 * 60 * 24 * 7
+SCRAPER_CACHE_MAX_SIZE = 1024 * 1024 * 1024
+# HTML extraction backend: 'stream' (standard library), 'bs4' or 'lxml' (needs the lxml package)
+SCRAPER_PARSER = 'stream'
+
+# Charts
+# Rendered on first view, recently used ones kept in memory, all of them on disk up to the maximum size
+
+CHART_CACHE_DIR = os.path.join(BASE_DIR, 'chart_cache')
+CHART_CACHE_MEMORY_SIZE = 64 * 1024 * 1024
+CHART_CACHE_MAX_SIZE = 512 * 1024 * 1024
+# Loaded by each chart for its tooltips, point it to a local copy to serve everything from this site
+CHART_TOOLTIPS_JS = 'https://kozea.github.io/pygal.js/2.0.x/pygal-tooltips.min.js'
+
+# Metrics
+# Prometheus text format under /metrics: view latency and queries, update job counters, kept in the state cache
+
+METRICS_ENABLED = False
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+# Seconds between two flushes of the view measures of a process to the cache
+METRICS_FLUSH_INTERVAL = 10
+# Seconds after which the measures of a process which stopped flushing are merged into those of retired processes
+METRICS_INSTANCE_TTL = 60 * 60 * 24
@@ -16,7 +16,10 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from motogp.metrics import metrics
+
 urlpatterns = [
     path('', include('motogp.urls')),
+    path('metrics', metrics, name='metrics'),
     path('admin/', admin.site.urls),
 ]
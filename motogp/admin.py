@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import Season, Session, Event, EventLocation, Rider, Result, MenuOptions, UpdateData
+from .models import Season, Session, Event, EventLocation, Rider, RiderAlias, Result, MenuOptions, UpdateData, \
+    PageValidator
 
 admin.site.register(MenuOptions)
 admin.site.register(Session)
@@ -8,5 +9,7 @@ admin.site.register(Season)
 admin.site.register(EventLocation)
 admin.site.register(Event)
 admin.site.register(Rider)
+admin.site.register(RiderAlias)
 admin.site.register(Result)
 admin.site.register(UpdateData)
+admin.site.register(PageValidator)
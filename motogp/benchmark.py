@@ -0,0 +1,217 @@
+import os
+import time
+
+from collections import OrderedDict, namedtuple
+from unittest import mock
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from . import scraper
+from .charts import create_chart
+from .models import Season, Event
+from .store import ResultsStore
+
+# Pages parsed by the benchmark, stored in corpus_dir as <path with dashes>.html. The pages shipped there are
+# synthetic: written after motogp.com's layout and quirks, not downloaded from it, so their measures only compare runs
+# with each other. record_corpus replaces them with the live pages.
+corpus_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_pages')
+CorpusPage = namedtuple('CorpusPage', ['path', 'menu'])  # menu: id of the menu element, None for results pages
+corpus = [
+    CorpusPage('2018', 'event'),
+    CorpusPage('2018/QAT', 'category'),
+    CorpusPage('2018/QAT/MotoGP', 'session'),
+    CorpusPage('2018/QAT/MotoGP/RAC', None),
+    CorpusPage('2018/QAT/MotoGP/FP1', None),
+    CorpusPage('2018/QAT/MotoGP/Q2', None),
+    CorpusPage('2018/QAT/Moto3/RAC', None),
+    CorpusPage('1990/JPN/500cc/RAC', None),  # Older format: no top speeds
+    CorpusPage('2016/GER/Moto2/RAC2', None),  # Restarted race
+]
+
+
+def corpus_file(page, directory=corpus_dir):
+    return os.path.join(directory, page.path.replace('/', '-') + '.html')
+
+
+def load_corpus(directory=corpus_dir):
+    """
+    :param directory: Directory holding the corpus pages
+    :return: Dictionary of url: (CorpusPage, page text)
+    """
+    pages = OrderedDict()
+    for page in corpus:
+        with open(corpus_file(page, directory), encoding='utf-8') as file:
+            pages[scraper.base_page + page.path] = (page, file.read())
+    return pages
+
+
+def record_corpus(directory=corpus_dir):
+    """
+    Replace the corpus pages with those of motogp.com.
+
+    :param directory: Directory receiving the corpus pages
+    :return: Number of pages recorded
+    """
+    os.makedirs(directory, exist_ok=True)
+    for page in corpus:
+        response = scraper.download(scraper.base_page + page.path)
+        response.raise_for_status()
+        with open(corpus_file(page, directory), 'w', encoding='utf-8') as file:
+            file.write(response.text)
+    return len(corpus)
+
+
+def serve_corpus(pages):
+    """
+    :param pages: Corpus, as returned by load_corpus
+    :return: Patch of fetch_page answering from the corpus instead of the network or the page cache
+    """
+    return mock.patch.object(scraper, 'fetch_page', side_effect=lambda url, conditional=False: pages[url][1])
+
+
+def throughput(count, seconds):
+    return round(count / seconds, 1) if seconds > 0 else None
+
+
+def benchmark_parsing(pages, repeat=10, parser=None):
+    """
+    Time get_options and get_results_from over the corpus.
+
+    :param pages: Corpus, as returned by load_corpus
+    :param repeat: Number of passes over the corpus
+    :param parser: Extraction backend (default = SCRAPER_PARSER setting)
+    :return: Dictionary of measures
+    """
+    options = {} if parser is None else {'SCRAPER_PARSER': parser}
+    menus = [(url, page.menu) for url, (page, text) in pages.items() if page.menu is not None]
+    results = [url for url, (page, text) in pages.items() if page.menu is None]
+    parsed_pages = rows = 0
+    with serve_corpus(pages), override_settings(**options):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for url, tag in menus:
+                scraper.get_options(url, tag)
+            for url in results:
+                rows += len(scraper.get_results_from(url)) - 3
+            parsed_pages += len(menus) + len(results)
+        seconds = time.perf_counter() - start
+    return {
+        'pages': parsed_pages,
+        'rows': rows,
+        'seconds': round(seconds, 4),
+        'pages_per_second': throughput(parsed_pages, seconds),
+        'rows_per_second': throughput(rows, seconds),
+    }
+
+
+def benchmark_ingestion(pages, repeat=3):
+    """
+    Time insert_in_database over the results pages of the corpus.
+
+    Each pass runs in a transaction rolled back at the end: nothing is left in the database.
+
+    :param pages: Corpus, as returned by load_corpus
+    :param repeat: Number of passes over the corpus
+    :return: Dictionary of measures
+    """
+    with serve_corpus(pages):
+        sessions = [(page.path.split('/'), scraper.get_results_from(url))
+                    for url, (page, text) in pages.items() if page.menu is None]
+    rows = 0
+    seconds = 0
+    for _ in range(repeat):
+        with transaction.atomic():
+            lookups = scraper.IngestLookups()
+            start = time.perf_counter()
+            for (season, event, category, session), results in sessions:
+                scraper.insert_in_database(season, event, category, session, results, lookups=lookups)
+                rows += len(results) - 3
+            seconds += time.perf_counter() - start
+            transaction.set_rollback(True)
+    return {
+        'sessions': len(sessions) * repeat,
+        'rows': rows,
+        'seconds': round(seconds, 4),
+        'rows_per_second': throughput(rows, seconds),
+    }
+
+
+def run_benchmark(repeat=10, parser=None, directory=corpus_dir):
+    """
+    :param repeat: Number of passes over the corpus when parsing, ingestion makes a third of them
+    :param parser: Extraction backend (default = SCRAPER_PARSER setting)
+    :param directory: Directory holding the corpus pages
+    :return: Dictionary of {'parse': measures, 'ingest': measures}
+    """
+    pages = load_corpus(directory)
+    return {
+        'parse': benchmark_parsing(pages, repeat, parser),
+        'ingest': benchmark_ingestion(pages, max(1, repeat // 3)),
+    }
+
+
+# Queries allowed to build the data of one chart, whatever the length of the history: loading its results store.
+# Builds from a store loaded beforehand send none.
+query_budgets = OrderedDict([
+    ('season', 2),
+    ('event_history', 2),
+    ('session_history', 2),
+])
+
+
+def chart_builders():
+    """
+    :return: List of (name, objects, function returning the chart specs of an object) for each kind of chart
+    """
+    seasons = list(Season.objects.order_by('year'))
+    events = list(Event.objects.select_related('season', 'event_location').order_by('season__year', 'pk'))
+    return [
+        ('season', seasons, Season.season_chart_specs),
+        ('event_history', events, Event.event_history_chart_specs),
+        ('session_history', events, Event.session_history_chart_specs),
+    ]
+
+
+def benchmark_charts(render=False, store=False):
+    """
+    Time the chart builders over every season and event in the database and count their queries.
+
+    :param render: Also time rendering the charts, without writing them
+    :param store: Build every chart from one ResultsStore of the whole history, loaded first
+    :return: Dictionary of chart kind: measures
+    """
+    results_store = load_seconds = None
+    if store:
+        start = time.perf_counter()
+        results_store = ResultsStore.load()
+        load_seconds = round(time.perf_counter() - start, 4)
+
+    report = OrderedDict()
+    for name, objects, build in chart_builders():
+        queries = []
+        seconds = render_seconds = 0
+        charts = 0
+        for obj in objects:
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                specs = build(obj, store=results_store)
+                seconds += time.perf_counter() - start
+            queries.append(len(captured))
+            charts += len(specs)
+            if render:
+                start = time.perf_counter()
+                for spec in specs:
+                    create_chart(spec.data, **spec.options)
+                render_seconds += time.perf_counter() - start
+        report[name] = {
+            'builds': len(objects),
+            'charts': charts,
+            'seconds': round(seconds, 4),
+            'ms_per_build': round(seconds * 1000 / len(objects), 2) if objects else None,
+            'render_seconds': round(render_seconds, 4) if render else None,
+            'store_seconds': load_seconds,
+            'max_queries': max(queries, default=0),
+            'query_budget': 0 if store else query_budgets[name],
+        }
+    return report
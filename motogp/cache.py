@@ -0,0 +1,89 @@
+import datetime
+import time
+
+from functools import wraps
+
+from django.core.cache import cache, caches
+from django.utils import timezone
+
+# Changes whenever scraped data or charts change, see bump_data_version
+data_version_key = 'motogp:data_version'
+
+
+def state_cache():
+    """
+    :return: Cache of the values which must not be culled along with pages: data version and metrics
+    """
+    return caches['state']
+
+
+def data_version():
+    """
+    Current version of the site data, shared by all processes through the state cache.
+
+    :return: Version number, a timestamp in milliseconds of the last data change
+    """
+    version = state_cache().get(data_version_key)
+    if version is None:
+        # Unknown after the cache was cleared: anything cached before is stale
+        version = bump_data_version()
+    return version
+
+
+def bump_data_version():
+    """
+    Invalidate every cached page, called once scraped data or charts changed.
+
+    :return: The new version
+    """
+    version = max(int(time.time() * 1000), (state_cache().get(data_version_key) or 0) + 1)
+    state_cache().set(data_version_key, version, timeout=None)
+    return version
+
+
+def data_version_etag(request, *args, **kwargs):
+    """ Strong ETag of a response built from the site data, for the condition decorator """
+    return f'"{data_version()}"'
+
+
+def data_version_modified(request, *args, **kwargs):
+    """ Last-Modified of a response built from the site data, for the condition decorator """
+    return datetime.datetime.fromtimestamp(data_version() / 1000, tz=timezone.utc)
+
+
+def cached_per_version(name, build):
+    """
+    Value built from the site data, built once per data version.
+
+    :param name: Name of the value, unique within a data version
+    :param build: Function building the value on a miss
+    :return: Value
+    """
+    key = f'motogp:data:{data_version()}:{name}'
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value)
+    return value
+
+
+def cache_per_version(view):
+    """
+    Cache successful GET responses of a view until the data version changes.
+
+    Warm requests are answered from the cache backend without touching the database.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+
+        key = f'motogp:page:{data_version()}:{request.get_full_path()}'
+        response = cache.get(key)
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, response)
+        return response
+
+    return wrapper
@@ -0,0 +1,209 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+
+from collections import OrderedDict
+
+from django.urls import reverse
+
+from . import metrics
+from .charts import create_chart, shared_stylesheet
+from .page_cache import PageCache
+from .svg import content_hash, optimize
+
+stylesheet_name = re.compile(r'chart-[0-9a-f]{12}\.css')
+
+
+class ChartCache:
+    """
+    Two tier LRU cache of rendered charts, so charts are only rendered when first viewed.
+
+    Charts are keyed by the sha1 of their data and options: a chart whose data did not change is never rendered twice,
+    and stale entries simply stop being asked for until they are evicted. Recently used charts are kept in memory,
+    every rendered chart is written to disk where the least recently used ones are removed past max_size. Charts are
+    stored optimized and gzipped, ready to be sent to clients accepting gzip.
+
+    The stylesheet shared by the charts is kept on disk next to them, never evicted, and served by the
+    chart_stylesheet view: charts rendered on demand never touch static files.
+
+    Concurrent requests for the same chart wait for a single render.
+    """
+    def __init__(self, directory, memory_size=None, max_size=None):
+        """
+        :param directory: Root of the on-disk tier
+        :param memory_size: Total size in bytes of charts kept in memory (default = unbounded)
+        :param max_size: Total size in bytes of charts kept on disk (default = unbounded)
+        """
+        self.directory = directory
+        self.memory_size = memory_size
+        self.max_size = max_size
+        self.memory = OrderedDict()
+        self.memory_used = 0
+        self.disk_used = None  # Measured on first write
+        self.lock = threading.Lock()
+        self.render_locks = {}
+        self.renders = 0
+
+    @staticmethod
+    def key(spec):
+        """
+        :param spec: ChartSpec of the chart, its path is ignored
+        :return: sha1 of the chart data and options
+        """
+        return hashlib.sha1(json.dumps([spec.data, spec.options]).encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.svg.gz')
+
+    def get_or_render(self, spec):
+        """
+        :param spec: ChartSpec of the chart, its options are passed to create_chart
+        :return: Rendered chart, gzipped
+        """
+        key = self.key(spec)
+        chart = self.get(key)
+        if chart is not None:
+            return chart
+
+        with self.lock:
+            render_lock = self.render_locks.setdefault(key, threading.Lock())
+        with render_lock:
+            # Rendered by another request while waiting
+            chart = self.get(key)
+            if chart is None:
+                chart = self.render(spec)
+                self.renders += 1
+                metrics.view_metrics.count('charts_rendered')
+                self.set(key, chart)
+        with self.lock:
+            self.render_locks.pop(key, None)
+        return chart
+
+    def render(self, spec):
+        """
+        :param spec: ChartSpec of the chart, its options are passed to create_chart
+        :return: Rendered chart, optimized and gzipped
+        """
+        return gzip.compress(optimize(create_chart(spec.data, **spec.options), self.publish_stylesheet,
+                                      shared_stylesheet()), compresslevel=9)
+
+    def stylesheet_path(self, name):
+        return os.path.join(self.directory, 'styles', name)
+
+    def publish_stylesheet(self, css):
+        """
+        :param css: Stylesheet shared by charts
+        :return: URL of the stylesheet, named after its content
+        """
+        name = f'chart-{content_hash(css)}.css'
+        path = self.stylesheet_path(name)
+        if not os.path.exists(path):
+            PageCache.write_atomic(path, css)
+        return reverse('motogp:chart_stylesheet', args=[name])
+
+    def stylesheet(self, name):
+        """
+        :param name: File name of the stylesheet
+        :return: Stylesheet content, None if there is none by that name
+        """
+        if not stylesheet_name.fullmatch(name):
+            return None
+        try:
+            with open(self.stylesheet_path(name), 'rb') as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def get(self, key):
+        """
+        :param key: Chart key
+        :return: Rendered chart, gzipped, or None on a miss
+        """
+        with self.lock:
+            chart = self.memory.get(key)
+            if chart is not None:
+                self.memory.move_to_end(key)
+                return chart
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as file:
+                chart = file.read()
+            # Track use for eviction
+            os.utime(path)
+        except OSError:
+            return None
+        self.remember(key, chart)
+        return chart
+
+    def set(self, key, chart):
+        """
+        Store a rendered chart in both tiers.
+
+        :param key: Chart key
+        :param chart: Rendered chart
+        """
+        self.remember(key, chart)
+        PageCache.write_atomic(self.path(key), chart)
+        with self.lock:
+            if self.disk_used is None:
+                self.disk_used = self.measure()
+            else:
+                self.disk_used += len(chart)
+            over = self.max_size is not None and self.disk_used > self.max_size
+        if over:
+            self.evict()
+
+    def remember(self, key, chart):
+        """ Keep a chart in memory, dropping the least recently used ones past memory_size """
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return
+            self.memory[key] = chart
+            self.memory_used += len(chart)
+            while self.memory_size is not None and self.memory_used > self.memory_size and len(self.memory) > 1:
+                _, dropped = self.memory.popitem(last=False)
+                self.memory_used -= len(dropped)
+
+    def stored(self):
+        """
+        :return: List of (last use, size, path) of the charts on disk
+        """
+        charts = []
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.svg.gz'):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    charts.append((stat.st_mtime, stat.st_size, path))
+        return charts
+
+    def measure(self):
+        """
+        :return: Total size in bytes of the charts on disk
+        """
+        return sum(size for _, size, _ in self.stored())
+
+    def evict(self):
+        """
+        Remove least recently used charts from disk until the tier fits in max_size.
+
+        :return: Number of charts removed
+        """
+        if self.max_size is None:
+            return 0
+        with self.lock:
+            charts = self.stored()
+            total = sum(size for _, size, _ in charts)
+            removed = 0
+            for _, size, path in sorted(charts):
+                if total <= self.max_size:
+                    break
+                os.remove(path)
+                total -= size
+                removed += 1
+            self.disk_used = total
+            return removed
@@ -1,5 +1,20 @@
+import os
 import pygal
 
+from collections import namedtuple
+from functools import lru_cache
+
+from django.conf import settings
+
+from .profiling import Profiler, profiler
+from .svg import optimize, static_stylesheet, style_block, write_hashed
+
+# Everything needed to render one chart file, picklable so it can be sent to worker processes
+ChartSpec = namedtuple('ChartSpec', ['path', 'data', 'options'])
+
+# Number of series styled by the stylesheet shared by charts, charts with more riders keep a stylesheet of their own
+shared_series = 100
+
 
 def create_chart(data, high_score_first=False, style='compare'):
     """
@@ -20,7 +35,9 @@ def create_chart(data, high_score_first=False, style='compare'):
     """
     from pygal.style import DarkStyle
     custom_dark_style = DarkStyle(transition='50ms')
-    chart = pygal.Line(inverse_y_axis=high_score_first, style=custom_dark_style)
+    # Without per-chart prefixes, the stylesheet is the same for all charts and can be shared (see svg.optimize)
+    chart = pygal.Line(inverse_y_axis=high_score_first, style=custom_dark_style, no_prefix=True,
+                       js=[settings.CHART_TOOLTIPS_JS])
     chart.title = data['title']
     chart.x_labels = [col for col in data['columns']]
     # Rider name followed by point totals
@@ -31,6 +48,54 @@ def create_chart(data, high_score_first=False, style='compare'):
     return chart
 
 
+@lru_cache(maxsize=1)
+def shared_stylesheet():
+    """
+    Stylesheet of a chart of shared_series series: charts only differ by the number of series their stylesheet
+    styles, so it also styles every smaller chart. Series past the pygal palette get other shades than in a chart of
+    their own.
+
+    :return: Stylesheet content
+    """
+    data = {'title': '', 'columns': ['']}
+    data.update((f'{index}', [0]) for index in range(shared_series))
+    return b''.join(style_block.findall(create_chart(data)))
+
+
+def render_chart(spec, chart_profiler=profiler):
+    """
+    Render a chart, optimize it and write it under a content-hashed name next to its path, with precompressed copies
+
+    :param spec: ChartSpec of the chart, its options are passed to create_chart
+    :param chart_profiler: Profiler measuring the render and write phases
+
+    :return: File name of the written chart
+    """
+    directory = os.path.dirname(spec.path)
+    name = os.path.basename(spec.path)
+    with chart_profiler.phase('render', 'charts', name):
+        svg = optimize(create_chart(spec.data, **spec.options), static_stylesheet(directory), shared_stylesheet())
+    with chart_profiler.phase('write', 'charts', name):
+        return write_hashed(spec.path, svg)
+
+
+def profile_render_chart(spec):
+    """
+    render_chart measured by a profiler of its own, as worker processes cannot reach the profiler of the run
+
+    :param spec: ChartSpec of the chart
+
+    :return: (file name of the written chart, profiler report to merge)
+    """
+    chart_profiler = Profiler()
+    chart_profiler.start()
+    try:
+        name = render_chart(spec, chart_profiler)
+    finally:
+        chart_profiler.stop()
+    return name, chart_profiler.report()
+
+
 if __name__ == '__main__':
     import sys
     import os
@@ -0,0 +1,185 @@
+import json
+import os
+import shutil
+
+from collections import OrderedDict
+
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Result
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Columns of the dataset: name: (Result field, Arrow type). Season and category are the partitions, not columns.
+columns = OrderedDict([
+    ('result_id', ('pk', 'int64')),
+    ('event', ('session__event__event_location__location', 'string')),
+    ('session', ('session__session_type', 'string')),
+    ('session_id', ('session_id', 'int64')),
+    ('point_event', ('session__point_event', 'bool_')),
+    ('position', ('position', 'int32')),
+    ('points', ('points', 'int32')),
+    ('rider', ('rider__full_name', 'string')),
+    ('rider_id', ('rider_id', 'int64')),
+    ('rider_key', ('rider__normalized_key', 'string')),
+    ('nationality', ('rider__nationality', 'string')),
+    ('team', ('team__team_name', 'string')),
+    ('brand', ('brand__brand_name', 'string')),
+    ('top_speed', ('top_speed', 'string')),
+    ('speed_kmh', ('speed_kmh', 'float64')),
+    ('time', ('time', 'string')),
+    ('time_ms', ('time_ms', 'int64')),
+])
+# File extension of each format
+formats = {'parquet': 'parquet', 'arrow': 'arrow'}
+# Written in the export directory, along with the season=YYYY partition directories. Dataset readers skip files
+# starting with _ or .
+state_file = '_export_state.json'
+
+
+def read_state(directory):
+    """
+    :param directory: Export directory
+    :return: State of the last export, None if there is none
+    """
+    try:
+        with open(os.path.join(directory, state_file)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def write_state(directory, state):
+    temp_path = os.path.join(directory, '.' + state_file + '.tmp')
+    with open(temp_path, 'w') as file:
+        json.dump(state, file, indent=2)
+    os.replace(temp_path, os.path.join(directory, state_file))
+
+
+def partitions(after, until):
+    """
+    Sessions scraped again get new results, so the partitions holding results stored since the last export are the
+    ones whose content changed.
+
+    :param after: Results up to this id are already exported
+    :param until: Last result id exported
+    :return: List of (year, category) of the partitions to export, in order
+    """
+    return list(Result.objects.filter(pk__gt=after, pk__lte=until)
+                .values_list('session__event__season__year', 'session__category__class_name')
+                .distinct().order_by('session__event__season__year', 'session__category__class_name'))
+
+
+def result_batches(year, category, until, batch_size=50000):
+    """
+    Read the results of a partition in primary key order, one batch at a time: memory use does not depend on the size
+    of the database.
+
+    :param year: Season of the partition
+    :param category: Category of the partition
+    :param until: Last result id exported
+    :param batch_size: Number of rows per batch
+    :return: Generator of lists of rows, with one value per column
+    """
+    results = Result.objects.filter(session__event__season__year=year, session__category__class_name=category,
+                                    pk__lte=until).order_by('pk')
+    fields = [field for field, arrow_type in columns.values()]
+    last = 0
+    while True:
+        rows = list(results.filter(pk__gt=last).values_list(*fields)[:batch_size])
+        if not rows:
+            return
+        last = rows[-1][0]
+        yield rows
+
+
+def schema():
+    return pyarrow.schema([(name, getattr(pyarrow, arrow_type)()) for name, (field, arrow_type) in columns.items()])
+
+
+def partition_path(directory, year, category, export_format):
+    # Hive-style directories, read back with pyarrow.dataset.dataset(directory, partitioning='hive')
+    return os.path.join(directory, f'season={year}', f'category={category}', f'results.{formats[export_format]}')
+
+
+def write_partition(path, batches, export_format):
+    """
+    :param path: File receiving the partition, written under a temporary name until complete, then replacing any
+    previous file of the partition
+    :param batches: Batches of rows, see result_batches
+    :param export_format: parquet or arrow (IPC file format)
+    :return: Number of rows written
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + '.tmp')
+    arrow_schema = schema()
+    if export_format == 'parquet':
+        writer = pyarrow.parquet.ParquetWriter(temp_path, arrow_schema)
+        write = writer.write_table
+    else:
+        writer = pyarrow.ipc.new_file(temp_path, arrow_schema)
+        write = writer.write
+    count = 0
+    try:
+        for rows in batches:
+            arrays = [pyarrow.array(values, type=field.type) for values, field in zip(zip(*rows), arrow_schema)]
+            batch = pyarrow.RecordBatch.from_arrays(arrays, schema=arrow_schema)
+            write(pyarrow.Table.from_batches([batch]))
+            count += len(rows)
+    finally:
+        writer.close()
+    os.replace(temp_path, path)
+    for name in os.listdir(os.path.dirname(path)):
+        if not name.startswith('.') and name != os.path.basename(path):
+            os.remove(os.path.join(os.path.dirname(path), name))
+    return count
+
+
+def export_results(directory, export_format='parquet', full=False, batch_size=50000):
+    """
+    Export the results history as a denormalized columnar dataset, partitioned by season and category.
+
+    Unless full is set, only the partitions holding results stored since the last export are exported again, each
+    replacing its previous file: new sessions, sessions scraped again and restarted races are all picked up. Only
+    results removed without any replacement need a full export.
+
+    :param directory: Export directory
+    :param export_format: parquet or arrow (IPC file format)
+    :param full: Export everything again, replacing the previous export
+    :param batch_size: Number of rows read from the database at once
+    :return: (number of partitions written, number of rows written)
+    """
+    if pyarrow is None:
+        raise ImportError('Exporting results needs the pyarrow package')
+    if export_format not in formats:
+        raise ValueError(f'Unknown export format: {export_format}')
+
+    state = None if full else read_state(directory)
+    if state is not None and 'last_result' not in state:
+        # Written before result ids were tracked
+        state = None
+    if state is not None and state['format'] != export_format:
+        raise ValueError(f"The previous export is in the {state['format']} format, "
+                         "export everything again to change it")
+    if state is None and os.path.isdir(directory):
+        # Replace the previous export
+        for name in os.listdir(directory):
+            if name.startswith('season='):
+                shutil.rmtree(os.path.join(directory, name))
+    os.makedirs(directory, exist_ok=True)
+
+    after = state['last_result'] if state is not None else 0
+    until = Result.objects.aggregate(last=Max('pk'))['last'] or 0
+    written = rows = 0
+    for year, category in partitions(after, until):
+        rows += write_partition(partition_path(directory, year, category, export_format),
+                                result_batches(year, category, until, batch_size), export_format)
+        written += 1
+    write_state(directory, {'format': export_format, 'last_result': until, 'exported': timezone.now().isoformat()})
+    return written, rows
@@ -0,0 +1,244 @@
+import re
+
+from collections import namedtuple
+from html import unescape
+
+from django.conf import settings
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+# What results are built from: the event description, every table header and every table cell of a results page.
+# Cells are (text, blank) pairs, blank meaning the cell only holds a non-breaking space, which ends the results.
+ResultsPage = namedtuple('ResultsPage', ['event_info', 'headers', 'cells'])
+
+# Elements without content or end tag
+void_elements = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source',
+                 'track', 'wbr'}
+# Elements whose content is raw text, not markup: end tag of each
+raw_text_end = {tag: re.compile(f'</{tag}', re.I) for tag in ('script', 'style')}
+
+# Markup: comments, declarations and processing instructions, or tags with their end marker, name and attributes
+markup = re.compile(r'<!--.*?-->|<[!?][^>]*>|<(/?)([a-zA-Z][^\s/>]*)((?:[^>"\']|"[^"]*"|\'[^\']*\')*)>', re.S)
+attribute = re.compile(r'([^\s=/]+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+)))?')
+
+
+class StreamExtractor:
+    """
+    Single pass tokenizer keeping only the text of the elements results are built from, no tree is built.
+
+    Tags are found with one regular expression and attributes are only parsed for tags which may matter. Unclosed
+    elements are handled like BeautifulSoup does: an end tag closes every element opened since its start tag, and
+    elements are listed in the order they start.
+    """
+    def __init__(self, option_tag=None):
+        """
+        :param option_tag: Id of the menu element whose options are collected
+        """
+        self.option_tag = option_tag
+        self.options = []
+        self.event_info = None
+        self.headers = []
+        self.cells = []
+        # Open elements: [tag, (list, index) receiving the text or None, direct children, direct text]
+        self.stack = []
+        self.captures = []
+        self.menu_depth = None
+
+    @staticmethod
+    def parse_attributes(text):
+        attrs = {}
+        for match in attribute.finditer(text):
+            name, *values = match.groups()
+            attrs[name.lower()] = unescape(next((value for value in values if value is not None), ''))
+        return attrs
+
+    def feed(self, text):
+        """
+        :param text: Page source
+        """
+        position = 0
+        length = len(text)
+        while position < length:
+            match = markup.search(text, position)
+            end = match.start() if match else length
+            if end > position:
+                data = text[position:end]
+                self.handle_data(unescape(data) if '&' in data else data)
+            if match is None:
+                break
+            position = match.end()
+            closing, tag, attrs = match.groups()
+            if tag is None:
+                continue
+            tag = tag.lower()
+            if closing:
+                self.handle_endtag(tag)
+                continue
+            # Only the attributes used below are worth parsing
+            wanted = 'value' in attrs or 'id' in attrs or (tag not in ('td', 'th') and 'class' in attrs)
+            attrs_dict = self.parse_attributes(attrs) if wanted else {}
+            if attrs.endswith('/'):
+                self.handle_startendtag(tag, attrs_dict)
+                continue
+            self.handle_starttag(tag, attrs_dict)
+            if tag in raw_text_end:
+                raw_end = raw_text_end[tag].search(text, position)
+                end = raw_end.start() if raw_end else length
+                if end > position:
+                    self.handle_data(text[position:end])
+                position = end
+
+    def add_child(self, attrs):
+        if self.stack:
+            self.stack[-1][2] += 1
+        if self.menu_depth is not None and len(self.stack) == self.menu_depth + 1 and attrs.get('value') is not None:
+            self.options.append(attrs['value'])
+
+    def handle_starttag(self, tag, attrs):
+        self.add_child(attrs)
+        if tag in void_elements:
+            return
+
+        target = None
+        if tag == 'td':
+            target = (self.cells, len(self.cells))
+        elif tag == 'th':
+            target = (self.headers, len(self.headers))
+        elif self.event_info is None and 'padbot5' in (attrs.get('class') or '').split():
+            self.event_info = ''
+            target = (None, None)
+        if target is not None:
+            if target[0] is not None:
+                # Placeholder keeping document order, filled once the element ends
+                target[0].append(None)
+            self.captures.append([])
+        if self.option_tag is not None and self.menu_depth is None and attrs.get('id') == self.option_tag:
+            self.menu_depth = len(self.stack)
+        self.stack.append([tag, target, 0, []])
+
+    def handle_startendtag(self, tag, attrs):
+        self.add_child(attrs)
+
+    def handle_endtag(self, tag):
+        if not any(open_tag == tag for open_tag, *_ in self.stack):
+            return
+        while self.stack:
+            open_tag, target, children, direct_text = self.stack.pop()
+            if self.menu_depth is not None and len(self.stack) == self.menu_depth:
+                # Left the menu, later elements with the same id are ignored like find() does
+                self.option_tag = None
+                self.menu_depth = None
+            if target is not None:
+                text = ''.join(self.captures.pop())
+                elements, index = target
+                if elements is None:
+                    self.event_info = text
+                elif open_tag == 'td':
+                    elements[index] = (text, children == 1 and direct_text == ['\xa0'])
+                else:
+                    elements[index] = text
+            if open_tag == tag:
+                return
+
+    def handle_data(self, data):
+        if self.stack:
+            self.stack[-1][2] += 1
+            self.stack[-1][3].append(data)
+        for capture in self.captures:
+            capture.append(data)
+
+    def close(self):
+        # Elements left open at the end of the page
+        while self.stack:
+            self.handle_endtag(self.stack[0][0])
+
+
+class StreamBackend:
+    """ Targeted streaming tokenizer, standard library only """
+    name = 'stream'
+
+    @staticmethod
+    def options(text, tag):
+        parser = StreamExtractor(option_tag=tag)
+        parser.feed(text)
+        parser.close()
+        return parser.options
+
+    @staticmethod
+    def results(text):
+        parser = StreamExtractor()
+        parser.feed(text)
+        parser.close()
+        return ResultsPage(parser.event_info or '', parser.headers, parser.cells)
+
+
+class SoupBackend:
+    """ Full BeautifulSoup tree, the reference implementation """
+    name = 'bs4'
+
+    @staticmethod
+    def options(text, tag):
+        from bs4 import BeautifulSoup
+        s = BeautifulSoup(text, 'html.parser')
+
+        option_source = s.find(id=tag)
+        options = []
+        try:
+            for source in option_source.contents:
+                try:
+                    options.append(source['value'])
+                except (TypeError, KeyError):
+                    pass
+        except AttributeError:
+            pass
+        return options
+
+    @staticmethod
+    def results(text):
+        from bs4 import BeautifulSoup
+        s = BeautifulSoup(text, 'html.parser')
+
+        event_info = ''
+        try:
+            event_info = s.find(class_='padbot5').text
+        except AttributeError:
+            pass
+        return ResultsPage(event_info, [item.text for item in s.find_all('th')],
+                           [(item.text, item.contents == ['\xa0']) for item in s.find_all('td')])
+
+
+class LxmlBackend:
+    """ libxml2 HTML parser, needs the optional lxml package """
+    name = 'lxml'
+
+    @staticmethod
+    def options(text, tag):
+        menus = lxml.html.fromstring(text).xpath('//*[@id=$tag]', tag=tag)
+        if not menus:
+            return []
+        return [option.get('value') for option in menus[0] if option.get('value') is not None]
+
+    @staticmethod
+    def results(text):
+        root = lxml.html.fromstring(text)
+        event_info = root.xpath('//*[contains(concat(" ", normalize-space(@class), " "), " padbot5 ")]')
+        return ResultsPage(event_info[0].text_content() if event_info else '',
+                           [item.text_content() for item in root.iter('th')],
+                           [(item.text_content(), len(item) == 0 and item.text == '\xa0') for item in root.iter('td')])
+
+
+backends = {backend.name: backend for backend in (StreamBackend, SoupBackend, LxmlBackend)}
+
+
+def get_backend(name=None):
+    """
+    :param name: Name of the backend (default = SCRAPER_PARSER setting)
+    :return: Extraction backend
+    """
+    name = name or settings.SCRAPER_PARSER
+    if name == 'lxml' and lxml is None:
+        raise ImportError('The lxml parser backend needs the lxml package')
+    return backends[name]
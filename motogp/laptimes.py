@@ -0,0 +1,32 @@
+import re
+
+# [minutes'] seconds [.'] fraction, as in 1'31.234, 1'11'111 or 58.9
+lap_time_format = re.compile(r"^(?:(\d+)[':])?(\d+)[.'](\d+)$")
+
+
+def parse_lap_time(text):
+    """
+    Convert a scraped time to milliseconds.
+
+    :param text: Time as displayed in results, like 1'31.234
+    :return: Time in milliseconds, or None for gaps (+0.123), laps behind and anything unparseable
+    """
+    match = lap_time_format.match(text.strip())
+    if match is None:
+        return None
+    minutes, seconds, fraction = match.groups()
+    milliseconds = int(fraction[:3].ljust(3, '0'))
+    return (int(minutes or 0) * 60 + int(seconds)) * 1000 + milliseconds
+
+
+def parse_speed(text):
+    """
+    Convert a scraped top speed to a number.
+
+    :param text: Speed as displayed in results, like 341.2
+    :return: Speed in km/h, or None if unparseable
+    """
+    try:
+        return float(text.strip().replace(',', '.'))
+    except ValueError:
+        return None
@@ -0,0 +1,61 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from motogp.benchmark import benchmark_charts
+from motogp.synthetic import generate_history
+
+
+class Command(BaseCommand):
+    help = 'Measures the chart builders on a generated history, in a throwaway test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seasons", type=int, default=30,
+                            help="number of seasons generated",
+                            )
+        parser.add_argument("--events", type=int, default=18,
+                            help="number of events per season",
+                            )
+        parser.add_argument("--riders", type=int, default=30,
+                            help="number of riders per session",
+                            )
+        parser.add_argument("--render", action="store_true",
+                            help="also time rendering the charts",
+                            )
+        parser.add_argument("--store", action="store_true",
+                            help="build every chart from one in-memory results store",
+                            )
+        parser.add_argument("-o", "--output",
+                            help="save the measures to this JSON file",
+                            )
+
+    def handle(self, *args, **options):
+        # Never touch the real data: generate the history in a test database, removed at the end
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            start = time.perf_counter()
+            created = generate_history(seasons=options['seasons'], events=options['events'], riders=options['riders'])
+            self.stdout.write(f'Generated {created} results in {time.perf_counter() - start:.1f}s')
+            report = benchmark_charts(render=options['render'], store=options['store'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['store']:
+            self.stdout.write(f"Results store loaded in {next(iter(report.values()))['store_seconds']}s")
+        for name, measures in report.items():
+            line = (f"{name}: {measures['builds']} builds, {measures['ms_per_build']} ms each, "
+                    f"{measures['max_queries']} queries at most (budget {measures['query_budget']})")
+            if measures['render_seconds'] is not None:
+                line += f", {measures['charts']} charts rendered in {measures['render_seconds']}s"
+            self.stdout.write(line)
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2)
+
+        over = [name for name, measures in report.items() if measures['max_queries'] > measures['query_budget']]
+        if over:
+            raise CommandError('Query budget exceeded: ' + ', '.join(over))
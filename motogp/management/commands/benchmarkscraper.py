@@ -0,0 +1,54 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from motogp.benchmark import record_corpus, run_benchmark
+
+
+class Command(BaseCommand):
+    help = 'Measures parsing and ingestion throughput of the scraper on a page corpus, without network access'
+
+    def add_arguments(self, parser):
+        parser.add_argument("-n", "--repeat", type=int, default=10,
+                            help="number of passes over the corpus pages",
+                            )
+        parser.add_argument("-p", "--parser",
+                            help="extraction backend to measure: stream, bs4 or lxml (default = SCRAPER_PARSER)",
+                            )
+        parser.add_argument("--record", action="store_true",
+                            help="replace the synthetic corpus pages with the live ones from motogp.com before measuring",
+                            )
+        parser.add_argument("-o", "--output",
+                            help="save the measures to this JSON file, for use as a baseline",
+                            )
+        parser.add_argument("-b", "--baseline",
+                            help="fail if throughput is lower than in this JSON file, beyond the tolerance",
+                            )
+        parser.add_argument("--tolerance", type=float, default=0.2,
+                            help="accepted throughput loss against the baseline (default = 0.2)",
+                            )
+
+    def handle(self, *args, **options):
+        if options['record']:
+            self.stdout.write(f'Recorded {record_corpus()} pages')
+        report = run_benchmark(repeat=options['repeat'], parser=options['parser'])
+
+        parse, ingest = report['parse'], report['ingest']
+        self.stdout.write(f"Parse:  {parse['pages']} pages in {parse['seconds']}s, "
+                          f"{parse['pages_per_second']} pages/s, {parse['rows_per_second']} rows/s")
+        self.stdout.write(f"Ingest: {ingest['rows']} rows in {ingest['seconds']}s, {ingest['rows_per_second']} rows/s")
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2)
+
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)
+            regressions = [
+                f'{phase} {measure}: {report[phase][measure]} < {baseline[phase][measure]}'
+                for phase, measure in (('parse', 'pages_per_second'), ('ingest', 'rows_per_second'))
+                if report[phase][measure] < baseline[phase][measure] * (1 - options['tolerance'])
+            ]
+            if regressions:
+                raise CommandError('Throughput regression: ' + ', '.join(regressions))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from motogp.export import export_results, formats
+
+
+class Command(BaseCommand):
+    help = 'Exports the results history as a columnar dataset partitioned by season and category (needs pyarrow)'
+
+    def add_arguments(self, parser):
+        parser.add_argument("-o", "--output", default="export",
+                            help="export directory (default = export)",
+                            )
+        parser.add_argument("-f", "--format", choices=sorted(formats), default="parquet",
+                            help="file format: parquet or arrow (Arrow IPC files)",
+                            )
+        parser.add_argument("--full", action="store_true",
+                            help="export everything again instead of the sessions stored since the last export",
+                            )
+        parser.add_argument("-b", "--batch-size", type=int, default=50000,
+                            help="number of results read from the database at once",
+                            )
+
+    def handle(self, *args, **options):
+        try:
+            partitions, rows = export_results(options['output'], export_format=options['format'],
+                                              full=options['full'], batch_size=options['batch_size'])
+        except (ImportError, ValueError) as error:
+            raise CommandError(error)
+        self.stdout.write(f"Exported {rows} results in {partitions} partitions to {options['output']}")
@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 
+from motogp.profiling import profile_run
 from motogp.scraper import chart_data
 from motogp.models import MenuOptions
 
@@ -11,8 +12,22 @@ class Command(BaseCommand):
         parser.add_argument("-s", "--season", type=int,
                             help="force a specific season to begin parsing from",
                             )
+        parser.add_argument("-j", "--jobs", type=int, default=1,
+                            help="number of processes rendering charts",
+                            )
+        parser.add_argument("--profile", nargs="?", const="profile.json", metavar="REPORT",
+                            help="measure each phase of the run and write a JSON report (default = profile.json)",
+                            )
 
     def handle(self, *args, **options):
-        chart_data(start_year=options['season'])
-        m, c = MenuOptions.objects.get_or_create()  # Force update
-        m.save()
+        if options['profile']:
+            with profile_run(options['profile'], command='updatecharts',
+                             options={name: options[name] for name in ('season', 'jobs')}):
+                self.run(options)
+            self.stdout.write(f"Profile written to {options['profile']}")
+        else:
+            self.run(options)
+
+    def run(self, options):
+        chart_data(start_year=options['season'], jobs=options['jobs'], force=True)
+        MenuOptions.rebuild()
@@ -1,6 +1,24 @@
+from argparse import ArgumentTypeError
+
 from django.core.management.base import BaseCommand
 
-from motogp.scraper import scrape_data, chart_data
+from motogp.profiling import profile_run
+from motogp.scraper import scrape_data, chart_changed
+
+
+def positive(kind):
+    """
+    :param kind: Type of the argument, int or float
+    :return: Argument type only accepting values above 0
+    """
+    def parse(text):
+        value = kind(text)
+        if value <= 0:
+            raise ArgumentTypeError(f'{text} is not above 0')
+        return value
+    # Named in argparse errors about values which are not numbers
+    parse.__name__ = kind.__name__
+    return parse
 
 
 class Command(BaseCommand):
@@ -10,7 +28,38 @@ class Command(BaseCommand):
         parser.add_argument("-s", "--season", type=int,
                             help="force a specific season to begin parsing from",
                             )
+        parser.add_argument("-w", "--workers", type=positive(int), default=1,
+                            help="number of pages fetched and parsed concurrently",
+                            )
+        parser.add_argument("-r", "--rate", type=positive(float),
+                            help="maximum overall requests per second sent to motogp.com (default = 1)",
+                            )
+        parser.add_argument("--charts", action="store_true",
+                            help="also render the charts of changed events to static files "
+                                 "(by default they are rendered on first view)",
+                            )
+        parser.add_argument("-j", "--jobs", type=int, default=1,
+                            help="number of processes rendering charts with --charts",
+                            )
+        parser.add_argument("--replay", action="store_true",
+                            help="rebuild the database from the page cache only, without network access",
+                            )
+        parser.add_argument("--profile", nargs="?", const="profile.json", metavar="REPORT",
+                            help="measure each phase of the run and write a JSON report (default = profile.json)",
+                            )
 
     def handle(self, *args, **options):
-        scrape_data(start_season=options['season'])
-        chart_data(start_year=options['season'])
+        if options['profile']:
+            with profile_run(options['profile'], command='updatescrapeddata',
+                             options={name: options[name] for name in
+                                      ('season', 'workers', 'rate', 'charts', 'jobs', 'replay')}):
+                self.run(options)
+            self.stdout.write(f"Profile written to {options['profile']}")
+        else:
+            self.run(options)
+
+    def run(self, options):
+        scrape_data(start_season=options['season'], workers=options['workers'], rate=options['rate'],
+                    replay=options['replay'])
+        if options['charts']:
+            chart_changed(jobs=options['jobs'])
@@ -0,0 +1,112 @@
+from collections import OrderedDict
+
+# Riders whose practice times are good enough to go straight to Q2
+count_riders_skipping_Q1 = 10
+
+
+def session_order(year):
+    """
+    Sessions making up an event weekend, in running order.
+
+    :param year: Season of the event
+    :return: List of session types
+    """
+    if year < 2005:
+        return ['RAC']
+    elif 2006 <= year <= 2008:
+        return ['FP1', 'QP1', 'FP2', 'QP2', 'QP', 'WUP', 'RAC']
+    else:
+        return ['FP1', 'FP2', 'FP3', 'FP4', 'QP', 'Q1', 'Q2', 'WUP', 'RAC']
+
+
+class SessionMatrix:
+    """
+    Positions of every rider in each session of an event, for one category.
+
+    Plain data independent of any chart library: `positions[i][j]` is the position of `riders[i]` in session
+    `columns[j]`, or None if the rider has no position there.
+    """
+    def __init__(self, columns, riders, positions):
+        self.columns = columns
+        self.riders = riders
+        self.positions = positions
+
+    def __iter__(self):
+        return iter(zip(self.riders, self.positions))
+
+    def __len__(self):
+        return len(self.riders)
+
+    def as_chart_data(self, title):
+        """
+        :param title: Title of the chart
+        :return: Chart data as expected by create_chart
+        """
+        data = OrderedDict()
+        data['columns'] = self.columns
+        data['title'] = title
+        for rider, positions in self:
+            data[rider] = positions
+        return data
+
+    @classmethod
+    def build(cls, session_results, order):
+        """
+        Lay out the results of an event's sessions in a single pass.
+
+        Qualifying adjustments:
+        - Q1: riders racing in Q1 are placed after the fastest practice riders, who are ranked by their best time in
+          FP1 to FP3
+        - Q2: riders missing from Q2 keep their Q1 position
+        - RAC: riders missing from the race are placed at the bottom, in order of appearance
+
+        Riders are sorted by their position in the last session. Riders without a position there are left out.
+
+        :param session_results: Dictionary of session type: list of (rider, position, time in ms) in finishing order
+        :param order: Running order of the session types, see session_order
+        :return: SessionMatrix
+        """
+        columns = [session_type for session_type in order if session_type in session_results]
+        rows = OrderedDict()
+        best_times = {}
+        for col, session_type in enumerate(columns):
+            last_position = -100
+            for rider, position, time in session_results[session_type]:
+                row = rows.get(rider)
+                if row is None:
+                    # Rider missed previous sessions
+                    row = rows[rider] = [None] * len(columns)
+
+                # Store time of first 3 sessions for Q1/Q2
+                if session_type in ('FP1', 'FP2', 'FP3') and time is not None:
+                    if rider not in best_times or time < best_times[rider]:
+                        best_times[rider] = time
+
+                row[col] = position
+                if session_type == 'Q1':  # Make room for rider times good enough to skip Q1
+                    row[col] += count_riders_skipping_Q1
+                last_position = max(last_position, row[col])
+
+            # Session specific adjustments
+            if session_type == 'Q1':
+                fastest = sorted(best_times, key=best_times.get)[:count_riders_skipping_Q1]
+                for position, rider in enumerate(fastest, start=1):
+                    rows[rider][col] = position
+            elif session_type == 'Q2' and col > 0:
+                for row in rows.values():
+                    if row[col] is None:
+                        row[col] = row[col - 1]
+            elif session_type == 'RAC':
+                for row in rows.values():
+                    if row[col] is None:
+                        last_position += 1
+                        row[col] = last_position
+
+        # Sort by most recent rider result (for display reasons)
+        by_latest_pos = {row[-1]: rider for rider, row in rows.items() if row and row[-1] is not None}
+        riders = []
+        pos = 1
+        while pos in by_latest_pos:
+            riders.append(by_latest_pos[pos])
+            pos += 1
+        return cls(columns, riders, [rows[rider] for rider in riders])
@@ -0,0 +1,320 @@
+import copy
+import os
+import threading
+import time
+import uuid
+
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import Http404, HttpResponse
+
+from .cache import state_cache
+
+# Upper bounds of the histogram buckets, +Inf is implied
+duration_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+query_buckets = (0, 1, 2, 5, 10, 25, 50, 100)
+
+# Processes serving views: instance id: time of their last flush. Each stores its own cumulative measures and
+# counters under views_key + instance id
+instances_key = 'motogp:metrics:instances'
+views_key = 'motogp:metrics:views:'
+# Measures of the processes which stopped flushing, see retire_instances
+retired_key = 'motogp:metrics:retired'
+# Totals of the update jobs, which run in their own processes
+jobs_key = 'motogp:metrics:jobs'
+
+# Counters published by the update jobs, and by the views for charts: name: help
+counters = OrderedDict([
+    ('pages_fetched', 'Pages downloaded from motogp.com'),
+    ('not_modified', 'Conditional requests answered 304 Not Modified'),
+    ('rows_ingested', 'Result rows stored'),
+    ('charts_rendered', 'Charts rendered, to static files by the update jobs or on demand by the views'),
+])
+
+
+def new_histogram(buckets):
+    # Count of each bucket (not cumulative), +Inf last
+    return {'buckets': [0] * (len(buckets) + 1), 'sum': 0, 'count': 0}
+
+
+def observe(histogram, buckets, value):
+    index = next((index for index, bound in enumerate(buckets) if value <= bound), len(buckets))
+    histogram['buckets'][index] += 1
+    histogram['sum'] += value
+    histogram['count'] += 1
+
+
+def add_histogram(total, histogram, sign=1):
+    total['buckets'] = [a + sign * b for a, b in zip(total['buckets'], histogram['buckets'])]
+    total['sum'] += sign * histogram['sum']
+    total['count'] += sign * histogram['count']
+
+
+def new_measures():
+    return {'views': {}, 'counters': {}}
+
+
+def add_measures(total, measures, sign=1):
+    """
+    :param total: Measures of processes, receiving measures
+    :param measures: Measures of a process: views (view: histograms) and counters (name: value)
+    :param sign: -1 to subtract measures instead
+    """
+    for view, entry in measures['views'].items():
+        histograms = total['views'].setdefault(view, {'duration': new_histogram(duration_buckets),
+                                                      'queries': new_histogram(query_buckets)})
+        add_histogram(histograms['duration'], entry['duration'], sign)
+        add_histogram(histograms['queries'], entry['queries'], sign)
+    for name, value in measures['counters'].items():
+        total['counters'][name] = total['counters'].get(name, 0) + sign * value
+
+
+def instance_id():
+    # Process ids are reused, the random part keeps the measures of a restarted worker apart
+    return f'{os.getpid()}-{uuid.uuid4().hex[:12]}'
+
+
+class ViewMetrics:
+    """
+    Latency and query count histograms of the views served by this process, and the counters they increment.
+
+    Measures are cumulative and flushed to the state cache at most every METRICS_FLUSH_INTERVAL seconds, under a key
+    of their own: processes never write each other's measures, and the metrics view sums those of every process.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.instance = instance_id()
+        self.measures = new_measures()
+        # Measures as of the last flush
+        self.flushed_measures = None
+        self.flushed = 0
+
+    def observe(self, view, seconds, queries):
+        """
+        :param view: Name of the view function
+        :param seconds: Time taken to answer
+        :param queries: Number of database queries sent
+        """
+        with self.lock:
+            views = self.measures['views']
+            entry = views.get(view)
+            if entry is None:
+                entry = views[view] = {'duration': new_histogram(duration_buckets),
+                                       'queries': new_histogram(query_buckets)}
+            observe(entry['duration'], duration_buckets, seconds)
+            observe(entry['queries'], query_buckets, queries)
+
+    def count(self, name, amount=1):
+        """
+        :param name: Counter, one of counters
+        :param amount: Increment
+        """
+        with self.lock:
+            self.measures['counters'][name] = self.measures['counters'].get(name, 0) + amount
+
+    def flush(self, force=False):
+        """
+        :param force: Flush even if the last flush is recent
+        """
+        now = time.monotonic()
+        if not force and now - self.flushed < settings.METRICS_FLUSH_INTERVAL:
+            return
+        self.flushed = now
+        cache = state_cache()
+        with self.lock:
+            if self.flushed_measures is not None and cache.get(views_key + self.instance) is None:
+                # Retired while idle: the measures flushed so far were merged into the retired ones, the rest carry
+                # on under a new id
+                add_measures(self.measures, self.flushed_measures, sign=-1)
+                self.instance = instance_id()
+            measures = copy.deepcopy(self.measures)
+            self.flushed_measures = copy.deepcopy(measures)
+        cache.set(views_key + self.instance, measures, timeout=None)
+        # Written on every flush: an instance lost to a concurrent registration is added back on the next one
+        instances = cache.get(instances_key) or {}
+        instances[self.instance] = time.time()
+        cache.set(instances_key, instances, timeout=None)
+
+
+view_metrics = ViewMetrics()
+
+# Counts of the job running in this process, published to the cache when it ends
+job_counts = Counter()
+job_lock = threading.Lock()
+
+
+def count(name, amount=1):
+    """
+    :param name: Counter, one of counters
+    :param amount: Increment
+    """
+    with job_lock:
+        job_counts[name] += amount
+
+
+@contextmanager
+def job(name):
+    """
+    Publish the counts of the enclosed job when it ends, recording it as failed if it raises.
+
+    :param name: Name of the job
+    """
+    started = time.time()
+    success = False
+    try:
+        yield
+        success = True
+    finally:
+        publish_job(name, started, success)
+
+
+def publish_job(job, started, success):
+    """
+    Add the counts of a finished job to the totals kept in the state cache.
+
+    :param job: Name of the job
+    :param started: Start time of the job, as returned by time.time()
+    :param success: Whether the job completed
+    """
+    with job_lock:
+        counts = dict(job_counts)
+        job_counts.clear()
+    if not settings.METRICS_ENABLED:
+        return
+
+    cache = state_cache()
+    totals = cache.get(jobs_key) or {'counters': {}, 'jobs': {}}
+    for name, value in counts.items():
+        totals['counters'][name] = totals['counters'].get(name, 0) + value
+    runs = totals['jobs'].setdefault(job, {'runs': 0, 'failures': 0, 'last_success': None, 'last_duration': None})
+    runs['runs'] += 1
+    if success:
+        runs['last_success'] = time.time()
+        runs['last_duration'] = runs['last_success'] - started
+    else:
+        runs['failures'] += 1
+    cache.set(jobs_key, totals, timeout=None)
+
+
+class MetricsMiddleware:
+    """
+    Measure the latency and database queries of each request answered by a motogp.views function.
+
+    Requests are timed from this middleware down: keep it first in MIDDLEWARE to measure the whole request.
+    """
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = [0]
+
+        def count_query(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        with connection.execute_wrapper(count_query):
+            response = self.get_response(request)
+        view = getattr(request, 'metrics_view', None)
+        if view is not None:
+            view_metrics.observe(view, time.perf_counter() - start, queries[0])
+            view_metrics.flush()
+        return response
+
+    @staticmethod
+    def process_view(request, view_func, view_args, view_kwargs):
+        if view_func.__module__ == 'motogp.views':
+            request.metrics_view = view_func.__name__
+
+
+def histogram_lines(name, labels, histogram, buckets):
+    lines = []
+    cumulative = 0
+    for bound, value in zip(list(buckets) + ['+Inf'], histogram['buckets']):
+        cumulative += value
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_sum{{{labels}}} {histogram["sum"]}')
+    lines.append(f'{name}_count{{{labels}}} {histogram["count"]}')
+    return lines
+
+
+def retire_instances(instances):
+    """
+    Merge the measures of the processes which did not flush for METRICS_INSTANCE_TTL seconds, stopped or restarted,
+    into the retired measures: totals never go down, and only live processes are read on each scrape.
+
+    :param instances: Registry of instances, see instances_key
+    :return: Registry of the live instances
+    """
+    cache = state_cache()
+    limit = time.time() - settings.METRICS_INSTANCE_TTL
+    stale = [views_key + instance for instance, flushed in instances.items() if flushed < limit]
+    if not stale:
+        return instances
+    retired = cache.get(retired_key) or new_measures()
+    for measures in cache.get_many(stale).values():
+        add_measures(retired, measures)
+    cache.set(retired_key, retired, timeout=None)
+    cache.delete_many(stale)
+    live = {instance: flushed for instance, flushed in instances.items() if flushed >= limit}
+    cache.set(instances_key, live, timeout=None)
+    return live
+
+
+def collect():
+    """
+    :return: Metrics of every process, in the Prometheus text format
+    """
+    cache = state_cache()
+    instances = retire_instances(cache.get(instances_key) or {})
+    total = new_measures()
+    add_measures(total, cache.get(retired_key) or new_measures())
+    for measures in cache.get_many([views_key + instance for instance in instances]).values():
+        add_measures(total, measures)
+    views = total['views']
+
+    lines = [
+        '# HELP motogp_view_duration_seconds Time taken to answer requests, per view',
+        '# TYPE motogp_view_duration_seconds histogram',
+    ]
+    for view in sorted(views):
+        lines += histogram_lines('motogp_view_duration_seconds', f'view="{view}"', views[view]['duration'],
+                                 duration_buckets)
+    lines += [
+        '# HELP motogp_view_queries Database queries sent per request, per view',
+        '# TYPE motogp_view_queries histogram',
+    ]
+    for view in sorted(views):
+        lines += histogram_lines('motogp_view_queries', f'view="{view}"', views[view]['queries'], query_buckets)
+
+    totals = cache.get(jobs_key) or {'counters': {}, 'jobs': {}}
+    for name, description in counters.items():
+        lines += [
+            f'# HELP motogp_{name}_total {description}',
+            f'# TYPE motogp_{name}_total counter',
+            f'motogp_{name}_total {totals["counters"].get(name, 0) + total["counters"].get(name, 0)}',
+        ]
+    jobs = sorted(totals['jobs'].items())
+    for metric, kind, description, field in (
+            ('motogp_job_runs_total', 'counter', 'Update job runs', 'runs'),
+            ('motogp_job_failures_total', 'counter', 'Update job runs which did not complete', 'failures'),
+            ('motogp_job_last_success_timestamp_seconds', 'gauge', 'End of the last successful run', 'last_success'),
+            ('motogp_job_last_duration_seconds', 'gauge', 'Duration of the last successful run', 'last_duration')):
+        lines += [f'# HELP {metric} {description}', f'# TYPE {metric} {kind}']
+        lines += [f'{metric}{{job="{job}"}} {runs[field]}' for job, runs in jobs if runs[field] is not None]
+    return '\n'.join(lines) + '\n'
+
+
+def metrics(request):
+    """ Metrics endpoint, only answering the addresses in METRICS_ALLOWED_IPS """
+    if not settings.METRICS_ENABLED or request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        raise Http404
+    # Include the latest measures of this process
+    view_metrics.flush(force=True)
+    return HttpResponse(collect(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,23 @@
+# Generated by Django 2.0.4 on 2026-10-18 11:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('motogp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PageValidator',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.CharField(max_length=200, unique=True)),
+                ('etag', models.CharField(blank=True, default='', max_length=200)),
+                ('last_modified', models.CharField(blank=True, default='', max_length=50)),
+                ('options', models.TextField(blank=True, default='')),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.0.4 on 2026-10-18 12:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('motogp', '0002_pagevalidator'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChartFingerprint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('digest', models.CharField(max_length=40)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChangedEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('race_changed', models.BooleanField(default=False)),
+                ('event', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='motogp.Event')),
+            ],
+        ),
+    ]
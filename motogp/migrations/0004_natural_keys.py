@@ -0,0 +1,132 @@
+from django.db import migrations, models
+
+
+def merge_duplicates(apps, model_name, fields):
+    """
+    Point every reference to a duplicated row at its oldest copy, then delete the other copies.
+    """
+    model = apps.get_model('motogp', model_name)
+    kept = {}
+    duplicates = {}
+    for row in model.objects.order_by('pk').values('pk', *fields):
+        key = tuple(row[field] for field in fields)
+        if key in kept:
+            duplicates[row['pk']] = kept[key]
+        else:
+            kept[key] = row['pk']
+    if not duplicates:
+        return
+
+    # Many to many links, from either side
+    links = [(field.remote_field.through, field.m2m_field_name(), field.m2m_reverse_field_name())
+             for field in model._meta.many_to_many]
+    links += [(rel.through, rel.field.m2m_reverse_field_name(), rel.field.m2m_field_name())
+              for rel in model._meta.related_objects if rel.many_to_many]
+    for through, own_field, other_field in links:
+        for duplicate, original in duplicates.items():
+            linked = set(through.objects.filter(**{own_field: original}).values_list(other_field, flat=True))
+            for link in through.objects.filter(**{own_field: duplicate}):
+                if getattr(link, f'{other_field}_id') in linked:
+                    link.delete()
+                else:
+                    setattr(link, f'{own_field}_id', original)
+                    link.save()
+
+    # Foreign keys
+    for rel in model._meta.related_objects:
+        if rel.many_to_many:
+            continue
+        related = rel.related_model.objects
+        for duplicate, original in duplicates.items():
+            if rel.one_to_one and related.filter(**{rel.field.name: original}).exists():
+                related.filter(**{rel.field.name: duplicate}).delete()
+            else:
+                related.filter(**{rel.field.name: duplicate}).update(**{rel.field.name: original})
+
+    model.objects.filter(pk__in=duplicates).delete()
+
+
+def delete_duplicates(apps, model_name, fields):
+    """
+    Keep only the most recent copy of duplicated rows, older copies come from previous scrapes.
+    """
+    model = apps.get_model('motogp', model_name)
+    seen = set()
+    stale = []
+    for row in model.objects.order_by('-pk').values('pk', *fields):
+        key = tuple(row[field] for field in fields)
+        if key in seen:
+            stale.append(row['pk'])
+        else:
+            seen.add(key)
+    for start in range(0, len(stale), 500):
+        model.objects.filter(pk__in=stale[start:start + 500]).delete()
+
+
+def remove_duplicates(apps, schema_editor):
+    merge_duplicates(apps, 'Season', ['year'])
+    merge_duplicates(apps, 'EventLocation', ['location'])
+    merge_duplicates(apps, 'Category', ['class_name'])
+    merge_duplicates(apps, 'Team', ['team_name'])
+    merge_duplicates(apps, 'Brand', ['brand_name'])
+    merge_duplicates(apps, 'Rider', ['full_name', 'last_name', 'first_name', 'nationality'])
+    # Depend on the merges above
+    merge_duplicates(apps, 'Event', ['event_location_id', 'season_id'])
+    delete_duplicates(apps, 'Session', ['event_id', 'category_id', 'session_type'])
+    delete_duplicates(apps, 'Result', ['session_id', 'position'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('motogp', '0003_changedevent_chartfingerprint'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='brand',
+            name='brand_name',
+            field=models.CharField(max_length=50, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='class_name',
+            field=models.CharField(max_length=50, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='eventlocation',
+            name='location',
+            field=models.CharField(max_length=50, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='season',
+            name='year',
+            field=models.IntegerField(unique=True),
+        ),
+        migrations.AlterField(
+            model_name='team',
+            name='team_name',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='event',
+            unique_together={('event_location', 'season')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='result',
+            unique_together={('session', 'position')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='rider',
+            unique_together={('full_name', 'last_name', 'first_name', 'nationality')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='session',
+            unique_together={('event', 'category', 'session_type')},
+        ),
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(fields=['point_event', 'event'], name='motogp_sess_point_e_46ef96_idx'),
+        ),
+    ]
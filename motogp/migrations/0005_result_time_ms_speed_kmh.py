@@ -0,0 +1,56 @@
+import re
+
+from django.db import migrations, models
+
+# Frozen copy of motogp.laptimes as of this migration, which must not change with it
+lap_time_format = re.compile(r"^(?:(\d+)[':])?(\d+)[.'](\d+)$")
+
+
+def parse_lap_time(text):
+    match = lap_time_format.match(text.strip())
+    if match is None:
+        return None
+    minutes, seconds, fraction = match.groups()
+    milliseconds = int(fraction[:3].ljust(3, '0'))
+    return (int(minutes or 0) * 60 + int(seconds)) * 1000 + milliseconds
+
+
+def parse_speed(text):
+    try:
+        return float(text.strip().replace(',', '.'))
+    except ValueError:
+        return None
+
+
+def parse_times(apps, schema_editor):
+    Result = apps.get_model('motogp', 'Result')
+    for pk, top_speed, time in Result.objects.values_list('pk', 'top_speed', 'time').iterator():
+        speed_kmh = parse_speed(top_speed)
+        time_ms = parse_lap_time(time)
+        if speed_kmh is not None or time_ms is not None:
+            Result.objects.filter(pk=pk).update(speed_kmh=speed_kmh, time_ms=time_ms)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('motogp', '0004_natural_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='result',
+            name='speed_kmh',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='result',
+            name='time_ms',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(parse_times, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='result',
+            index=models.Index(fields=['session', 'time_ms'], name='motogp_resu_session_f89e87_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations, models
+
+# Frozen copy of motogp.points.points_scales as of this migration, which must not change with it
+points_scales = [
+    (1993, (25, 20, 16, 13, 11, 10, 9, 8, 7, 6, 5, 4, 3, 2, 1)),
+    (1992, (20, 15, 12, 10, 8, 6, 4, 3, 2, 1)),
+    (1988, (20, 17, 15, 13, 11, 10, 9, 8, 7, 6, 5, 4, 3, 2, 1)),
+    (1969, (15, 12, 10, 8, 6, 5, 4, 3, 2, 1)),
+    (1950, (8, 6, 4, 3, 2, 1)),
+    (1949, (10, 8, 7, 6, 5)),
+]
+
+
+def score_races(apps, schema_editor):
+    Result = apps.get_model('motogp', 'Result')
+    last_season = None
+    for first_season, scale in points_scales:
+        races = Result.objects.filter(session__point_event=True, session__event__season__year__gte=first_season)
+        if last_season is not None:
+            races = races.filter(session__event__season__year__lt=last_season)
+        for position, points in enumerate(scale, start=1):
+            races.filter(position=position).update(points=points)
+        last_season = first_season
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('motogp', '0005_result_time_ms_speed_kmh'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='result',
+            name='points',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(score_races, migrations.RunPython.noop),
+    ]
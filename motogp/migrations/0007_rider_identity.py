@@ -0,0 +1,102 @@
+import re
+import unicodedata
+
+from collections import defaultdict
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Frozen copy of motogp.riders as of this migration, which must not change with it
+name_particles = {'Jr', 'Jr.'}
+separators = re.compile(r'[\W_]+')
+
+
+def normalize_name(name):
+    decomposed = unicodedata.normalize('NFKD', name)
+    letters = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return separators.sub(' ', letters.casefold()).strip()
+
+
+def split_name(name):
+    words = name.split()
+    start = len(words)
+    while start > 1 and (words[start - 1] in name_particles or is_upper(words[start - 1])):
+        start -= 1
+    if start == len(words) or not is_upper(words[start]):
+        return None
+    return ' '.join(words[:start]).lower(), ' '.join(words[start:]).lower()
+
+
+def is_upper(word):
+    if word.startswith('Mc'):
+        word = word[2:]
+    return word.isupper()
+
+
+def identify_riders(apps, schema_editor):
+    """
+    Give riders their normalized key and merge the riders sharing one, created whenever the spelling or the nationality
+    of a name changed. Every name a rider was stored under becomes an alias of the oldest copy.
+    """
+    Rider = apps.get_model('motogp', 'Rider')
+    RiderAlias = apps.get_model('motogp', 'RiderAlias')
+    Result = apps.get_model('motogp', 'Result')
+
+    kept = {}
+    duplicates = defaultdict(list)
+    aliases = {}
+    for rider in Rider.objects.order_by('pk'):
+        key = normalize_name(rider.full_name)
+        if key in kept:
+            duplicates[kept[key]].append(rider.pk)
+        else:
+            kept[key] = rider.pk
+            rider.normalized_key = key
+            # First names used to be cut from the wrong place
+            names = split_name(rider.full_name)
+            if names is not None:
+                rider.first_name, rider.last_name = names
+            rider.save(update_fields=['normalized_key', 'first_name', 'last_name'])
+        aliases.setdefault(rider.full_name, kept[key])
+
+    for original, copies in duplicates.items():
+        for start in range(0, len(copies), 500):
+            Result.objects.filter(rider_id__in=copies[start:start + 500]).update(rider_id=original)
+            Rider.objects.filter(pk__in=copies[start:start + 500]).delete()
+    RiderAlias.objects.bulk_create([RiderAlias(name=name, rider_id=rider) for name, rider in aliases.items()],
+                                   batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('motogp', '0006_result_points'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='rider',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='rider',
+            name='normalized_key',
+            field=models.CharField(default='', max_length=100),
+            preserve_default=False,
+        ),
+        migrations.CreateModel(
+            name='RiderAlias',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('rider', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='aliases',
+                                            to='motogp.Rider')),
+            ],
+        ),
+        migrations.RunPython(identify_riders, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='rider',
+            name='normalized_key',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+    ]
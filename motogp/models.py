@@ -1,109 +1,127 @@
 import json
 
+from array import array
 from collections import OrderedDict
+from itertools import accumulate
 
 from django.db import models
 from django.conf import settings
 
-from motogp.charts import create_chart
+from motogp.charts import ChartSpec, render_chart
+from motogp.matrix import SessionMatrix, session_order
+from motogp.store import ResultsStore
 
 app_name = 'motogp'
 
 
+def charts_directory():
+    """
+    :return: Directory of the charts in static files
+    """
+    return settings.BASE_DIR + f"/{app_name}/static/{app_name}/charts"
+
+
+def chart_path(name):
+    """
+    :param name: Chart name, without extension
+    :return: Path of the chart in static files, before a content hash is added to its file name (see render_chart)
+    """
+    return charts_directory() + f"/{name}.svg"
+
+
+# Classes merged into the class that replaced them in event history charts
+replaced_classes = {
+    '500cc': 'MotoGP',
+    '250cc': 'Moto2',
+    '125cc': 'Moto3',
+}
+
+
 class Category(models.Model):
-    class_name = models.CharField(max_length=50)
+    class_name = models.CharField(max_length=50, unique=True)
 
     def __str__(self):
         return self.class_name
 
 
 class EventLocation(models.Model):
-    location = models.CharField(max_length=50)
+    location = models.CharField(max_length=50, unique=True)
 
     def __str__(self):
         return self.location
 
 
 class Season(models.Model):
-    year = models.IntegerField()
+    year = models.IntegerField(unique=True)
     categories = models.ManyToManyField(Category)
 
-    def create_season_chart(self):
-        modern_points = {
-            1: 25,
-            2: 20,
-            3: 16,
-            4: 13,
-            5: 11,
-            6: 10,
-            7: 9,
-            8: 8,
-            9: 7,
-            10: 6,
-            11: 5,
-            12: 4,
-            13: 3,
-            14: 2,
-            15: 1,
-        }
-        results = {cat.__str__(): {} for cat in self.categories.all()}
-        for cat in results:
-            results[cat]['title'] = f'{str(self.year)} {cat} Championship'
-            results[cat]['columns'] = []
-            for event in self.event_set.all():
-                try:
-                    if Category.objects.get(class_name=cat) in event.categories.all():
-                        results[cat]['columns'].append(event.__str__())
-                except Category.DoesNotExist:
-                    return
-        counts = {cat: 0 for cat in results}
-        for cat in results:
-            events = self.event_set.all()
-            for event in events:
-                try:
-                    session = Session.objects.get(point_event=True, category=Category.objects.get(class_name=cat), event=event)
-                except Session.DoesNotExist:
-                    continue
-
-                # Prepare slots for new score
-                for rider in results[cat]:
-                    if rider not in ['title', 'columns', ]:
-                        if len(results[cat][rider]) > 1:
-                            results[cat][rider].append(results[cat][rider][-1])
-                        else:
-                            results[cat][rider].append(0)
-
-                session_results = session.result_set.all()
-                for result in session_results:
-                    rider = result.rider.__str__()
-                    if rider not in results[cat]:
-                        # New rider: update old scores at 0
-                        results[cat][rider] = [0 for _ in range(counts[cat] + 1)]
-                    try:
-                        results[cat][rider][-1] = results[cat][rider][-2] + modern_points.get(result.position, 0)
-                    except IndexError:
-                        # First event
-                        results[cat][rider][-1] = modern_points.get(result.position, 0)
-
-                counts[cat] += 1
-
-                # Re-order by latest position for display reasons
-                title = results[cat].pop('title')
-                columns = results[cat].pop('columns')
-                # results are: (rider, [result1, result2]). This sorts by latest result
-                new_order = sorted(results[cat].items(), key=lambda x: x[-1][-1], reverse=True)
-                new_results = OrderedDict()
-                for rider, scores in new_order:
-                    new_results[rider] = scores
-                new_results['title'] = title
-                new_results['columns'] = columns
-                results[cat] = new_results
+    # Passed to create_chart
+    chart_options = {'style': 'aggregate'}
+
+    def season_chart_data(self, store=None):
+        """
+        Championship points of every rider after each round, per category.
+
+        Running totals are computed in a single pass over the season's races, laid out per round in arrays, and riders
+        are sorted once at the end.
+
+        :param store: ResultsStore holding the season (default = load this season only)
+        :return: Dictionary of category: chart data as expected by create_chart
+        """
+        if store is None:
+            store = ResultsStore.load(Session.objects.filter(event__season=self))
+        sessions = store.by_season.get(self.year, [])
+
+        # Events holding each category, in calendar order
+        event_categories = {(store.session_event[session], store.session_category[session],
+                             store.session_location[session]) for session in sessions}
+        columns = {}
+        for event_id, category_id, location_id in sorted(event_categories):
+            columns.setdefault(store.categories[category_id], []).append(store.locations[location_id])
+
+        # Rounds: events holding a race, in calendar order
+        races = sorted((store.session_event[session], session) for session in sessions
+                       if store.session_point_event[session])
+        rounds = {cat: OrderedDict() for cat in columns}
+        for event_id, session in races:
+            cat = store.categories[store.session_category[session]]
+            rounds[cat].setdefault(event_id, len(rounds[cat]))
+
+        # Championship total of each rider after each race they took part in
+        points = {cat: OrderedDict() for cat in columns}
+        labels = {}
+        running_totals = {}
+        for event_id, session in races:
+            cat = store.categories[store.session_category[session]]
+            for result in store.results(session):
+                rider_id = store.rider[result]
+                total = running_totals[cat, rider_id] = running_totals.get((cat, rider_id), 0) + store.points[result]
+                if rider_id not in points[cat]:
+                    points[cat][rider_id] = array('i', [-1]) * len(rounds[cat])
+                    labels[rider_id] = store.riders[rider_id]
+                points[cat][rider_id][rounds[cat][event_id]] = total
+
+        charts = {}
+        for cat in columns:
+            # Rounds a rider missed keep their previous total
+            totals = [(labels[rider_id], list(accumulate(round_totals, lambda total, new: new if new >= 0 else total)))
+                      for rider_id, round_totals in points[cat].items()]
+            totals = [(rider, [max(total, 0) for total in round_totals]) for rider, round_totals in totals]
+            # Latest total first, ties decided by the previous rounds, then by first appearance
+            totals.sort(key=lambda x: x[-1][::-1], reverse=True)
+            charts[cat] = OrderedDict(totals)
+            charts[cat]['title'] = f'{str(self.year)} {cat} Championship'
+            charts[cat]['columns'] = columns[cat]
+        return charts
+
+    def season_chart_specs(self, store=None):
+        return [ChartSpec(chart_path(f'{self.year}-{category}'), data, self.chart_options)
+                for category, data in self.season_chart_data(store).items()]
 
+    def create_season_chart(self):
         # Save in static files
-        for category in results:
-            chart = create_chart(results[category], style='aggregate')
-            with open(settings.BASE_DIR + f"/{app_name}/static/{app_name}/charts/{self.year}-{category}.svg", 'wb') as file:
-                file.write(chart)
+        for spec in self.season_chart_specs():
+            render_chart(spec)
 
     def __str__(self):
         return str(self.year)
@@ -117,20 +135,36 @@ class Rider(models.Model):
     last_name = models.CharField(max_length=50)
     first_name = models.CharField(max_length=50)
     nationality = models.CharField(max_length=50)
+    # Identity of the rider, see motogp.riders.normalize_name. Every scraped spelling of the name is a RiderAlias
+    normalized_key = models.CharField(max_length=100, unique=True)
+
+    def __str__(self):
+        return self.label(self.first_name, self.last_name)
+
+    @staticmethod
+    def label(first_name, last_name):
+        """ Short name shown in charts, like V. ROSSI """
+        return f'{first_name[0].upper()}. {last_name.upper()}'
+
+
+class RiderAlias(models.Model):
+    """ Name of a rider as scraped, mapped to the canonical rider """
+    name = models.CharField(max_length=100, unique=True)
+    rider = models.ForeignKey(Rider, on_delete=models.CASCADE, related_name='aliases')
 
     def __str__(self):
-        return f'{self.first_name[0].upper()}. {self.last_name.upper()}'
+        return self.name
 
 
 class Brand(models.Model):
-    brand_name = models.CharField(max_length=50)
+    brand_name = models.CharField(max_length=50, unique=True)
 
     def __str__(self):
         return self.brand_name
 
 
 class Team(models.Model):
-    team_name = models.CharField(max_length=100)
+    team_name = models.CharField(max_length=100, unique=True)
 
     def __str__(self):
         return self.team_name
@@ -141,174 +175,110 @@ class Event(models.Model):
     event_location = models.ForeignKey(EventLocation, on_delete=models.CASCADE)
     categories = models.ManyToManyField(Category)
 
-    def create_event_history_chart(self, season_count=5):
-        results = {}
-        result_counts = {}
-
-        motogp_present = False
-        moto2_present = False
-        moto3_present = False
-        for year in reversed(range(self.season.year - season_count, self.season.year + 1)):
-            try:
-                season = Season.objects.get(year=year)
-            except Season.DoesNotExist:
-                continue
-            try:
-                event = Event.objects.get(season=season, event_location=self.event_location)
-            except Event.DoesNotExist:
-                continue
-
-            categories = season.categories.all()
-            for category in categories:
-                try:
-                    session = Session.objects.get(category=category, event=event, point_event=True)
-                except Session.DoesNotExist:
-                    continue
-
-                cat = category.__str__()
-                if cat == 'MotoGP':
-                    motogp_present = True
-                elif cat == 'Moto2':
-                    moto2_present = True
-                elif cat == 'moto3':
-                    moto3_present = True
-                elif cat == '500cc' and motogp_present is True:
-                    cat = 'MotoGP'
-                elif cat == '250cc' and moto2_present is True:
-                    cat = 'Moto2'
-                elif cat == '125cc' and moto3_present is True:
-                    cat = 'Moto3'
-                if cat not in results:
-                    results[cat] = {'title': f'{event.event_location.__str__()} {cat} Results History', 'columns': []}
-                if cat not in result_counts:
-                    result_counts[cat] = 1
-                else:
-                    result_counts[cat] += 1
-
-                session_results = session.result_set.all()
-                if len(session_results) > 0:
-                    results[cat]['columns'] = [str(year)] + results[cat]['columns']
-                for result in session_results:
-                    rider = result.rider.__str__()
-
-                    if rider not in results[cat]:
-                        results[cat][rider] = [] + [None for _ in range(result_counts[cat] - 1)]
-
-                    results[cat][rider] = [result.position] + results[cat][rider]
-
-                for rider in results[cat]:
-                    if rider not in ['columns', 'title']:
-                        while len(results[cat][rider]) < result_counts[cat]:
-                            results[cat][rider] = [None] + results[cat][rider]
+    # Passed to create_chart, for both history charts: positions, lowest first
+    chart_options = {'high_score_first': True}
+
+    def event_history_chart_data(self, season_count=5, store=None):
+        """
+        Race positions of every rider at this event location over the last seasons, per category.
+
+        The races of the location for the period are found through the location index of the store, then laid out in
+        a riders x seasons position matrix. Older classes are merged with the class that replaced them when the latter
+        raced at the location during the period.
+
+        :param season_count: Number of seasons before this one to include
+        :param store: ResultsStore holding the period (default = load the races of the location for the period only)
+        :return: Dictionary of category: chart data as expected by create_chart
+        """
+        first_year = self.season.year - season_count
+        if store is None:
+            store = ResultsStore.load(Session.objects.filter(event__event_location_id=self.event_location_id,
+                                                             event__season__year__range=(first_year, self.season.year),
+                                                             point_event=True))
+        races = [session for session in store.by_location.get(self.event_location_id, [])
+                 if store.session_point_event[session]
+                 and first_year <= store.session_year[session] <= self.season.year]
+        races.sort(key=lambda session: (-store.session_year[session], store.session_category[session]))
+
+        # Most recent season first: riders are listed in order of their latest appearance
+        present = set()
+        positions = {}
+        for session in races:
+            year = store.session_year[session]
+            cat = store.categories[store.session_category[session]]
+            if cat in replaced_classes.values():
+                present.add(cat)
+            elif replaced_classes.get(cat) in present:
+                cat = replaced_classes[cat]
+            riders = positions.setdefault(cat, OrderedDict())
+            for result in store.results(session):
+                riders.setdefault(store.riders[store.rider[result]], {})[year] = store.position[result]
+
+        charts = {}
+        for cat, riders in positions.items():
+            years = sorted({year for rider_years in riders.values() for year in rider_years})
+            column = {year: index for index, year in enumerate(years)}
+            charts[cat] = OrderedDict()
+            charts[cat]['title'] = f'{self.event_location.__str__()} {cat} Results History'
+            charts[cat]['columns'] = [str(year) for year in years]
+            for rider, rider_years in riders.items():
+                row = [None] * len(years)
+                for year, position in rider_years.items():
+                    row[column[year]] = position
+                charts[cat][rider] = row
+        return charts
+
+    def event_history_chart_specs(self, season_count=5, store=None):
+        return [ChartSpec(chart_path(f'{self.__str__()}-{category}'), data, self.chart_options)
+                for category, data in self.event_history_chart_data(season_count, store).items()]
 
+    def create_event_history_chart(self, season_count=5):
         # Save in static files
-        for category in results:
-            chart = create_chart(results[category], high_score_first=True)
-            with open(settings.BASE_DIR + f"/{app_name}/static/{app_name}/charts/{self.__str__()}-{category}.svg", 'wb') as file:
-                file.write(chart)
+        for spec in self.event_history_chart_specs(season_count):
+            render_chart(spec)
+
+    def session_matrices(self, store=None):
+        """
+        Positions of every rider in each session of this event, per category.
+
+        :param store: ResultsStore holding the event (default = load this event only)
+        :return: Dictionary of category: SessionMatrix
+        """
+        if store is None:
+            store = ResultsStore.load(self.session_set.all())
+        session_results = OrderedDict()
+        for session in store.by_event.get(self.pk, []):
+            session_results.setdefault(store.categories[store.session_category[session]], {})[
+                store.session_type[session]] = [(store.riders[store.rider[result]], store.position[result],
+                                                 store.time(result)) for result in store.results(session)]
+
+        order = session_order(self.season.year)
+        return OrderedDict((cat, SessionMatrix.build(sessions, order)) for cat, sessions in session_results.items())
+
+    def session_history_chart_data(self, store=None):
+        """
+        :param store: ResultsStore holding the event (default = load this event only)
+        :return: Dictionary of category: chart data as expected by create_chart
+        """
+        return {cat: matrix.as_chart_data(f'{self.event_location.__str__()} {self.season.__str__()} {cat} Results')
+                for cat, matrix in self.session_matrices(store).items()}
+
+    def session_history_chart_specs(self, store=None):
+        return [ChartSpec(chart_path(f'{self.season.__str__()}-{self.__str__()}-{category}'), data, self.chart_options)
+                for category, data in self.session_history_chart_data(store).items()]
 
     def create_session_history_chart(self):
-        count_riders_skipping_Q1 = 10
-        results = {session.category.__str__(): OrderedDict() for session in self.session_set.all()}
-        for cat in results:
-            results[cat]['times'] = {}
-            results[cat]['title'] = f'{self.event_location.__str__()} {self.season.__str__()} {cat} Results'
-            results[cat]['columns'] = [session.session_type for session in self.session_set.all() if cat == session.category.__str__()]
-
-        if self.season.year < 2005:
-            session_order = ['RAC']
-        elif 2006 <= self.season.year <= 2008:
-            session_order = ['FP1', 'QP1', 'FP2', 'QP2', 'QP', 'WUP', 'RAC']
-        else:
-            session_order = ['FP1', 'FP2', 'FP3', 'FP4', 'QP', 'Q1', 'Q2', 'WUP', 'RAC']
-        counts = {cat: 0 for cat in results}
-        for cat in results:
-            for session in session_order:
-                try:
-                    s = Session.objects.get(event=self, session_type=session, category=Category.objects.get(class_name=cat))
-                    # Prepare slots for new score
-                    for rider in results[cat]:
-                        if rider not in ['title', 'columns', 'times']:
-                            results[cat][rider].append(None)
-
-                    # Store result
-                    last_position = -100
-                    session_results = s.result_set.all()
-                    for result in session_results:
-                        rider = result.rider.__str__()
-
-                        # Rider missed previous sessions: catch up results
-                        if rider not in results[cat]:
-                            results[cat][rider] = [None for _ in range(counts[cat] + 1)]
-
-                        # Store time of first 3 sessions for Q1/Q2
-                        if s.session_type in ('FP1', 'FP2', 'FP3'):
-                            if rider not in results[cat]['times'] or result.time < results[cat]['times'][rider]:
-                                results[cat]['times'][rider] = result.time
-
-                        if s.session_type == 'RAC' and len(results[cat]) < 4: # Old race only result
-                            results[cat][rider] = [result.position]
-
-                        results[cat][rider][-1] = result.position
-                        if s.session_type == 'Q1':  # Make room for rider times good enough to skip Q1
-                            results[cat][rider][-1] += count_riders_skipping_Q1
-                        last_position = max(last_position, results[cat][rider][-1])
-
-                    # Session specific adjustments
-                    if s.session_type == 'Q1':
-                        # Fastest riders get to skip Q1, their position is based on best lap times
-                        fastest_times = {}
-                        for rider in results[cat]['times']:
-                            lap_time = results[cat]['times'][rider]
-                            fastest_times[lap_time] = rider
-                        position = 1
-                        for lap_time in sorted(fastest_times.keys()):
-                            results[cat][fastest_times[lap_time]][-1] = position
-                            position += 1
-                            if position > count_riders_skipping_Q1:
-                                break
-                    elif s.session_type == 'Q2':
-                        # Give missing riders their previous results
-                        for rider in results[cat]:
-                            if rider not in ['title', 'columns', 'times'] and results[cat][rider][-1] is None:
-                                results[cat][rider][-1] = results[cat][rider][-2]
-                    elif s.session_type == 'RAC':
-                        # Place missing riders at bottom
-                        for rider in results[cat]:
-                            if rider not in ['title', 'columns', 'times']:
-                                if results[cat][rider][-1] is None:
-                                    results[cat][rider][-1] = last_position + 1
-                                    last_position += 1
-                    counts[cat] += 1
-                except Session.DoesNotExist:
-                    continue
-
-            # Re-sort results by most recent rider result (for display reasons)
-            new_order = OrderedDict()
-            del results[cat]['times']
-            new_order['columns'] = results[cat].pop('columns')
-            new_order['title'] = results[cat].pop('title')
-            by_latest_pos = {}
-            for rider in results[cat]:
-                if results[cat][rider][-1] is not None:
-                    by_latest_pos[results[cat][rider][-1]] = (rider, results[cat][rider])
-            pos = 1
-            while pos in by_latest_pos:
-                new_order[by_latest_pos[pos][0]] = by_latest_pos[pos][1]
-                pos += 1
-            results[cat] = new_order
-
         # Save in static files
-        for category in results:
-            chart = create_chart(results[category], high_score_first=True)
-            with open(settings.BASE_DIR + f"/{app_name}/static/{app_name}/charts/{self.season.__str__()}-{self.__str__()}-{category}.svg", 'wb') as file:
-                file.write(chart)
+        for spec in self.session_history_chart_specs():
+            render_chart(spec)
 
     def __str__(self):
         return f'{self.event_location.__str__()}'
 
     class Meta:
         get_latest_by = 'season'
+        # Location first: also serves event history lookups across seasons
+        unique_together = ('event_location', 'season')
 
 
 class Session(models.Model):
@@ -321,10 +291,42 @@ class Session(models.Model):
     def __str__(self):
         return f'{self.event}-{self.session_type}: race={self.point_event}'
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        m, c = MenuOptions.objects.get_or_create()  # Force update
-        m.save()
+    class Meta:
+        unique_together = ('event', 'category', 'session_type')
+        indexes = [
+            models.Index(fields=['point_event', 'event']),
+        ]
+
+
+class ResultQuerySet(models.QuerySet):
+
+    def timed(self):
+        """ Results with a lap time (race gaps have none) """
+        return self.filter(time_ms__isnull=False)
+
+    def fastest(self):
+        """ Results by lap time, fastest first """
+        return self.timed().order_by('time_ms')
+
+    def best_times(self):
+        """ Best lap time of each rider, fastest first: [{'rider': id, 'best_time_ms': time}, ..] """
+        return self.timed().values('rider').annotate(best_time_ms=models.Min('time_ms')).order_by('best_time_ms')
+
+    def races(self):
+        """ Results of point scoring sessions """
+        return self.filter(session__point_event=True)
+
+    def standings(self):
+        """
+        Championship table of the filtered results, leader first.
+
+        Filter by season and category first, e.g. Result.objects.filter(session__event__season=s,
+        session__category=c).standings()
+
+        :return: [{'rider': id, 'total_points': points}, ..]
+        """
+        return self.races().values('rider').annotate(total_points=models.Sum('points')).order_by('-total_points',
+                                                                                                 'rider')
 
 
 class Result(models.Model):
@@ -335,10 +337,23 @@ class Result(models.Model):
     session = models.ForeignKey(Session, on_delete=models.CASCADE)
     top_speed = models.CharField(max_length=10)
     time = models.CharField(max_length=20)
+    # Parsed from top_speed and time at ingest
+    speed_kmh = models.FloatField(null=True, blank=True)
+    time_ms = models.IntegerField(null=True, blank=True)
+    # Championship points, from the points scale of the season (see motogp.points)
+    points = models.IntegerField(default=0)
+
+    objects = ResultQuerySet.as_manager()
 
     def __str__(self):
         return f'{self.rider.__str__()} on {self.brand.__str__()}'
 
+    class Meta:
+        unique_together = ('session', 'position')
+        indexes = [
+            models.Index(fields=['session', 'time_ms']),
+        ]
+
 
 class UpdateData(models.Model):
     most_recent_scraped_season = models.IntegerField(default=1993)
@@ -347,45 +362,55 @@ class UpdateData(models.Model):
     most_recent_charted_event = models.CharField(max_length=10, default='')
 
 
-class MenuOptions(models.Model):
-    JSON_menu = models.CharField(max_length=2000)
+class ChangedEvent(models.Model):
+    """ Event with sessions scraped since its charts were last rendered """
+    event = models.OneToOneField(Event, on_delete=models.CASCADE)
+    race_changed = models.BooleanField(default=False)  # Race results feed the history and championship charts too
 
-    def save(self, *args, **kwargs):
-        menu_data = {
-            'season_data': {},
-            'event_data': {},
-        }
 
-        seasons = Season.objects.all()
-        for season in seasons:
-            year = season.__str__()
-            menu_data['season_data'][year] = {}
+class ChartFingerprint(models.Model):
+    """ Hash of the data a chart file was last rendered from """
+    name = models.CharField(max_length=100, unique=True)
+    digest = models.CharField(max_length=40)
 
-            events = Event.objects.filter(season=season)
-            for event in events:
-                loc = event.__str__()
-                menu_data['season_data'][year][loc] = {}
 
-                classes = event.categories.all()
-                for category in classes:
-                    cat = category.__str__()
-                    menu_data['season_data'][year][loc][cat] = True
+class PageValidator(models.Model):
+    """ Cache validators of a scraped page, used to send conditional requests on the next run """
+    url = models.CharField(max_length=200, unique=True)
+    etag = models.CharField(max_length=200, blank=True, default='')
+    last_modified = models.CharField(max_length=50, blank=True, default='')
+    options = models.TextField(blank=True, default='')  # JSON list of menu options found on the page, if any
 
-        locations = EventLocation.objects.all()
-        for location in locations:
-            loc = location.__str__()
-            menu_data['event_data'][loc] = {}
 
-            events = Event.objects.filter(event_location=location)
-            for event in events:
-                season = event.season.__str__()
-                menu_data['event_data'][loc][season] = {}
+class MenuOptions(models.Model):
+    JSON_menu = models.CharField(max_length=2000)
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Regenerate the navigation menu from the whole database.
 
-                categories = event.categories.all()
-                for category in categories:
-                    cat = category.__str__()
-                    menu_data['event_data'][loc][season][cat] = True
+        Not done on every insert: callers rebuild once after a batch of changes (see scrape_data).
 
-        self.JSON_menu = json.dumps(menu_data)
-        super().save(*args, **kwargs)
+        :return: The updated MenuOptions object
+        """
+        menu_data = {
+            'season_data': {str(year): {} for year in Season.objects.order_by('pk').values_list('year', flat=True)},
+            'event_data': {loc: {} for loc in EventLocation.objects.order_by('pk').values_list('location', flat=True)},
+        }
 
+        events = Event.objects.order_by('pk').values_list('season__year', 'event_location__location')
+        for year, loc in events:
+            menu_data['season_data'][str(year)][loc] = {}
+            menu_data['event_data'][loc][str(year)] = {}
+
+        event_categories = Event.categories.through.objects.order_by('event_id', 'category_id').values_list(
+            'event__season__year', 'event__event_location__location', 'category__class_name')
+        for year, loc, cat in event_categories:
+            menu_data['season_data'][str(year)][loc][cat] = True
+            menu_data['event_data'][loc][str(year)][cat] = True
+
+        menu, created = cls.objects.get_or_create()  # Safe: only one object
+        menu.JSON_menu = json.dumps(menu_data)
+        menu.save()
+        return menu
@@ -0,0 +1,116 @@
+import gzip
+import hashlib
+import os
+import threading
+import time
+
+
+class PageCache:
+    """
+    Compressed on-disk cache of scraped pages.
+
+    Page bodies are gzipped and stored under the sha1 of their content, so identical pages are only kept once. Each url
+    points to its body through a small reference file whose modification time gives the age of the entry.
+
+    Layout:
+    <directory>/urls/<ab>/<sha1 of url>      containing the sha1 of the body
+    <directory>/pages/<cd>/<sha1 of body>.gz
+    """
+    def __init__(self, directory, ttl=None, max_size=None):
+        """
+        :param directory: Root of the cache
+        :param ttl: Seconds after which an entry is no longer used for live scrapes (default = never expires)
+        :param max_size: Total size in bytes of stored bodies kept by evict() (default = unbounded)
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size
+        # Replay mode: serve everything from the cache, whatever its age, and never touch the network
+        self.offline = False
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def digest(data):
+        return hashlib.sha1(data).hexdigest()
+
+    def url_path(self, url):
+        key = self.digest(url.encode())
+        return os.path.join(self.directory, 'urls', key[:2], key)
+
+    def body_path(self, digest):
+        return os.path.join(self.directory, 'pages', digest[:2], digest + '.gz')
+
+    @staticmethod
+    def write_atomic(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Thread ids are only unique within a process: worker processes may write the same file
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, path)
+
+    def get(self, url, max_age=None):
+        """
+        Read a page from the cache.
+
+        :param url: Url of the page
+        :param max_age: Ignore entries older than this many seconds (default = any age)
+
+        :return: Page text, or None on a miss
+        """
+        ref = self.url_path(url)
+        try:
+            if max_age is not None and time.time() - os.path.getmtime(ref) > max_age:
+                return None
+            with open(ref) as file:
+                body = self.body_path(file.read().strip())
+            with gzip.open(body, 'rb') as file:
+                text = file.read().decode('utf-8')
+        except (OSError, EOFError):
+            return None
+        # Track use for eviction
+        os.utime(body)
+        return text
+
+    def set(self, url, text):
+        """
+        Store a page in the cache.
+
+        :param url: Url of the page
+        :param text: Page text
+        """
+        data = text.encode('utf-8')
+        digest = self.digest(data)
+        body = self.body_path(digest)
+        if os.path.exists(body):
+            os.utime(body)
+        else:
+            self.write_atomic(body, gzip.compress(data))
+        self.write_atomic(self.url_path(url), digest.encode())
+
+    def evict(self):
+        """
+        Remove least recently used bodies until the cache fits in max_size.
+
+        References to evicted bodies are left in place and simply miss on the next lookup.
+
+        :return: Number of bodies removed
+        """
+        if self.max_size is None:
+            return 0
+        with self.lock:
+            bodies = []
+            for root, dirs, files in os.walk(os.path.join(self.directory, 'pages')):
+                for name in files:
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    bodies.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in bodies)
+            removed = 0
+            for _, size, path in sorted(bodies):
+                if total <= self.max_size:
+                    break
+                os.remove(path)
+                total -= size
+                removed += 1
+            return removed
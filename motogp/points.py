@@ -0,0 +1,32 @@
+# Points scored for each finishing position in a race, by first season the scale applied, most recent first
+points_scales = [
+    (1993, (25, 20, 16, 13, 11, 10, 9, 8, 7, 6, 5, 4, 3, 2, 1)),
+    (1992, (20, 15, 12, 10, 8, 6, 4, 3, 2, 1)),
+    (1988, (20, 17, 15, 13, 11, 10, 9, 8, 7, 6, 5, 4, 3, 2, 1)),
+    (1969, (15, 12, 10, 8, 6, 5, 4, 3, 2, 1)),
+    (1950, (8, 6, 4, 3, 2, 1)),
+    (1949, (10, 8, 7, 6, 5)),
+]
+
+
+def points_scale(year):
+    """
+    :param year: Season
+    :return: Tuple of points for positions 1, 2, ..
+    """
+    for first_season, scale in points_scales:
+        if year >= first_season:
+            return scale
+    return ()
+
+
+def points_for(year, position):
+    """
+    :param year: Season
+    :param position: Finishing position in a race
+    :return: Championship points scored
+    """
+    scale = points_scale(year)
+    if 1 <= position <= len(scale):
+        return scale[position - 1]
+    return 0
@@ -0,0 +1,214 @@
+import json
+import threading
+import time
+import tracemalloc
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.db import connection
+
+phases = ('fetch', 'parse', 'insert', 'aggregate', 'render', 'write')
+# Breakdowns of the report: per url (fetch, parse, insert), per chart build (aggregate), per chart (render, write)
+breakdowns = ('urls', 'builds', 'charts')
+
+
+def new_measures():
+    return OrderedDict([
+        ('count', 0),
+        ('wall', 0.0),
+        ('cpu', 0.0),
+        ('queries', 0),
+        ('query_time', 0.0),
+        ('bytes', 0),
+        ('peak_memory', 0),
+    ])
+
+
+def add_measures(total, measures):
+    """
+    :param total: Measures receiving the sum
+    :param measures: Measures added, peak memory is the largest of both
+    """
+    for name, value in measures.items():
+        if name == 'peak_memory':
+            total[name] = max(total[name], value)
+        else:
+            total[name] += value
+
+
+class Profiler:
+    """
+    Wall time, CPU time, SQL queries, bytes downloaded and peak memory of each phase of a run.
+
+    Phases may run in several threads at once: CPU time is the time of the thread running the phase, SQL queries and
+    downloaded bytes are counted in the innermost phase of the thread sending them. Peak memory is the largest amount of
+    memory traced while the phase ran, above what was allocated when it started: it is process wide, so phases running
+    at the same time in other threads are included.
+
+    Until start() is called, phase() only yields, so measured code costs nothing outside of profiled runs.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        self.phases = OrderedDict((phase, new_measures()) for phase in phases)
+        # Queries sent outside of any phase
+        self.other = new_measures()
+        self.breakdowns = OrderedDict((breakdown, OrderedDict()) for breakdown in breakdowns)
+        self.wall = self.cpu = 0.0
+        self.peak_memory = 0
+        self.started_tracing = False
+
+    def start(self):
+        self.reset()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+        self.wall = time.perf_counter() - self.start_wall
+        self.cpu = time.process_time() - self.start_cpu
+        self.peak_memory = max(self.peak_memory, tracemalloc.get_traced_memory()[1])
+        if self.started_tracing:
+            tracemalloc.stop()
+
+    def stack(self):
+        """
+        :return: Measures of the phases running in the current thread, innermost last
+        """
+        try:
+            return self.local.stack
+        except AttributeError:
+            self.local.stack = []
+            return self.local.stack
+
+    def traced_peak(self):
+        """
+        :return: Peak of traced memory since the last call, restarting the measure (the peak of the whole run is kept)
+        """
+        peak = tracemalloc.get_traced_memory()[1]
+        with self.lock:
+            self.peak_memory = max(self.peak_memory, peak)
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        return peak
+
+    @contextmanager
+    def phase(self, name, breakdown=None, key=None):
+        """
+        Measure a block of code as part of a phase.
+
+        :param name: Phase, one of phases
+        :param breakdown: Breakdown also receiving the measures, one of breakdowns
+        :param key: Entry of the breakdown, such as an url or a chart name
+        """
+        if not self.enabled:
+            yield
+            return
+        measures = new_measures()
+        stack = self.stack()
+        stack.append(measures)
+        start_memory = tracemalloc.get_traced_memory()[0]
+        self.traced_peak()
+        start_wall = time.perf_counter()
+        start_cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            measures['count'] = 1
+            measures['wall'] = time.perf_counter() - start_wall
+            measures['cpu'] = time.thread_time() - start_cpu
+            measures['peak_memory'] = max(0, self.traced_peak() - start_memory)
+            stack.pop()
+            self.record(name, measures, breakdown, key)
+
+    def record(self, name, measures, breakdown=None, key=None):
+        with self.lock:
+            add_measures(self.phases[name], measures)
+            if breakdown is not None:
+                entry = self.breakdowns[breakdown].setdefault(key, OrderedDict())
+                add_measures(entry.setdefault(name, new_measures()), measures)
+
+    def add_bytes(self, count):
+        """
+        :param count: Bytes downloaded by the current phase of this thread
+        """
+        if self.enabled and self.stack():
+            self.stack()[-1]['bytes'] += count
+
+    def execute(self, execute, sql, params, many, context):
+        """
+        Database execute wrapper counting queries in the current phase of this thread, see connection.execute_wrapper
+        """
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            stack = self.stack()
+            if stack:
+                measures = stack[-1]
+            else:
+                measures = self.other
+            measures['queries'] += 1
+            measures['query_time'] += time.perf_counter() - start
+
+    def merge(self, report):
+        """
+        Add the measures of a report made in another process, such as a chart rendering worker.
+
+        :param report: Report returned by report()
+        """
+        with self.lock:
+            for name, measures in report['phases'].items():
+                add_measures(self.phases[name], measures)
+            for breakdown in breakdowns:
+                for key, entry in report[breakdown].items():
+                    for name, measures in entry.items():
+                        add_measures(self.breakdowns[breakdown].setdefault(key, OrderedDict())
+                                     .setdefault(name, new_measures()), measures)
+
+    def report(self, **info):
+        """
+        :param info: Description of the run, added to the report
+        :return: JSON-serializable dictionary of the measures
+        """
+        report = OrderedDict(info)
+        report['wall'] = self.wall
+        report['cpu'] = self.cpu
+        report['peak_memory'] = self.peak_memory
+        report['phases'] = self.phases
+        report['other'] = self.other
+        report.update(self.breakdowns)
+        return report
+
+
+# Profiler of the running command, enabled by profile_run
+profiler = Profiler()
+
+
+@contextmanager
+def profile_run(path, **info):
+    """
+    Profile the database queries and measured phases of the enclosed code, then write the report.
+
+    The report is written even if the run fails, with what was measured until then.
+
+    :param path: JSON file receiving the report
+    :param info: Description of the run, added to the report
+    """
+    profiler.start()
+    try:
+        with connection.execute_wrapper(profiler.execute):
+            yield profiler
+    finally:
+        profiler.stop()
+        with open(path, 'w') as file:
+            json.dump(profiler.report(**info), file, indent=2)
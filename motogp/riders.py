@@ -0,0 +1,44 @@
+import re
+import unicodedata
+
+from functools import lru_cache
+
+# Words of a last name which are not written in upper case
+name_particles = {'Jr', 'Jr.'}
+# Anything but letters and digits separates words in normalized names
+separators = re.compile(r'[\W_]+')
+
+
+@lru_cache(maxsize=4096)
+def normalize_name(name):
+    """
+    Identity of a rider whatever the way the name is written: case, accents, punctuation and spacing are ignored.
+
+    :param name: Full name as scraped, like Jorge MARTÍN
+    :return: Normalized key, like jorge martin
+    """
+    decomposed = unicodedata.normalize('NFKD', name)
+    letters = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return separators.sub(' ', letters.casefold()).strip()
+
+
+@lru_cache(maxsize=4096)
+def split_name(name):
+    """
+    :param name: Full name as scraped, last name in upper case, like Valentino ROSSI or Alex DE ANGELIS
+    :return: (first name, last name) in lower case, or None if the name cannot be split
+    """
+    words = name.split()
+    # The last name is made of the trailing upper case words (McWILLIAMS included)
+    start = len(words)
+    while start > 1 and (words[start - 1] in name_particles or is_upper(words[start - 1])):
+        start -= 1
+    if start == len(words) or not is_upper(words[start]):
+        return None
+    return ' '.join(words[:start]).lower(), ' '.join(words[start:]).lower()
+
+
+def is_upper(word):
+    if word.startswith('Mc'):
+        word = word[2:]
+    return word.isupper()
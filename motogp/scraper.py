@@ -1,57 +1,265 @@
+import hashlib
+import json
+import os
 import requests
+import threading
 import time
-import re
 
-from collections import OrderedDict
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-from bs4 import BeautifulSoup
+from django.db import IntegrityError, transaction
 from django.utils import timezone
 from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+from .cache import bump_data_version
+from .charts import profile_render_chart, render_chart
+from .models import Season, Result, Category, Brand, Team, Session, Event, EventLocation, UpdateData, Rider, \
+    RiderAlias, PageValidator, MenuOptions, ChangedEvent, ChartFingerprint, charts_directory
+from .laptimes import parse_lap_time, parse_speed
+from .points import points_for
+from .extract import get_backend
+from .page_cache import PageCache
+from .profiling import profiler
+from .riders import normalize_name, split_name
+from .store import ResultsStore
+from .svg import read_manifest, write_manifest
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting the overall request rate to the scraped host.
 
-from .models import Season, Result, Category, Brand, Team, Session, EventLocation, UpdateData, Rider
-
-
-def rate_limit(delayed_func, delay=1):
+    Tokens are refilled continuously at `rate` per second, up to `capacity`. Each request consumes one token and
+    blocks until one is available, so any number of workers share the same overall budget.
+    """
+    def __init__(self, rate=1.0, capacity=1):
+        self.lock = threading.Lock()
+        self.configure(rate, capacity)
+
+    def configure(self, rate=1.0, capacity=1):
+        """
+        Change the allowed request rate.
+
+        :param rate: Requests per second allowed on average, must be positive
+        :param capacity: Maximum burst size
+        """
+        if rate <= 0:
+            raise ValueError(f'Request rate must be positive, not {rate}')
+        with self.lock:
+            self.rate = float(rate)
+            self.capacity = capacity
+            self.tokens = 0.0
+            self.last_refill = time.monotonic()
+
+    def acquire(self):
+        """
+        Block until a token is available, then consume it.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# First season of the championship, where a full rebuild starts
+first_season = 1949
+# Results pages are found under <base_page><season>/<event>/<category>/<session>
+base_page = 'http://www.motogp.com/en/Results+Statistics/'
+
+# Shared by every scraping thread: one request per second to motogp.com unless configured otherwise
+request_bucket = TokenBucket()
+
+
+def rate_limit(delayed_func):
     """
     Delay function call
 
-    Simple decorator to delay a function call
+    Simple decorator waiting for a token from the shared request bucket before calling the function
 
     :param delayed_func: The function to delay
-    :param delay: Delay in seconds (default = 1)
 
     :return: Closure call for the delayed function
     """
     def wrapper(*args, **kwargs):
-        time.sleep(delay)
+        request_bucket.acquire()
         return delayed_func(*args, **kwargs)
 
     return wrapper
 
 
+class ValidatorStore:
+    """
+    In-memory view of the PageValidator table for the duration of a scrape.
+
+    Worker threads read and record validators here; only the calling thread of scrape_data writes them back to the
+    database, once the results they vouch for have been stored.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.validators = {}
+        self.dirty = set()
+
+    def load(self):
+        with self.lock:
+            self.validators = {v.url: v for v in PageValidator.objects.all()}
+            self.dirty = set()
+
+    def request_headers(self, url):
+        """
+        :return: Conditional request headers for a previously fetched url
+        """
+        headers = {}
+        validator = self.validators.get(url)
+        if validator is not None:
+            if validator.etag:
+                headers['If-None-Match'] = validator.etag
+            if validator.last_modified:
+                headers['If-Modified-Since'] = validator.last_modified
+        return headers
+
+    def record(self, url, page):
+        """
+        Store the validators sent with a page, if any.
+        """
+        etag = page.headers.get('ETag', '')
+        last_modified = page.headers.get('Last-Modified', '')
+        if not etag and not last_modified:
+            return
+        with self.lock:
+            validator = self.validators.setdefault(url, PageValidator(url=url))
+            validator.etag = etag
+            validator.last_modified = last_modified
+            self.dirty.add(url)
+
+    def get_options(self, url):
+        """
+        :return: Menu options stored with a page, or None if unknown
+        """
+        validator = self.validators.get(url)
+        if validator is None or not validator.options:
+            return None
+        return json.loads(validator.options)
+
+    def set_options(self, url, options):
+        with self.lock:
+            if url in self.validators:
+                self.validators[url].options = json.dumps(options)
+                self.dirty.add(url)
+
+    def flush(self):
+        """
+        Write changed validators to the database.
+        """
+        with self.lock:
+            changed = [self.validators[url] for url in self.dirty]
+            self.dirty = set()
+        if not changed:
+            return
+        with transaction.atomic():
+            PageValidator.objects.filter(url__in=[v.url for v in changed]).delete()
+            for validator in changed:
+                validator.pk = None
+            PageValidator.objects.bulk_create(changed)
+
+
+# Keep-alive connections shared by all scraping threads, see size_connection_pools
+http_session = requests.Session()
+
+
+def size_connection_pools(workers):
+    """
+    Keep one connection per scraping thread alive: smaller pools close and reopen connections, larger ones hold
+    sockets no thread uses.
+
+    :param workers: Number of threads fetching pages
+    """
+    for prefix in ('http://', 'https://'):
+        http_session.mount(prefix, HTTPAdapter(pool_connections=4, pool_maxsize=workers))
+
+
+size_connection_pools(1)
+
+validators = ValidatorStore()
+page_cache = PageCache(settings.SCRAPER_CACHE_DIR, ttl=settings.SCRAPER_CACHE_TTL,
+                       max_size=settings.SCRAPER_CACHE_MAX_SIZE)
+
+
 @rate_limit
-def get_options(source_url, tag, only_accept_after=None):
+def download(source_url, headers=None):
+    """
+    Send a GET request through the shared session.
+
+    :param source_url: The url to fetch
+    :param headers: Extra request headers
+
+    :return: The requests response
+    """
+    return http_session.get(source_url, headers=headers)
+
+
+def fetch_page(source_url, conditional=False):
+    """
+    Fetch the text of a page.
+
+    Unconditional fetches are answered from the page cache when it holds a fresh copy. Conditional fetches always ask
+    the server, which knows best whether the page changed. In replay mode only the cache is used.
+
+    :param source_url: The url to fetch
+    :param conditional: Send the validators stored for this url and accept a 304 answer
+
+    :return: Page text, or None if the page did not change since it was last fetched (or is missing in replay mode)
+    """
+    if page_cache.offline:
+        return page_cache.get(source_url)
+    if not conditional:
+        text = page_cache.get(source_url, max_age=page_cache.ttl)
+        if text is not None:
+            return text
+
+    headers = validators.request_headers(source_url) if conditional else {}
+    page = download(source_url, headers=headers)
+    metrics.count('pages_fetched')
+    if profiler.enabled:
+        profiler.add_bytes(len(page.content))
+    if page.status_code == 304:
+        metrics.count('not_modified')
+        return None
+    validators.record(source_url, page)
+    page_cache.set(source_url, page.text)
+    return page.text
+
+
+def get_options(source_url, tag, only_accept_after=None, conditional=False):
     """
     Parse a BS4 tag on a page for the available menu options.
 
     :param source_url: The url we wish to parse.
     :param tag: The current BS4 tag we are looking at.
     :param only_accept_after: Used if we wish to discard options before this point (previously parsed)
+    :param conditional: Reuse the options found on the previous run if the page did not change
     :return: Dictionary-compatible object containing the options. Format: {option1: [], opption2: []}
     """
-    page = requests.get(source_url)
-    s = BeautifulSoup(page.text, 'html.parser')
+    with profiler.phase('fetch', 'urls', source_url):
+        text = fetch_page(source_url, conditional=conditional)
+    options = validators.get_options(source_url) if text is None else None
+    if options is None:
+        if text is None and not page_cache.offline:
+            # Unchanged page but nothing remembered from it
+            with profiler.phase('fetch', 'urls', source_url):
+                text = fetch_page(source_url)
+        with profiler.phase('parse', 'urls', source_url):
+            options = parse_options(text, tag) if text is not None else []
+        validators.set_options(source_url, options)
 
-    option_source = s.find(id=tag)
-    options = []
-    try:
-        for source in option_source.contents:
-            try:
-                options.append(source['value'])
-            except TypeError:
-                pass
-    except AttributeError:
-        pass
     if only_accept_after is not None:
         # reject everything prior to parameter
         candidate_options = OrderedDict()
@@ -71,21 +279,35 @@ def get_options(source_url, tag, only_accept_after=None):
         return {option: [] for option in options}
 
 
-@rate_limit
-def get_results_from(source_url):
+def parse_options(text, tag):
+    """
+    Find the menu options of a page.
+
+    :param text: The page source
+    :param tag: Id of the menu element
+
+    :return: List of option values
+    """
+    return get_backend().options(text, tag)
+
+
+def get_results_from(source_url, conditional=False):
     """
     Parse and organize results from a page.
 
     :param source_url: The actual page containing the data
+    :param conditional: Skip the page if it did not change since it was last fetched
 
-    :return: The parsed data in the format: ([source_url], [event_info], [results1], [results2],..)
+    :return: The parsed data in the format: ([source_url], [event_info], [results1], [results2],..), or None if the
+    page was skipped
     """
     unwanted_items = ['Not Classified', 'Fastest Lap: ', 'Circuit Record Lap: ', 'Best Lap:', 'Pole Lap: ',
                       'Not Finished 1st Lap', 'Not Starting', 'Excluded', ]
     attempts = 5
     while attempts > 0:
         try:
-            page = requests.get(source_url)
+            with profiler.phase('fetch', 'urls', source_url):
+                text = fetch_page(source_url, conditional=conditional)
             attempts = 0
         except:
             attempts -= 1
@@ -93,38 +315,37 @@ def get_results_from(source_url):
                 time.sleep(180)
             else:
                 exit()
+    if text is None:
+        return None
 
-    s = BeautifulSoup(page.text, 'html.parser')
+    with profiler.phase('parse', 'urls', source_url):
+        return parse_results(source_url, text, unwanted_items)
 
-    event_info = ''
-    try:
-        event_info = s.find(class_='padbot5').text
-    except AttributeError:
-        pass
 
-    col_names = s.find_all('th')
-    results_table = [[item.text for item in col_names if item.text not in unwanted_items]]
+def parse_results(source_url, text, unwanted_items):
+    """
+    Body of get_results_from, once the page is fetched.
+    """
+    page = get_backend().results(text)
+    headers = [header for header in page.headers if header not in unwanted_items]
+    results_table = [headers]
 
-    rows_count = results_line_count(page.text, unwanted_items)
-    rows = s.find_all('td')
-    col_count = len(results_table[0])
+    rows_count = results_line_count(text, unwanted_items)
+    cells = page.cells
+    col_count = len(headers)
     row = 0
     # Create a tuple of the parsed results for each row
-    while row < len(rows) and len(results_table) <= rows_count and rows[row].contents != ['\xa0']:
-        rider_result = []
-        try:
-            if rows[row].text in unwanted_items:
-                row += 1
-            else:
-                for col in range(col_count):
-                    rider_result.append(rows[row + col].text)
-
-                results_table.append(tuple(rider_result))
-                row += col_count
-        except IndexError:
-            pass
+    while row < len(cells) and len(results_table) <= rows_count and not cells[row][1]:
+        if cells[row][0] in unwanted_items:
+            row += 1
+        elif row + col_count > len(cells):
+            # Incomplete last row
+            break
+        else:
+            results_table.append(tuple(text for text, blank in cells[row:row + col_count]))
+            row += col_count
 
-    return tuple([source_url] + [event_info] + results_table)
+    return tuple([source_url] + [page.event_info] + results_table)
 
 
 def results_line_count(source, to_skip=None):
@@ -140,65 +361,263 @@ def results_line_count(source, to_skip=None):
         to_skip = []
     start = source.find('<tbody>')
     end = source.find('</tbody>') + len('</tbody>')
+    body = source[start:end]
 
-    count = source[start:end].count('</tr>')
-    skip_count = 0
-    for item in to_skip:
-        skip_count += source[start:end].count(item)
-    return count - skip_count
+    return body.count('</tr>') - sum(body.count(item) for item in to_skip)
 
 
-def scrape_data(start_season=None):
+def scrape_data(start_season=None, workers=1, rate=None, replay=False):
     """
     Scrape a data source for all the relevant data.
 
     Iterate through seasons, events, categories to gather the menu options available, then calls get_results_from to
     gather results and insert_in_database to store then.
 
+    Pages are fetched by a pool of worker threads sharing the request bucket, while results are inserted by the calling
+    thread in menu order. An event is only checkpointed once all of its sessions are stored, so an interrupted run
+    resumes from the first incomplete event whatever the order in which pages were downloaded.
+
+    Nightly runs (no start_season) send conditional requests: unchanged menus reuse the options found last time and
+    unchanged result pages are skipped. Forcing a season stores every page again, reading it from the page cache when
+    a fresh copy exists. Replay runs rebuild the database from the page cache alone, without any network access.
+
     :param start_season: The first season to begin parsing with. (default = last season parsed)
+    :param workers: Number of threads fetching and parsing pages concurrently, at least 1 (default = 1)
+    :param rate: Overall requests per second allowed to the data source (default = unchanged, 1 per second)
+    :param replay: Only read pages from the page cache (default start_season = first championship season)
     """
-    base_page = 'http://www.motogp.com/en/Results+Statistics/'
-    banned_events = ['T22', ]
+    if workers < 1:
+        raise ValueError(f'At least one worker is needed, not {workers}')
+    if rate is not None:
+        request_bucket.configure(rate)
+    size_connection_pools(workers)
 
     update_data, created = UpdateData.objects.get_or_create()
+    if replay and start_season is None:
+        start_season = first_season
+    conditional = start_season is None
     if start_season is None:
         start_season = update_data.most_recent_scraped_season
-        start_event = update_data.most_recent_scraped_event
+        start_event = update_data.most_recent_scraped_event or None
     else:
         start_event = None
+    validators.load()
 
     seasons = [str(item) for item in list(range(start_season, timezone.now().year + 1))]
-    for season in seasons:
-        if settings.DEBUG:
-            print(f'\nParsing season: {season}')
-        events = get_options(base_page + season, 'event', only_accept_after=start_event)
-        for event in events:
-            if event in banned_events:
-                continue
-            if settings.DEBUG:
-                print(f'{season}: {event}')
-            categories = get_options(base_page + season + '/' + event, 'category')
-            if len(categories) > 0:
-                update_data.most_recent_scraped_event = event
-                update_data.save(update_fields=['most_recent_scraped_event'])
+    page_cache.offline = replay
+    try:
+        with metrics.job('scrape'):
+            scrape_seasons(seasons, start_event, workers, conditional, update_data)
+    finally:
+        page_cache.offline = False
+        # Once for the whole run, including what was stored before an error
+        MenuOptions.rebuild()
+        bump_data_version()
+    if not replay:
+        page_cache.evict()
+
+
+def scrape_seasons(seasons, start_event, workers, conditional, update_data):
+    """
+    Fetch and store the results of the given seasons, see scrape_data.
+    """
+    banned_events = ['T22', ]
 
-            for category in categories:
+    lookups = IngestLookups()
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = []
+    try:
+        for season in seasons:
+            pending.clear()
+            if settings.DEBUG:
+                print(f'\nParsing season: {season}')
+            season_page = base_page + season
+            events = get_options(season_page, 'event', only_accept_after=start_event, conditional=conditional)
+            # The resume point only applies to the season it was recorded in
+            start_event = None
+            events = [event for event in events if event not in banned_events]
+
+            event_categories = results_of(submit_all(
+                executor, lambda e: get_options(f'{season_page}/{e}', 'category', conditional=conditional), events,
+                pending))
+            category_pages = [(event, category)
+                              for event, categories in zip(events, event_categories)
+                              for category in categories]
+
+            category_sessions = results_of(submit_all(
+                executor, lambda c: get_options(f'{season_page}/{c[0]}/{c[1]}', 'session', conditional=conditional),
+                category_pages, pending))
+            session_pages = [(event, category, session)
+                             for (event, category), sessions in zip(category_pages, category_sessions)
+                             for session in sessions]
+
+            # Downloads run ahead in the pool, results are consumed in submission order
+            results = results_of(submit_all(
+                executor, lambda p: get_results_from(f'{season_page}/{p[0]}/{p[1]}/{p[2]}', conditional=conditional),
+                session_pages, pending))
+            remaining = Counter(event for event, category, session in session_pages)
+            for (event, category, session), session_results in zip(session_pages, results):
                 if settings.DEBUG:
-                    print(f'{season}: {event}: {category}')
-                sessions = get_options(base_page + season + '/' + event + '/' + category, 'session')
+                    print(f'{season}: {event}: {category}: {session}')
+                if session_results is not None:
+                    with profiler.phase('insert', 'urls', session_results[0]):
+                        insert_in_database(season, event, category, session, session_results, lookups=lookups)
+                remaining[event] -= 1
+                if remaining[event] == 0:
+                    update_data.most_recent_scraped_season = int(season)
+                    update_data.most_recent_scraped_event = event
+                    update_data.save(update_fields=['most_recent_scraped_season', 'most_recent_scraped_event'])
+            # Only remember validators once the pages they describe are stored
+            validators.flush()
+    except BaseException:
+        # Fail now rather than once every download queued behind the error went through the rate limit
+        for futures in pending:
+            for future in futures:
+                future.cancel()
+        raise
+    finally:
+        executor.shutdown(wait=True)
+
+
+def submit_all(executor, function, items, pending):
+    """
+    :param executor: Executor running function
+    :param function: Function called with each item
+    :param items: Items to submit
+    :param pending: List of the deques of futures not consumed yet, the returned deque is added to it
+    :return: Deque of the futures of function(item) for each item, in order
+    """
+    futures = deque(executor.submit(function, item) for item in items)
+    pending.append(futures)
+    return futures
 
-                for session in sessions:
-                    results = get_results_from(base_page + season + '/' + event + '/' + category + '/' + session)
-                    insert_in_database(season, event, category, session, results)
-        update_data.most_recent_scraped_season = season
-        update_data.save(update_fields=['most_recent_scraped_season'])
 
+def results_of(futures):
+    """
+    :param futures: Deque of futures, each dropped once its result is consumed
+    :return: Generator of their results, in order
+    """
+    while futures:
+        yield futures.popleft().result()
 
-def chart_data(start_year=None):
+
+class ChartWriter:
+    """
+    Send chart specs to an executor for rendering, skipping charts whose data did not change since they were written.
+
+    Fingerprints and checkpoints of rendered charts are saved in submission order, once the charts they depend on are
+    written, along with the manifest mapping chart names to their content-hashed files.
+    """
+    def __init__(self, executor, update_data=None, force=False):
+        """
+        :param executor: Executor running render_chart
+        :param update_data: UpdateData object receiving checkpoints
+        :param force: Render every chart, even if its data did not change
+        """
+        self.executor = executor
+        self.update_data = update_data
+        self.force = force
+        self.fingerprints = dict(ChartFingerprint.objects.values_list('name', 'digest'))
+        self.directory = charts_directory()
+        self.manifest = read_manifest(self.directory)
+        # (checkpoint values, [(chart name, digest, future)]), in submission order
+        self.pending = deque()
+        self.rendered = 0
+
+    @staticmethod
+    def digest(spec):
+        # Chart data is ordered: riders appear in the legend in insertion order
+        return hashlib.sha1(json.dumps([spec.data, spec.options]).encode()).hexdigest()
+
+    def submit(self, specs, checkpoint=None):
+        """
+        :param specs: ChartSpecs to render
+        :param checkpoint: UpdateData values to save once the charts are written
+        """
+        jobs = []
+        for spec in specs:
+            name = os.path.basename(spec.path)
+            digest = self.digest(spec)
+            written = self.manifest.get(name)
+            if not self.force and self.fingerprints.get(name) == digest and written is not None and \
+                    os.path.exists(os.path.join(self.directory, written)):
+                continue
+            if profiler.enabled:
+                jobs.append((name, digest, self.executor.submit(profile_render_chart, spec)))
+            else:
+                jobs.append((name, digest, self.executor.submit(render_chart, spec)))
+        self.pending.append((checkpoint or {}, jobs))
+        self.save_completed()
+
+    def save_completed(self, wait=False):
+        """
+        Save fingerprints and checkpoints of written charts, stopping at the first submission still rendering.
+
+        :param wait: Wait for all pending charts instead of stopping
+        """
+        while self.pending:
+            checkpoint, jobs = self.pending[0]
+            if not wait and not all(future.done() for name, digest, future in jobs):
+                return
+            for name, digest, future in jobs:
+                # Raise rendering errors before checkpointing past them
+                written = future.result()
+                if isinstance(written, tuple):
+                    written, report = written
+                    profiler.merge(report)
+                self.manifest[name] = written
+            self.pending.popleft()
+            if jobs:
+                with profiler.phase('write'):
+                    write_manifest(self.directory, self.manifest)
+                    with transaction.atomic():
+                        ChartFingerprint.objects.filter(name__in=[name for name, digest, future in jobs]).delete()
+                        ChartFingerprint.objects.bulk_create([ChartFingerprint(name=name, digest=digest)
+                                                              for name, digest, future in jobs])
+                self.fingerprints.update((name, digest) for name, digest, future in jobs)
+                self.rendered += len(jobs)
+            if checkpoint:
+                for field, value in checkpoint.items():
+                    setattr(self.update_data, field, value)
+                self.update_data.save(update_fields=list(checkpoint))
+
+
+def build_chart_specs(obj, builder, *args, store=None):
+    """
+    :param obj: Season or Event
+    :param builder: Chart specs method of obj's class, measured as the aggregate phase of one build
+    :param args: Arguments of the method
+    :param store: ResultsStore the method reads from (default = the method loads the results it needs)
+
+    :return: Chart specs
+    """
+    label = f'{obj.season} {obj}' if isinstance(obj, Event) else str(obj)
+    with profiler.phase('aggregate', 'builds', f'{builder.__name__} {label}'):
+        return builder(obj, *args, store=store)
+
+
+def chart_executor(jobs):
+    """
+    :param jobs: Number of processes rendering charts
+    :return: Executor for render_chart, a single background thread for one job
+    """
+    return ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else ThreadPoolExecutor(max_workers=1)
+
+
+def chart_data(start_year=None, jobs=1, force=False):
     """
     Iterate through all the seasons and events to create their data charts.
 
+    Chart data is prepared here from results loaded once in memory, rendering and writing the SVG files is done by a
+    pool of worker processes. Charts are only rendered again if their data changed. Checkpoints are saved in charting
+    order, once all the charts of an event (or season) are written.
+
+    Each chart file is submitted once: workers never write the same file concurrently. History charts, named after
+    their event location, are built from the latest event held there (see latest_events).
+
     :param start_year: First year to start charting. (default = last year charted)
+    :param jobs: Number of processes rendering charts (default = 1, rendering in a background thread)
+    :param force: Render charts even if their data did not change
     """
     update_data, created = UpdateData.objects.get_or_create()
     if start_year is None:
@@ -211,90 +630,289 @@ def chart_data(start_year=None):
     else:
         loc = None
 
-    years = list(range(start_year, timezone.now().year + 1))
-    for year in years:
-        try:
-            s = Season.objects.get(year=year)
-            if settings.DEBUG:
-                print(f'Charting season: {year}')
-        except Season.DoesNotExist:
-            return
-        events_temp = s.event_set.all()
-        events = []
-        if year == start_year and loc is not None:
-            for event in events_temp:
-                if event.event_location == loc:
-                    events.append(event)
-                elif len(events) > 0:
-                    events.append(event)
-        else:
-            events = events_temp
+    with metrics.job('charts'), chart_executor(jobs) as executor:
+        # Event history charts go back 5 seasons
+        with profiler.phase('aggregate', 'builds', 'results store'):
+            store = ResultsStore.load(Session.objects.filter(event__season__year__gte=start_year - 5))
+        writer = ChartWriter(executor, update_data, force=force)
+        history_events = {event.pk for event in latest_events().values()}
+        years = list(range(start_year, timezone.now().year + 1))
+        for year in years:
+            try:
+                s = Season.objects.get(year=year)
+                if settings.DEBUG:
+                    print(f'Charting season: {year}')
+            except Season.DoesNotExist:
+                break
+            events_temp = s.event_set.select_related('season', 'event_location')
+            events = []
+            if year == start_year and loc is not None:
+                for event in events_temp:
+                    if event.event_location == loc:
+                        events.append(event)
+                    elif len(events) > 0:
+                        events.append(event)
+            else:
+                events = events_temp
+
+            for event in events:
+                specs = build_chart_specs(event, Event.session_history_chart_specs, store=store)
+                if event.pk in history_events:
+                    specs = build_chart_specs(event, Event.event_history_chart_specs, store=store) + specs
+                writer.submit(specs,
+                              checkpoint={'most_recent_charted_event': event.event_location.__str__()})
+            writer.submit(build_chart_specs(s, Season.season_chart_specs, store=store),
+                          checkpoint={'most_recent_charted_season': year})
+        writer.save_completed(wait=True)
+        metrics.count('charts_rendered', writer.rendered)
+    bump_data_version()
+    return writer.rendered
+
+
+def chart_changed(jobs=1, season_count=5):
+    """
+    Render the charts fed by sessions scraped since the last call.
+
+    Dependencies of a changed event:
+    - any session: the session chart of the event
+    - a race: the history charts of the event location, and the championship chart of the season
+
+    Charts whose data did not change are still skipped.
+
+    :param jobs: Number of processes rendering charts
+    :param season_count: Number of seasons shown in event history charts
+    :return: Number of charts rendered
+    """
+    with metrics.job('charts'):
+        rendered = render_changed(season_count, jobs)
+    if rendered:
+        bump_data_version()
+    return rendered
+
+
+def render_changed(season_count, jobs):
+    """
+    Body of chart_changed.
+    """
+    changes = list(ChangedEvent.objects.select_related('event__season', 'event__event_location'))
+    if not changes:
+        return 0
+
+    session_events = [change.event for change in changes]
+    races = [change.event for change in changes if change.race_changed]
+    seasons = {event.season_id: event.season for event in races}
+    # One history chart per location, whatever the number of its changed seasons
+    history_events = []
+    for location, latest in latest_events([event.event_location_id for event in races]).items():
+        # Races older than the seasons shown in the chart leave it unchanged
+        if any(event.event_location_id == location and event.season.year >= latest.season.year - season_count
+               for event in races):
+            history_events.append(latest)
+
+    with chart_executor(jobs) as executor:
+        writer = ChartWriter(executor)
+        for event in session_events:
+            writer.submit(build_chart_specs(event, Event.session_history_chart_specs))
+        for event in history_events:
+            writer.submit(build_chart_specs(event, Event.event_history_chart_specs, season_count))
+        for season in seasons.values():
+            writer.submit(build_chart_specs(season, Season.season_chart_specs))
+        writer.save_completed(wait=True)
+    ChangedEvent.objects.filter(pk__in=[change.pk for change in changes]).delete()
+    metrics.count('charts_rendered', writer.rendered)
+    return writer.rendered
+
+
+def latest_events(locations=None):
+    """
+    History charts are named after their event location alone: like the track_chart view, they are built from the
+    most recent event held there.
+
+    :param locations: Event location ids (default = every location)
+    :return: Dictionary of event location id: most recent Event held there
+    """
+    events = Event.objects.select_related('season', 'event_location').order_by('season__year')
+    if locations is not None:
+        events = events.filter(event_location_id__in=set(locations))
+    return {event.event_location_id: event for event in events}
 
-        for event in events:
-            event.create_event_history_chart()
-            event.create_session_history_chart()
-            update_data.most_recent_charted_event = event.event_location.__str__()
-            update_data.save(update_fields=['most_recent_charted_event'])
-        s.create_season_chart()
-        update_data.most_recent_charted_season = year
-        update_data.save(update_fields=['most_recent_charted_season'])
+
+class IngestLookups:
+    """
+    In-memory maps from natural keys to database rows.
+
+    Shared by every insert_in_database call of a scrape so each dimension row is looked up or created once per run.
+    Keys are tuples of the field values named in `fields`. Riders are found through the names they were scraped
+    under, see resolve_riders.
+    """
+    fields = {
+        Season: ('year', ),
+        EventLocation: ('location', ),
+        Category: ('class_name', ),
+        Event: ('season_id', 'event_location_id'),
+        Rider: ('normalized_key', ),
+        Team: ('team_name', ),
+        Brand: ('brand_name', ),
+    }
+
+    def __init__(self):
+        self.rows = {model: {} for model in self.fields}
+        # Scraped rider name: canonical rider
+        self.aliases = {}
+        # (season_id, category_id) and (event_id, category_id) pairs known to be linked
+        self.season_categories = set()
+        self.event_categories = set()
+        # event_id: whether a race changed, as recorded in ChangedEvent
+        self.changed_events = {}
+
+    def resolve(self, model, keys, defaults=None):
+        """
+        Map natural keys to rows, creating the missing ones with a single bulk insert.
+
+        :param model: One of the models in `fields`
+        :param keys: Iterable of natural key tuples
+        :param defaults: Dictionary of natural key: other field values of the row, used if it is created
+
+        :return: Dictionary of natural key: row for all requested keys
+        """
+        fields = self.fields[model]
+        cache = self.rows[model]
+        keys = set(keys)
+        missing = keys - cache.keys()
+        attempts = 3
+        while missing:
+            # Narrow down on the first field, then match whole keys
+            candidates = model.objects.filter(**{f'{fields[0]}__in': {key[0] for key in missing}})
+            for row in candidates:
+                cache[tuple(getattr(row, field) for field in fields)] = row
+            missing -= cache.keys()
+            if not missing:
+                break
+            if attempts == 0:
+                raise RuntimeError(f'Bulk created {model.__name__} rows could not be found again: {missing}')
+            attempts -= 1
+            # Primary keys are not returned by bulk inserts on SQLite: created rows are read back on the next pass
+            try:
+                with transaction.atomic():
+                    model.objects.bulk_create([model(**dict(zip(fields, key)), **(defaults or {}).get(key, {}))
+                                               for key in missing])
+            except IntegrityError:
+                # Some keys were inserted by someone else meanwhile: the next pass reads them, creates the others
+                pass
+        return {key: cache[key] for key in keys}
+
+    def get(self, model, *key):
+        return self.resolve(model, [key])[key]
+
+    def resolve_riders(self, riders):
+        """
+        Map scraped rider names to canonical riders.
+
+        Names already seen are found in RiderAlias. New spellings are matched on their normalized key, creating the
+        rider if there is none, and recorded as aliases of it.
+
+        :param riders: Iterable of (full name, last name, first name, nationality) as scraped
+        :return: Dictionary of full name: Rider
+        """
+        riders = {rider[0]: rider for rider in riders}
+        missing = riders.keys() - self.aliases.keys()
+        if missing:
+            for alias in RiderAlias.objects.filter(name__in=missing).select_related('rider'):
+                self.aliases[alias.name] = alias.rider
+            missing -= self.aliases.keys()
+        if missing:
+            keys = {name: (normalize_name(name), ) for name in missing}
+            # The first spelling met gives the names of a new rider, nationality is not part of its identity
+            defaults = {}
+            for name in sorted(missing):
+                full_name, last_name, first_name, nationality = riders[name]
+                defaults.setdefault(keys[name], {'full_name': full_name, 'last_name': last_name,
+                                                 'first_name': first_name, 'nationality': nationality})
+            rows = self.resolve(Rider, keys.values(), defaults)
+            aliases = [RiderAlias(name=name, rider=rows[keys[name]]) for name in missing]
+            try:
+                with transaction.atomic():
+                    RiderAlias.objects.bulk_create(aliases)
+            except IntegrityError:
+                # Some spellings were recorded by someone else meanwhile: theirs are kept
+                aliases = [RiderAlias.objects.select_related('rider').get_or_create(
+                    name=alias.name, defaults={'rider': alias.rider})[0] for alias in aliases]
+            self.aliases.update((alias.name, alias.rider) for alias in aliases)
+        return {name: self.aliases[name] for name in riders}
+
+    def mark_changed(self, event, race):
+        """
+        Record that the charts fed by an event need to be rendered again, see chart_changed.
+
+        :param event: Event of the stored session
+        :param race: Whether the stored session is a race
+        """
+        if event.pk in self.changed_events and (self.changed_events[event.pk] or not race):
+            return
+        change, created = ChangedEvent.objects.get_or_create(event=event, defaults={'race_changed': race})
+        if race and not change.race_changed:
+            change.race_changed = True
+            change.save(update_fields=['race_changed'])
+        self.changed_events[event.pk] = change.race_changed
 
 
-def insert_in_database(season, event, category, session, results):
+def insert_in_database(season, event, category, session, results, lookups=None):
     """
     Insert a set of results in the proper database objects
 
+    Inserting the same session again replaces its previous results.
+
     :param season: Source season
     :param event: Source event
     :param category: Source category
     :param session: Source session
     :param results: Set of results
+    :param lookups: IngestLookups shared across calls (default = new maps for this call only)
+    """
+    if lookups is None:
+        lookups = IngestLookups()
+
+    with transaction.atomic():
+        insert_session(season, event, category, session, results, lookups)
+
+
+def insert_session(season, event, category, session, results, lookups):
+    """
+    Body of insert_in_database, run in a transaction.
     """
     # Get or create DB references for session
-    y, created = Season.objects.get_or_create(year=int(season))
-    event_loc, created = EventLocation.objects.get_or_create(location=event)
-    cat, created = Category.objects.get_or_create(class_name=category)
-    y.categories.add(cat)
-    e, created = event_loc.event_set.get_or_create(season=y, event_location=event_loc)
-    e.categories.add(cat)
+    y = lookups.get(Season, int(season))
+    event_loc = lookups.get(EventLocation, event)
+    cat = lookups.get(Category, category)
+    if (y.pk, cat.pk) not in lookups.season_categories:
+        y.categories.add(cat)
+        lookups.season_categories.add((y.pk, cat.pk))
+    e = lookups.get(Event, y.pk, event_loc.pk)
+    if (e.pk, cat.pk) not in lookups.event_categories:
+        e.categories.add(cat)
+        lookups.event_categories.add((e.pk, cat.pk))
     is_point_event = session in ('RAC', 'RAC2')
 
-    # RAC2 or WUP2 mean restarted sessions, find any old one and remove
-    if session == 'RAC2':
-        try:
-            sessions = Session.objects.filter(point_event=is_point_event,
-                                              category=cat,
-                                              event=e,
-                                              session_type='RAC',
-                                              )
-            for s in sessions:
-                s.delete()
-        except Session.DoesNotExist:
-            if settings.DEBUG:
-                print('Previous session should exist!', session)
-            return
-        session = 'RAC'
-    if session == 'WUP2':
-        try:
-            sessions = Session.objects.filter(point_event=is_point_event,
-                                              category=cat,
-                                              event=e,
-                                              session_type='WUP',
-                                              )
-            for s in sessions:
-                s.delete()
-        except Session.DoesNotExist:
-            if settings.DEBUG:
-                print('Previous session should exist!', session)
-            return
-        session = 'WUP'
+    # RAC2 or WUP2 mean restarted sessions, remove any old one
+    if session in ('RAC2', 'WUP2'):
+        session = session[:-1]
+        Session.objects.filter(category=cat, event=e, session_type=session).delete()
 
-    s, created = Session.objects.get_or_create(point_event=is_point_event,
-                                               category=cat,
+    lookups.mark_changed(e, is_point_event)
+    s, created = Session.objects.get_or_create(category=cat,
                                                event=e,
                                                session_type=session,
-                                               source_url=results[0],
-                                               )
+                                               defaults={
+                                                   'point_event': is_point_event,
+                                                   'source_url': results[0],
+                                               })
+    if not created:
+        # Scraped again: replace previous results
+        s.result_set.all().delete()
+        if s.source_url != results[0]:
+            s.source_url = results[0]
+            s.save(update_fields=['source_url'])
+
     if is_point_event:
         # Columns where appropriate data is located for each type of result
         data = {
@@ -315,36 +933,31 @@ def insert_in_database(season, event, category, session, results):
             'time': 7,
         }
 
-    position = 1
+    rows = []
     for row in results[3:]:
         try:
             rider = row[data['rider']]
-            try:
-                rider_last = re.search('\ [A-ZÓÑØÜÄÖÉÚÁÉ(Mc)]([A-ZÓÜÑØÄÖÉÚÁÉ(Mc)(Jr)\'\-\ ])*.?$', rider).group(0)
-            except:
+            names = split_name(rider)
+            if names is None:
+                # Unparseable result, ignored
                 if settings.DEBUG:
                     print(f'rider_last Error!: s={season}, e={event}, c={category}, sesh={session}, r={rider}\n{row}\n')
                 continue
-            rider_last = rider_last.strip().lower()
-            rider_first = rider[:rider.find(rider_last)].strip().lower()
-            if len(rider) < 1 or len(rider_last) < 1 or len(rider_first) < 1:
-                # Unparseable result, ignored
-                continue
-            r, created = Rider.objects.get_or_create(
-                full_name=rider,
-                last_name=rider_last,
-                first_name=rider_first,
-                nationality=row[data['nation']].lower())
-            r.save()
+            rider_first, rider_last = names
+            rider_key = (rider, rider_last, rider_first, row[data['nation']].lower())
+            rows.append((rider_key, row[data['team']], row[data['bike']], row[data['speed']], row[data['time']]))
         except IndexError:
             continue
 
-        t, created = Team.objects.get_or_create(team_name=row[data['team']])
-        b, created = Brand.objects.get_or_create(brand_name=row[data['bike']])
-
-        speed = row[data['speed']]
-        lap_time = row[data['time']]
-
-        new = Result(rider=r, brand=b, team=t, session=s, top_speed=speed, time=lap_time, position=position)
-        new.save()
-        position += 1
+    riders = lookups.resolve_riders([rider_key for rider_key, *_ in rows])
+    teams = lookups.resolve(Team, [(team, ) for _, team, *_ in rows])
+    brands = lookups.resolve(Brand, [(bike, ) for _, _, bike, *_ in rows])
+
+    metrics.count('rows_ingested', len(rows))
+    Result.objects.bulk_create([
+        Result(rider=riders[rider_key[0]], brand=brands[(bike, )], team=teams[(team, )], session=s,
+               top_speed=speed, time=lap_time, position=position,
+               speed_kmh=parse_speed(speed), time_ms=parse_lap_time(lap_time),
+               points=points_for(y.year, position) if is_point_event else 0)
+        for position, (rider_key, team, bike, speed, lap_time) in enumerate(rows, start=1)
+    ])
@@ -0,0 +1,120 @@
+from array import array
+
+
+class ResultsStore:
+    """
+    Results held in compact columns, for chart aggregation without building model instances.
+
+    Sessions have columns of their own (season, event, location, category, session type, race) and results refer to
+    them by position: results are grouped by session, so the results of a session are one contiguous slice of the
+    result columns (rider, position, points, lap time). Indexes map seasons, event locations and events to their
+    sessions, in session id order.
+
+    Load the whole history once to chart the whole site, or only the sessions a chart needs.
+    """
+    # Lap time of results without one
+    no_time = -1
+
+    def __init__(self):
+        # Session columns
+        self.session_id = array('q')
+        self.session_year = array('i')
+        self.session_event = array('q')
+        self.session_location = array('q')
+        self.session_category = array('q')
+        self.session_type = []
+        self.session_point_event = array('b')
+        # Index of the first result of each session, followed by the number of results
+        self.session_start = array('q')
+
+        # Result columns, grouped by session
+        self.rider = array('q')
+        self.position = array('i')
+        self.points = array('i')
+        self.time_ms = array('q')
+
+        # Names: id: name
+        self.locations = {}
+        self.categories = {}
+        self.riders = {}
+
+        # Indexes: key: list of session positions
+        self.by_season = {}
+        self.by_location = {}
+        self.by_event = {}
+
+    def __len__(self):
+        return len(self.rider)
+
+    @classmethod
+    def load(cls, sessions=None, chunk_size=10000):
+        """
+        Read sessions and their results in two queries, results being streamed from the database.
+
+        :param sessions: Session queryset to load (default = every session)
+        :param chunk_size: Number of results fetched from the database at once
+        :return: ResultsStore
+        """
+        from .models import Result, Rider, Session
+
+        store = cls()
+        results = Result.objects.all()
+        if sessions is None:
+            sessions = Session.objects.all()
+        else:
+            results = results.filter(session__in=sessions.values('pk'))
+        rows = sessions.order_by('pk').values_list(
+            'pk', 'event__season__year', 'event_id', 'event__event_location_id', 'event__event_location__location',
+            'category_id', 'category__class_name', 'session_type', 'point_event')
+        index = {}
+        for session_id, year, event_id, location_id, location, category_id, category, session_type, point_event \
+                in rows:
+            position = len(store.session_id)
+            index[session_id] = position
+            store.session_id.append(session_id)
+            store.session_year.append(year)
+            store.session_event.append(event_id)
+            store.session_location.append(location_id)
+            store.session_category.append(category_id)
+            store.session_type.append(session_type)
+            store.session_point_event.append(point_event)
+            store.locations[location_id] = location
+            store.categories[category_id] = category
+            store.by_season.setdefault(year, []).append(position)
+            store.by_location.setdefault(location_id, []).append(position)
+            store.by_event.setdefault(event_id, []).append(position)
+
+        counts = array('q', [0]) * len(store.session_id)
+        results = results.order_by('session_id', 'pk').values_list(
+            'session_id', 'rider_id', 'position', 'points', 'time_ms', 'rider__first_name', 'rider__last_name')
+        for session_id, rider_id, position, points, time_ms, first_name, last_name \
+                in results.iterator(chunk_size=chunk_size):
+            counts[index[session_id]] += 1
+            store.rider.append(rider_id)
+            store.position.append(position)
+            store.points.append(points)
+            store.time_ms.append(cls.no_time if time_ms is None else time_ms)
+            if rider_id not in store.riders:
+                store.riders[rider_id] = Rider.label(first_name, last_name)
+
+        start = 0
+        for count in counts:
+            store.session_start.append(start)
+            start += count
+        store.session_start.append(start)
+        return store
+
+    def results(self, session):
+        """
+        :param session: Position of the session
+        :return: Positions of its results, in id order
+        """
+        return range(self.session_start[session], self.session_start[session + 1])
+
+    def time(self, result):
+        """
+        :param result: Position of the result
+        :return: Lap time in ms, None if there is none
+        """
+        time_ms = self.time_ms[result]
+        return None if time_ms == self.no_time else time_ms
@@ -0,0 +1,169 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+
+from django.urls import reverse
+
+from .page_cache import PageCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+manifest_name = 'manifest.json'
+# Files of the charts directory served by the chart_file view: content-hashed charts and stylesheets
+served_file = re.compile(r'[^/]+\.[0-9a-f]{12}\.svg|chart-[0-9a-f]{12}\.css')
+
+xml_declaration = re.compile(rb'^<\?xml[^>]*\?>')
+style_block = re.compile(rb'<style type="text/css">(.*?)</style>', re.S)
+comment = re.compile(rb'<!--.*?-->', re.S)
+# Rules styling each series, written by pygal for as many series as the chart holds
+series_rule = re.compile(rb'\.color-(\d+)\b')
+# Attributes holding coordinates, written by pygal with 6 decimals
+geometry = re.compile(rb' (d|x|y|x1|x2|y1|y2|cx|cy|r|width|height|points|transform)="([^"]*)"')
+# Tooltip positions, written with full float precision
+tooltip_position = re.compile(rb'(<desc class="[xy] [^"]*">)(-?\d+\.\d+)(</desc>)')
+decimal = re.compile(rb'-?\d+\.\d+')
+
+
+def content_hash(data):
+    """
+    :param data: File content
+    :return: Short hash of the content, used in file names
+    """
+    return hashlib.sha1(data).hexdigest()[:12]
+
+
+def shorten_number(match):
+    number = b'%.2f' % float(match.group(0))
+    number = number.rstrip(b'0').rstrip(b'.')
+    return b'0' if number == b'-0' else number
+
+
+def shorten_geometry(match):
+    return b' %s="%s"' % (match.group(1), decimal.sub(shorten_number, match.group(2)))
+
+
+def shorten_tooltip_position(match):
+    return match.group(1) + decimal.sub(shorten_number, match.group(2)) + match.group(3)
+
+
+def publish_stylesheet(css, directory):
+    """
+    Write a stylesheet shared by charts, under a name derived from its content.
+
+    :param css: Stylesheet content
+    :param directory: Directory of the charts
+    :return: File name of the stylesheet
+    """
+    name = f'chart-{content_hash(css)}.css'
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        write_compressed(path, css)
+    return name
+
+
+def static_stylesheet(directory):
+    """
+    :param directory: Directory of the charts written by the update commands
+    :return: Function publishing stylesheets for optimize, next to the charts and served like them by the chart_file
+    view
+    """
+    return lambda css: reverse('motogp:chart_file', args=[publish_stylesheet(css, directory)])
+
+
+def series_count(css):
+    """
+    :param css: Stylesheet of a chart
+    :return: Number of series it styles
+    """
+    return max((int(index) for index in series_rule.findall(css)), default=-1) + 1
+
+
+def optimize(svg, publish, shared_css=None):
+    """
+    Shrink a chart rendered by pygal.
+
+    Stylesheets are moved to a separate file. Charts are rendered without per-chart css prefixes, but pygal writes
+    rules for each of their series: the stylesheet is replaced by shared_css, written for more series, so that charts
+    share one file. Comments and spaces closing tags are dropped and coordinates rounded to 2 decimals.
+
+    :param svg: Chart, as rendered by create_chart
+    :param publish: Function storing the stylesheet content and returning its URL (see static_stylesheet)
+    :param shared_css: Stylesheet used instead of the chart's own when it styles as many series (see
+    charts.shared_stylesheet)
+    :return: Optimized chart
+    """
+    css = b''.join(style_block.findall(svg))
+    if shared_css is not None and css and series_count(css) <= series_count(shared_css):
+        css = shared_css
+    svg = style_block.sub(b'', svg)
+    svg = comment.sub(b'', svg)
+    svg = geometry.sub(shorten_geometry, svg)
+    svg = tooltip_position.sub(shorten_tooltip_position, svg)
+    svg = svg.replace(b' />', b'/>')
+    if css:
+        href = publish(css).encode()
+        stylesheet = b'<?xml-stylesheet type="text/css" href="%s"?>' % href
+        declaration = xml_declaration.match(svg)
+        if declaration:
+            svg = declaration.group(0) + stylesheet + svg[declaration.end():]
+        else:
+            svg = stylesheet + svg
+    return svg
+
+
+def write_compressed(path, data):
+    """
+    Write a file along with its precompressed .gz and .br (if brotli is installed) siblings.
+
+    :param path: Path of the uncompressed file
+    :param data: File content
+    """
+    PageCache.write_atomic(path, data)
+    PageCache.write_atomic(path + '.gz', gzip.compress(data, compresslevel=9))
+    if brotli is not None:
+        PageCache.write_atomic(path + '.br', brotli.compress(data))
+
+
+def write_hashed(path, data):
+    """
+    Write a chart under a content-hashed name, so it can be served with far-future cache headers, and remove the
+    previous versions of that chart.
+
+    :param path: Path of the chart, without hash
+    :param data: Chart content
+    :return: File name of the written chart, like 2018-MotoGP.0123456789ab.svg
+    """
+    directory, name = os.path.split(path)
+    stem, extension = os.path.splitext(name)
+    hashed_name = f'{stem}.{content_hash(data)}{extension}'
+    previous = re.compile(re.escape(stem) + r'\.[0-9a-f]{12}' + re.escape(extension) + r'(\.gz|\.br)?$')
+    write_compressed(os.path.join(directory, hashed_name), data)
+    for old in os.listdir(directory):
+        if previous.match(old) and not old.startswith(hashed_name):
+            os.remove(os.path.join(directory, old))
+    return hashed_name
+
+
+def read_manifest(directory):
+    """
+    :param directory: Directory of the charts
+    :return: Dictionary of chart name: content-hashed file name
+    """
+    try:
+        with open(os.path.join(directory, manifest_name)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(directory, manifest):
+    """
+    :param directory: Directory of the charts
+    :param manifest: Dictionary of chart name: content-hashed file name
+    """
+    PageCache.write_atomic(os.path.join(directory, manifest_name), json.dumps(manifest, sort_keys=True).encode())
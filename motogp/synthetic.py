@@ -0,0 +1,122 @@
+import random
+
+from django.db import transaction
+
+from .laptimes import parse_lap_time
+from .matrix import session_order
+from .models import Season, EventLocation, Event, Session, Result, Rider, Brand, Team, Category
+from .points import points_for
+from .riders import normalize_name
+
+first_names = ['Marco', 'Luca', 'Jorge', 'Alex', 'Dani', 'Cal', 'Jack', 'Andrea', 'Johann', 'Tito', 'Franco', 'Karel',
+               'Xavier', 'Bradley', 'Thomas', 'Stefan', 'Sam', 'Joan', 'Jonas', 'Pol', 'Aleix', 'Danilo', 'Remy']
+last_names = ['BRANDINI', 'CORSETTI', 'MARTELL', 'OHARA', 'LINDE', 'ALLISTER', 'NUNEZ', 'SORENSEN', 'MULLER',
+              'ROSSETTI', 'GARCIA', 'LOWES', 'FERRANTI', 'NAKATA', 'KENT', 'PASINI', 'FOLGER', 'LECUONA', 'BINDER']
+
+
+def bulk_create(model, objects, key):
+    """
+    Insert objects in bulk and read back their primary keys, which SQLite does not return on bulk inserts.
+
+    :param model: Model of the objects
+    :param objects: Objects to insert
+    :param key: Names of the fields identifying an object
+    :return: Dictionary of key values: primary key
+    """
+    model.objects.bulk_create(objects, batch_size=500)
+    return {tuple(values[:-1]): values[-1] for values in model.objects.values_list(*key, 'pk')}
+
+
+def lap_time(milliseconds):
+    return f"{milliseconds // 60000}'{milliseconds % 60000 / 1000:06.3f}"
+
+
+def generate_history(first_season=1990, seasons=30, events=18, categories=('MotoGP', 'Moto2', 'Moto3'), riders=30,
+                     seed=0):
+    """
+    Fill the database with made up results, to measure the chart builders on decades of history.
+
+    Every season has the same events and categories, with each session of the season's weekend format. Riders are
+    drawn from a pool several times larger than a grid, so they come and go between seasons. Everything is inserted
+    in bulk, in a few hundred queries whatever the size.
+
+    :param first_season: First season generated
+    :param seasons: Number of seasons
+    :param events: Number of events per season
+    :param categories: Categories racing at each event
+    :param riders: Riders taking part in each session
+    :param seed: Seed of the random generator, the same seed gives the same history
+    :return: Number of results created
+    """
+    rng = random.Random(seed)
+    years = list(range(first_season, first_season + seasons))
+    with transaction.atomic():
+        category_ids = bulk_create(Category, [Category(class_name=name) for name in categories], ['class_name'])
+        location_ids = bulk_create(EventLocation, [EventLocation(location=f'S{number:02d}') for number in range(events)],
+                                   ['location'])
+        brand_ids = list(bulk_create(Brand, [Brand(brand_name=f'Brand {number}') for number in range(6)],
+                                     ['brand_name']).values())
+        team_ids = list(bulk_create(Team, [Team(team_name=f'Team {number}') for number in range(12)],
+                                    ['team_name']).values())
+        pool = [(f'{first} {last}{number or ""}', f'{last}{number or ""}'.lower(), first.lower(), 'xx')
+                for number in range(riders * len(categories) * 3 // (len(first_names) * len(last_names)) + 1)
+                for first in first_names for last in last_names]
+        rider_ids = list(bulk_create(Rider, [Rider(full_name=full, last_name=last, first_name=first, nationality=nation,
+                                                   normalized_key=normalize_name(full))
+                                             for full, last, first, nation in pool],
+                                     ['normalized_key']).values())
+        rng.shuffle(rider_ids)
+
+        season_ids = bulk_create(Season, [Season(year=year) for year in years], ['year'])
+        Season.categories.through.objects.bulk_create([
+            Season.categories.through(season_id=season_id, category_id=category_id)
+            for season_id in season_ids.values() for category_id in category_ids.values()])
+        event_ids = bulk_create(Event, [Event(season_id=season_ids[(year, )], event_location_id=location_id)
+                                        for year in years for location_id in location_ids.values()],
+                                ['season_id', 'event_location_id'])
+        Event.categories.through.objects.bulk_create([
+            Event.categories.through(event_id=event_id, category_id=category_id)
+            for event_id in event_ids.values() for category_id in category_ids.values()])
+
+        sessions = []
+        for year in years:
+            for location_id in location_ids.values():
+                event_id = event_ids[(season_ids[(year, )], location_id)]
+                for category_id in category_ids.values():
+                    for session_type in session_order(year):
+                        sessions.append(Session(event_id=event_id, category_id=category_id, session_type=session_type,
+                                                point_event=session_type == 'RAC', source_url=''))
+        session_ids = bulk_create(Session, sessions, ['event_id', 'category_id', 'session_type'])
+
+        created = 0
+        year_of_season = {season_id: year for (year, ), season_id in season_ids.items()}
+        year_of_event = {event_id: year_of_season[season_id] for (season_id, _), event_id in event_ids.items()}
+        results = []
+        grids = {}
+        for (event_id, category_id, session_type), session_id in session_ids.items():
+            year = year_of_event[event_id]
+            if (year, category_id) not in grids:
+                # Same grid all season long, part of the pool changes every season
+                offset = (year - first_season) * riders // 4 + list(category_ids.values()).index(category_id) * riders
+                grids[(year, category_id)] = [rider_ids[(offset + number) % len(rider_ids)] for number in range(riders)]
+            grid = list(grids[(year, category_id)])
+            rng.shuffle(grid)
+            if session_type == 'Q1':
+                grid = grid[10:]
+            elif session_type == 'Q2':
+                grid = grid[:12]
+            best = rng.randint(95000, 125000)
+            for position, rider_id in enumerate(grid, start=1):
+                time = lap_time(best + position * rng.randint(50, 400))
+                speed = round(rng.uniform(250, 350), 1)
+                results.append(Result(rider_id=rider_id, brand_id=rng.choice(brand_ids), team_id=rng.choice(team_ids),
+                                      session_id=session_id, position=position, top_speed=str(speed), time=time,
+                                      speed_kmh=speed, time_ms=parse_lap_time(time),
+                                      points=points_for(year, position) if session_type == 'RAC' else 0))
+            if len(results) >= 5000:
+                Result.objects.bulk_create(results, batch_size=500)
+                created += len(results)
+                results = []
+        Result.objects.bulk_create(results, batch_size=500)
+        created += len(results)
+    return created
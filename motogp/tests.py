@@ -1,13 +1,41 @@
 import datetime
+import gzip
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
 
-from django.test import TestCase
+from unittest import mock, skipIf
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.utils import timezone
 
 
-from .models import Season, EventLocation, Event, Session, Result, Rider, Brand, Team, Category
+from .models import Season, EventLocation, Event, Session, Result, Rider, Brand, Team, Category, UpdateData, \
+    PageValidator, MenuOptions
 
-from .scraper import insert_in_database
+from .benchmark import benchmark_charts, chart_builders, load_corpus, query_budgets, run_benchmark, serve_corpus
+from .cache import bump_data_version, state_cache
+from .chart_cache import ChartCache
+from .charts import ChartSpec, create_chart, shared_series, shared_stylesheet
+from . import export, extract, metrics, scraper
+from .laptimes import parse_lap_time, parse_speed
+from .matrix import SessionMatrix
+from .page_cache import PageCache
+from .points import points_for
+from .profiling import profile_run, profiler
+from .riders import normalize_name, split_name
+from .store import ResultsStore
+from .synthetic import generate_history
+from .svg import optimize, read_manifest, static_stylesheet, write_hashed
+from .scraper import chart_changed, chart_data, insert_in_database, scrape_data, IngestLookups, TokenBucket, get_options, get_results_from, validators
 
 
 test_scraped_race_data = [
@@ -137,6 +165,478 @@ class DatabaseInsertionTests(TestCase):
         pass
 
 
+# Results page as served by motogp.com, with the quirks the parsers have to deal with
+test_results_page = """<!DOCTYPE html>
+<html><head><title>Results</title><meta charset="utf-8"><script>var cell = "<td>x</td>";</script></head><body>
+<select id="season"><option value="2017">2017</option><option value="2018" selected>2018</option></select>
+<select id="session"><option value="FP1">FP1</option><option value="RAC">Race</option><optgroup><option value="X">
+</option></optgroup></select>
+<div class="c-results padbot5">Grand Prix of <b>Qatar</b> &amp; more<br>Losail</div>
+<table><thead><tr><th>Pos.</th><th>Points</th><th>Num.</th><th>Rider</th><th>Nation</th><th>Team</th><th>Bike</th>
+<th>Km/h</th><th>Time/Gap</th></tr></thead>
+<tbody>
+<tr><td>1</td><td>25</td><td>4</td><td><a href="/rider/1">Andrea DOVIZIOSO</a></td><td>ITA</td><td>Ducati Team</td>
+<td>Ducati</td><td>344.9</td><td>42'34.654</td></tr>
+<tr><td>2</td><td>20</td><td>93</td><td><a href="/rider/2">Marc MARQUEZ</a></td><td>SPA</td><td>Repsol Honda Team</td>
+<td>Honda</td><td>342.6</td><td>+0.027</td></tr>
+<tr><td colspan="9">Not Classified</td></tr>
+<tr><td></td><td></td><td>46</td><td>Valentino ROSSI</td><td>ITA</td><td>Movistar Yamaha MotoGP</td><td>Yamaha
+</td><td>341.9<td>5 Laps</tr>
+<tr><td>&nbsp;</td></tr>
+</tbody></table>
+<table><tr><td>Fastest Lap: </td><td>1'55.352</td></tr></table>
+</body></html>"""
+
+
+def scraped_page(rows, point_event=False):
+    """ Results laid out as returned by get_results_from """
+    if point_event:
+        header = ['Pos.', 'Points', 'Num.', 'Rider', 'Nation', 'Team', 'Bike', 'Km/h', 'Time/Gap']
+    else:
+        header = ['Pos.', 'Num.', 'Rider', 'Nation', 'Team', 'Bike', 'Km/h', 'Time', 'Gap 1st/Prev.']
+    return tuple(['scraped_source_url', 'event info', header] + [row for [row] in rows])
+
+
+class BulkInsertionTests(TestCase):
+
+    def test_results_stored_in_bulk(self):
+        """=> A session should be stored with a bounded number of queries, whatever its number of riders"""
+        results = scraped_page(test_scraped_timed_data[2:])
+        insert_in_database('1900', 'XXXX', '1cc', 'FP1', results)
+        self.assertEqual(13, Result.objects.count())
+        self.assertEqual(13, Rider.objects.count())
+        self.assertEqual(['Dummy RIDERONE', 'Dummy RIDERTWO'],
+                         [r.rider.full_name for r in Result.objects.order_by('position')[:2]])
+
+        # Dimension rows are all known once the lookups are warm
+        lookups = IngestLookups()
+        insert_in_database('1900', 'XXXX', '1cc', 'FP2', results, lookups=lookups)
+        with self.assertNumQueries(7):
+            insert_in_database('1900', 'XXXX', '1cc', 'FP3', results, lookups=lookups)
+
+    def test_existing_rows_reused(self):
+        """=> Rows created outside the lookups should be found through their natural key"""
+        lookups = IngestLookups()
+        Team.objects.create(team_name='TeamOne')
+        teams = lookups.resolve(Team, [('TeamOne', ), ('TeamTwo', )])
+        self.assertEqual(2, Team.objects.count())
+        self.assertEqual(Team.objects.get(team_name='TeamOne'), teams[('TeamOne', )])
+
+    def test_rider_identity(self):
+        """=> A rider scraped under another spelling or nationality should not be duplicated"""
+        insert_in_database('1900', 'XXXX', '1cc', 'RAC', scraped_page(test_scraped_race_data[2:], point_event=True))
+        riders = Rider.objects.count()
+        renamed = [[('1', '11', 'Dummy RÍDERONE', 'COUNTRYTWO', 'TeamOne', 'BrandOne', '111.1', "1'11'111", '')],
+                   [('2', '22', 'Dummy  RIDERONE', 'COUNTRYONE', 'TeamOne', 'BrandOne', '222.2', "2'22'222", '')]]
+        insert_in_database('1900', 'XXXX', '1cc', 'FP1', scraped_page(renamed))
+        self.assertEqual(riders, Rider.objects.count())
+        rider = Rider.objects.get(normalized_key='dummy riderone')
+        self.assertEqual(['Dummy  RIDERONE', 'Dummy RIDERONE', 'Dummy RÍDERONE'],
+                         sorted(rider.aliases.values_list('name', flat=True)))
+        self.assertEqual([rider.pk] * 2,
+                         list(Result.objects.filter(session__session_type='FP1').values_list('rider', flat=True)))
+
+    def test_rider_names(self):
+        """=> Scraped names should be split on their upper case last name and normalized for identity"""
+        self.assertEqual(('dummy', 'rider three'), split_name('Dummy RIDER THREE'))
+        self.assertEqual(('jorge', 'martín'), split_name('Jorge MARTÍN'))
+        self.assertEqual(('dummy', 'mcriderfour'), split_name('Dummy McRIDERFOUR'))
+        self.assertEqual(('kenny', 'roberts jr'), split_name('Kenny ROBERTS Jr'))
+        self.assertIsNone(split_name('ROSSI'))
+        self.assertEqual('jorge martin', normalize_name('Jorge  MARTÍN'))
+
+    def test_insert_again_replaces_results(self):
+        """=> Scraping a session twice should not duplicate its results"""
+        results = scraped_page(test_scraped_race_data[2:], point_event=True)
+        insert_in_database('1900', 'XXXX', '1cc', 'RAC', results)
+        insert_in_database('1900', 'XXXX', '1cc', 'RAC', results)
+        self.assertEqual(1, Session.objects.count())
+        self.assertEqual(4, Result.objects.count())
+
+    def test_restarted_race_replaces_race(self):
+        """=> RAC2 should replace the original RAC session"""
+        results = scraped_page(test_scraped_race_data[2:], point_event=True)
+        insert_in_database('1900', 'XXXX', '1cc', 'RAC', results)
+        insert_in_database('1900', 'XXXX', '1cc', 'RAC2', results)
+        session = Session.objects.get()
+        self.assertEqual('RAC', session.session_type)
+        self.assertTrue(session.point_event)
+
+
+class MenuOptionsTests(TestCase):
+
+    def test_rebuild(self):
+        """=> The menu should list seasons, events and categories both ways"""
+        results = scraped_page(test_scraped_race_data[2:], point_event=True)
+        insert_in_database('1900', 'XXXX', '1cc', 'RAC', results)
+        insert_in_database('1900', 'YYYY', '2cc', 'RAC', results)
+        insert_in_database('1901', 'XXXX', '1cc', 'RAC', results)
+        self.assertFalse(MenuOptions.objects.exists(), msg='Menu should only be rebuilt on demand')
+
+        with self.assertNumQueries(9):
+            menu = json.loads(MenuOptions.rebuild().JSON_menu)
+        self.assertEqual({'1900': {'XXXX': {'1cc': True}, 'YYYY': {'2cc': True}}, '1901': {'XXXX': {'1cc': True}}},
+                         menu['season_data'])
+        self.assertEqual(['XXXX', 'YYYY'], list(menu['event_data']))
+        self.assertEqual(['1900', '1901'], list(menu['event_data']['XXXX']))
+
+
+class SeasonChartTests(TestCase):
+
+    def setUp(self):
+        race = test_scraped_race_data[2:]
+        insert_in_database('2015', 'XXXX', '1cc', 'RAC', scraped_page(race, point_event=True))
+        insert_in_database('2015', 'YYYY', '1cc', 'FP1', scraped_page(test_scraped_timed_data[2:]))
+        insert_in_database('2015', 'YYYY', '1cc', 'RAC', scraped_page(race[::-1], point_event=True))
+
+    def test_season_chart_points(self):
+        """=> Season chart should hold cumulative points after each round, leader first"""
+        season = Season.objects.get(year=2015)
+        with self.assertNumQueries(2):
+            data = season.season_chart_data()['1cc']
+        self.assertEqual(['XXXX', 'YYYY'], data['columns'])
+        self.assertEqual('2015 1cc Championship', data['title'])
+        riders = [rider for rider in data if rider not in ('title', 'columns')]
+        # Ties broken by the previous round
+        self.assertEqual(['D. RIDERONE', 'D. MCRIDERFOUR', 'D. RIDERTWO', 'D. RIDER THREE'], riders)
+        self.assertEqual([13, 38], data['D. MCRIDERFOUR'])
+        self.assertEqual([25, 38], data['D. RIDERONE'])
+        self.assertEqual([20, 36], data['D. RIDERTWO'])
+
+    def test_standings(self):
+        """=> Standings should come from stored points in one query, qualifying sessions excluded"""
+        with self.assertNumQueries(1):
+            standings = list(Result.objects.filter(session__event__season__year=2015).standings())
+        names = [Rider.objects.get(pk=row['rider']).full_name for row in standings]
+        self.assertEqual([38, 38, 36, 36], [row['total_points'] for row in standings])
+        self.assertEqual({'Dummy RIDERONE', 'Dummy McRIDERFOUR'}, set(names[:2]))
+
+    def test_points_scales(self):
+        """=> Points should follow the scale of the season"""
+        self.assertEqual(25, points_for(2015, 1))
+        self.assertEqual(0, points_for(2015, 16))
+        self.assertEqual(20, points_for(1990, 1))
+        self.assertEqual(15, points_for(1992, 2))
+        self.assertEqual(8, points_for(1960, 1))
+        self.assertEqual(0, points_for(1900, 1))
+        insert_in_database('1960', 'XXXX', '1cc', 'RAC', scraped_page(test_scraped_race_data[2:], point_event=True))
+        self.assertEqual([8, 6, 4, 3], list(Result.objects.filter(session__event__season__year=1960)
+                                              .order_by('position').values_list('points', flat=True)))
+
+
+class EventHistoryChartTests(TestCase):
+
+    def setUp(self):
+        race = test_scraped_race_data[2:]
+        insert_in_database('1900', 'XXXX', '500cc', 'RAC', scraped_page(race, point_event=True))
+        insert_in_database('1901', 'YYYY', 'MotoGP', 'RAC', scraped_page(race, point_event=True))
+        insert_in_database('1902', 'XXXX', 'MotoGP', 'RAC', scraped_page(race[:2][::-1], point_event=True))
+
+    def test_position_matrix(self):
+        """=> Event history should list positions per season at this location only, merging replaced classes"""
+        event = Event.objects.select_related('season', 'event_location').get(season__year=1902)
+        with self.assertNumQueries(2):
+            charts = event.event_history_chart_data()
+        self.assertEqual(['MotoGP'], list(charts))
+        data = charts['MotoGP']
+        self.assertEqual(['1900', '1902'], data['columns'])
+        self.assertEqual([1, 2], data['D. RIDERONE'])
+        self.assertEqual([2, 1], data['D. RIDERTWO'])
+        self.assertEqual([3, None], data['D. RIDER THREE'])
+        riders = [rider for rider in data if rider not in ('title', 'columns')]
+        self.assertEqual(['D. RIDERTWO', 'D. RIDERONE', 'D. RIDER THREE', 'D. MCRIDERFOUR'], riders)
+
+
+class LapTimeTests(TestCase):
+
+    def test_parse_lap_time(self):
+        """=> Scraped times should convert to milliseconds, gaps should not"""
+        self.assertEqual(91234, parse_lap_time("1'31.234"))
+        self.assertEqual(71111, parse_lap_time("1'11'111"))
+        self.assertEqual(2483456, parse_lap_time("41'23.456"))
+        self.assertEqual(58900, parse_lap_time('58.9'))
+        self.assertIsNone(parse_lap_time('+0.123'))
+        self.assertIsNone(parse_lap_time('1 Lap'))
+        self.assertIsNone(parse_lap_time(''))
+        self.assertEqual(341.2, parse_speed('341.2'))
+        self.assertIsNone(parse_speed(''))
+
+    def test_best_times(self):
+        """=> Best times should be ordered numerically in SQL"""
+        insert_in_database('2015', 'XXXX', '1cc', 'FP1', scraped_page(test_scraped_timed_data[2:]))
+        best = list(Result.objects.best_times()[:3])
+        names = [Rider.objects.get(pk=row['rider']).full_name for row in best]
+        # 2'22 is faster than 10'44, unlike the strings
+        self.assertEqual(['Dummy RIDERONE', 'Dummy RIDERTWO', 'Dummy RIDER THREE'], names)
+        self.assertEqual(111.1, Result.objects.fastest().first().speed_kmh)
+
+
+class SessionMatrixTests(TestCase):
+
+    def test_missing_riders_backfilled(self):
+        """=> Riders missing from Q2 keep their previous position, riders missing from the race go to the bottom"""
+        matrix = SessionMatrix.build({
+            'FP1': [('A', 1, 1), ('B', 2, 2), ('C', 3, 3), ('D', 4, 4)],
+            'Q2': [('B', 1, 1), ('A', 2, 2)],
+            'RAC': [('A', 1, 1), ('C', 2, 2)],
+        }, ['FP1', 'Q2', 'RAC'])
+        self.assertEqual(['FP1', 'Q2', 'RAC'], matrix.columns)
+        self.assertEqual([('A', [1, 2, 1]), ('C', [3, 3, 2]), ('B', [2, 1, 3]), ('D', [4, 4, 4])], list(matrix))
+
+    def test_fastest_riders_skip_Q1(self):
+        """=> The fastest practice riders should be placed ahead of the Q1 riders"""
+        practice = [(f'R{i}', i, i) for i in range(1, 12)]
+        matrix = SessionMatrix.build({'FP1': practice, 'Q1': [('R11', 1, 0), ('R10', 2, 0)]}, ['FP1', 'Q1'])
+        self.assertEqual([f'R{i}' for i in range(1, 12)], matrix.riders)
+        self.assertEqual([10, 10], matrix.positions[9])
+        self.assertEqual([11, 11], matrix.positions[10])
+
+    def test_event_matrices(self):
+        """=> Event matrices should be built from two queries"""
+        insert_in_database('2015', 'XXXX', '1cc', 'FP1', scraped_page(test_scraped_timed_data[2:]))
+        insert_in_database('2015', 'XXXX', '1cc', 'RAC', scraped_page(test_scraped_race_data[2:], point_event=True))
+        event = Event.objects.select_related('season').get()
+        with self.assertNumQueries(2):
+            matrix = event.session_matrices()['1cc']
+        self.assertEqual(['FP1', 'RAC'], matrix.columns)
+        self.assertEqual(13, len(matrix))
+        self.assertEqual([1, 1], matrix.positions[0])
+
+
+class ChartRenderingTests(TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.base_dir.cleanup)
+        self.charts_dir = os.path.join(self.base_dir.name, 'motogp', 'static', 'motogp', 'charts')
+        os.makedirs(self.charts_dir)
+        for event in ('XXXX', 'YYYY'):
+            insert_in_database('2015', event, '1cc', 'RAC', scraped_page(test_scraped_race_data[2:], point_event=True))
+
+    def test_parallel_rendering(self):
+        """=> Charts rendered by worker processes should all be written and checkpointed"""
+        with override_settings(BASE_DIR=self.base_dir.name):
+            chart_data(start_year=2015, jobs=2)
+        manifest = read_manifest(self.charts_dir)
+        self.assertEqual(['2015-1cc.svg', '2015-XXXX-1cc.svg', '2015-YYYY-1cc.svg', 'XXXX-1cc.svg', 'YYYY-1cc.svg'],
+                         sorted(manifest))
+        for name in manifest.values():
+            self.assertTrue(os.path.exists(os.path.join(self.charts_dir, name)))
+            self.assertTrue(os.path.exists(os.path.join(self.charts_dir, name + '.gz')))
+        update_data = UpdateData.objects.get()
+        self.assertEqual(2015, update_data.most_recent_charted_season)
+        self.assertEqual('YYYY', update_data.most_recent_charted_event)
+
+    def test_history_charts_submitted_once(self):
+        """=> A history chart should be rendered once per run, from the latest event at its location"""
+        insert_in_database('2016', 'XXXX', '1cc', 'RAC', scraped_page(test_scraped_race_data[2:], point_event=True))
+        with override_settings(BASE_DIR=self.base_dir.name):
+            # 2 championship, 3 session and 2 history charts
+            self.assertEqual(7, chart_data(start_year=2015, jobs=2))
+        with open(os.path.join(self.charts_dir, read_manifest(self.charts_dir)['XXXX-1cc.svg']), 'rb') as file:
+            self.assertIn(b'>2016<', file.read())
+
+    def test_written_charts_served(self):
+        """=> Pages should link to the written chart files, served with their stylesheet and far-future caching"""
+        insert_in_database('2015', 'XXXX', 'MotoGP', 'RAC', scraped_page(test_scraped_race_data[2:], point_event=True))
+        with override_settings(BASE_DIR=self.base_dir.name):
+            self.assertIn(reverse('motogp:season_chart', args=[2015, 'MotoGP']).encode(),
+                          self.client.get(reverse('motogp:season', args=[2015])).content)
+            chart_data(start_year=2015)
+            written = read_manifest(self.charts_dir)['2015-MotoGP.svg']
+            url = reverse('motogp:chart_file', args=[written])
+            self.assertIn(url.encode(), self.client.get(reverse('motogp:season', args=[2015])).content)
+
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual('gzip', response['Content-Encoding'])
+            self.assertIn('immutable', response['Cache-Control'])
+            chart = gzip.decompress(response.content)
+            self.assertIn(b'2015 MotoGP Championship', chart)
+            href = re.search(rb'<\?xml-stylesheet type="text/css" href="([^"]*)"', chart).group(1)
+            stylesheet = self.client.get(href.decode())
+            self.assertEqual('text/css', stylesheet['Content-Type'])
+            self.assertEqual(404, self.client.get(reverse('motogp:chart_file', args=['manifest.json'])).status_code)
+
+    def test_only_changed_charts_rendered(self):
+        """=> Only charts fed by newly scraped sessions and whose data changed should be rendered"""
+        with override_settings(BASE_DIR=self.base_dir.name):
+            self.assertEqual(5, chart_changed())
+            self.assertEqual(0, chart_changed())
+
+            # Practice only feeds the session chart
+            insert_in_database('2015', 'YYYY', '1cc', 'FP1', scraped_page(test_scraped_timed_data[2:]))
+            self.assertEqual(1, chart_changed())
+
+            # Same race results again: dependent charts are checked but unchanged
+            insert_in_database('2015', 'XXXX', '1cc', 'RAC', scraped_page(test_scraped_race_data[2:], point_event=True))
+            self.assertEqual(0, chart_changed())
+
+            # New race results feed the session, history and championship charts
+            race = scraped_page(test_scraped_race_data[2:][::-1], point_event=True)
+            insert_in_database('2015', 'XXXX', '1cc', 'RAC', race)
+            self.assertEqual(3, chart_changed())
+
+    def test_backfilled_history(self):
+        """=> History charts should be rendered once per location, from its latest event, even when backfilling"""
+        with override_settings(BASE_DIR=self.base_dir.name):
+            chart_changed()
+            insert_in_database('2016', 'XXXX', '1cc', 'RAC', scraped_page(test_scraped_race_data[2:], point_event=True))
+            chart_changed()
+            insert_in_database('2014', 'XXXX', '1cc', 'RAC', scraped_page(test_scraped_race_data[2:], point_event=True))
+            # Session, history and championship charts of the backfilled season
+            self.assertEqual(3, chart_changed())
+        with open(os.path.join(self.charts_dir, read_manifest(self.charts_dir)['XXXX-1cc.svg']), 'rb') as file:
+            chart = file.read()
+        for year in (b'2014', b'2015', b'2016'):
+            self.assertIn(b'>%s<' % year, chart)
+
+    def test_profile_report(self):
+        """=> A profiled run should report each phase, with the measures of chart rendering worker processes"""
+        report_path = os.path.join(self.base_dir.name, 'profile.json')
+        url = scraper.base_page + '2018/QAT/MotoGP/RAC'
+        with override_settings(BASE_DIR=self.base_dir.name), profile_run(report_path, command='test'):
+            with serve_corpus(load_corpus()):
+                get_results_from(url)
+            chart_data(start_year=2015, jobs=2)
+        with open(report_path) as file:
+            report = json.load(file)
+
+        self.assertEqual('test', report['command'])
+        self.assertEqual(['fetch', 'parse'], list(report['urls'][url]))
+        # Loading the results store, then per event: event history and session history, then the season
+        self.assertEqual(6, report['phases']['aggregate']['count'])
+        self.assertEqual(6, len(report['builds']))
+        self.assertGreater(report['phases']['aggregate']['queries'], 0)
+        self.assertEqual(5, report['phases']['render']['count'])
+        self.assertEqual(sorted(read_manifest(self.charts_dir)), sorted(report['charts']))
+        self.assertEqual(['render', 'write'], list(report['charts']['2015-1cc.svg']))
+        self.assertGreater(report['peak_memory'], 0)
+        self.assertFalse(profiler.enabled)
+
+
+class PageCacheViewTests(TestCase):
+
+    def setUp(self):
+        insert_in_database('1900', 'XXXX', '1cc', 'RAC', scraped_page(test_scraped_race_data[2:], point_event=True))
+        bump_data_version()
+
+    def test_warm_requests_skip_database(self):
+        """=> Cached pages should be served without queries until the data version changes"""
+        url = reverse('motogp:season', args=[1900])
+        response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        with self.assertNumQueries(0):
+            cached = self.client.get(url)
+        self.assertEqual(response.content, cached.content)
+
+        insert_in_database('1900', 'YYYY', '1cc', 'RAC', scraped_page(test_scraped_race_data[2:], point_event=True))
+        MenuOptions.rebuild()
+        bump_data_version()
+        self.assertContains(self.client.get(url), 'YYYY')
+
+
+@override_settings(METRICS_ENABLED=True)
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.base_dir.cleanup)
+        os.makedirs(os.path.join(self.base_dir.name, 'motogp', 'static', 'motogp', 'charts'))
+        metrics.job_counts.clear()
+        patcher = mock.patch.object(metrics, 'view_metrics', metrics.ViewMetrics())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Measures are totalled in the state cache
+        state_cache().clear()
+        insert_in_database('2015', 'XXXX', '1cc', 'RAC', scraped_page(test_scraped_race_data[2:], point_event=True))
+
+    def test_view_metrics(self):
+        """=> Latency and queries of motogp views should be exposed per view, in the Prometheus text format"""
+        for _ in range(2):
+            self.client.get(reverse('motogp:season_data', args=[2015]))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual('text/plain; version=0.0.4; charset=utf-8', response['Content-Type'])
+        lines = response.content.decode().splitlines()
+        self.assertIn('motogp_view_duration_seconds_count{view="season_data"} 2', lines)
+        self.assertIn('motogp_view_duration_seconds_bucket{view="season_data",le="+Inf"} 2', lines)
+        self.assertIn('motogp_view_queries_count{view="season_data"} 2', lines)
+        self.assertFalse([line for line in lines if 'view="metrics"' in line])
+
+    def test_retired_instances(self):
+        """=> Measures of a process which stopped flushing should be kept in the totals, and its key dropped"""
+        self.client.get(reverse('motogp:season_data', args=[2015]))
+        stopped = metrics.ViewMetrics()
+        stopped.observe('season_data', 0.1, 1)
+        stopped.flush(force=True)
+        instances = state_cache().get(metrics.instances_key)
+        instances[stopped.instance] = time.time() - 2 * settings.METRICS_INSTANCE_TTL
+        state_cache().set(metrics.instances_key, instances)
+
+        lines = self.client.get(reverse('metrics')).content.decode().splitlines()
+        self.assertIn('motogp_view_duration_seconds_count{view="season_data"} 2', lines)
+        self.assertNotIn(stopped.instance, state_cache().get(metrics.instances_key))
+        self.assertIsNone(state_cache().get(metrics.views_key + stopped.instance))
+
+        # Back from idle, a retired process should only publish what it measured since
+        stopped.observe('season_data', 0.1, 1)
+        stopped.flush(force=True)
+        lines = self.client.get(reverse('metrics')).content.decode().splitlines()
+        self.assertIn('motogp_view_duration_seconds_count{view="season_data"} 3', lines)
+
+    def test_job_metrics(self):
+        """=> Counters published by the update jobs should be exposed with the time of their last success"""
+        with override_settings(BASE_DIR=self.base_dir.name):
+            self.assertEqual(3, chart_changed())
+        # Rendered on demand by a view
+        with mock.patch('motogp.views.chart_cache', ChartCache(os.path.join(self.base_dir.name, 'chart_cache'))):
+            bump_data_version()
+            self.client.get(reverse('motogp:season_chart', args=[2015, '1cc']))
+        lines = self.client.get(reverse('metrics')).content.decode().splitlines()
+        self.assertIn('motogp_charts_rendered_total 4', lines)
+        self.assertIn(f'motogp_rows_ingested_total {Result.objects.count()}', lines)
+        self.assertIn('motogp_job_runs_total{job="charts"} 1', lines)
+        self.assertIn('motogp_job_failures_total{job="charts"} 0', lines)
+        self.assertTrue([line for line in lines
+                         if line.startswith('motogp_job_last_success_timestamp_seconds{job="charts"}')])
+
+    def test_local_only(self):
+        """=> The metrics endpoint should only answer the allowed addresses"""
+        self.assertEqual(404, self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.1').status_code)
+
+
+class ChartDataViewTests(TestCase):
+
+    def setUp(self):
+        insert_in_database('2015', 'XXXX', '1cc', 'RAC', scraped_page(test_scraped_race_data[2:], point_event=True))
+        insert_in_database('2015', 'XXXX', '1cc', 'FP1', scraped_page(test_scraped_timed_data[2:]))
+        bump_data_version()
+
+    def test_series(self):
+        """=> Chart data endpoints should return columns, riders and one row of values per rider"""
+        data = self.client.get(reverse('motogp:season_data', args=[2015])).json()['charts'][0]
+        self.assertEqual('1cc', data['category'])
+        self.assertEqual(['XXXX'], data['columns'])
+        self.assertEqual('D. RIDERONE', data['riders'][0])
+        self.assertEqual([[25], [20], [16], [13]], data['values'])
+
+        data = self.client.get(reverse('motogp:event_data', args=[2015, 'XXXX'])).json()['charts'][0]
+        self.assertEqual(['FP1', 'RAC'], data['columns'])
+        data = self.client.get(reverse('motogp:track_data', args=['XXXX'])).json()['charts'][0]
+        self.assertEqual(['2015'], data['columns'])
+        self.assertEqual(404, self.client.get(reverse('motogp:track_data', args=['YYYY'])).status_code)
+
+    def test_revalidation(self):
+        """=> Clients holding the current ETag should get a 304 until the data version changes"""
+        url = reverse('motogp:season_data', args=[2015])
+        response = self.client.get(url)
+        self.assertTrue(response.has_header('Last-Modified'))
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(304, self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code)
+        bump_data_version()
+        self.assertEqual(200, self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code)
+
+
 class SeasonViewTests(TestCase):
 
     def setUp(self):
@@ -163,6 +663,432 @@ class SeasonViewTests(TestCase):
     #     self.assertEqual(response, season_response)
 
 
+class ConcurrentScrapeTests(TestCase):
+    menus = {
+        'event': ['AAA', 'BBB', 'CCC'],
+        'category': ['1cc', '2cc'],
+        'session': ['FP1', 'RAC'],
+    }
+
+    def fake_options(self, source_url, tag, only_accept_after=None, conditional=False):
+        return {option: [] for option in self.menus[tag]}
+
+    @staticmethod
+    def fake_results(source_url, conditional=False):
+        # Finish out of order
+        time.sleep(random.random() / 100)
+        return (source_url, '')
+
+    def test_results_inserted_in_menu_order(self):
+        """=> Concurrent fetches should still be stored in menu order and checkpoint the last event"""
+        year = timezone.now().year
+        with mock.patch('motogp.scraper.get_options', side_effect=self.fake_options), \
+                mock.patch('motogp.scraper.get_results_from', side_effect=self.fake_results), \
+                mock.patch('motogp.scraper.insert_in_database') as insert:
+            scrape_data(start_season=year, workers=4)
+
+        inserted = [call[0][1:4] for call in insert.call_args_list]
+        expected = [(e, c, s) for e in self.menus['event'] for c in self.menus['category'] for s in self.menus['session']]
+        self.assertEqual(expected, inserted, msg='Sessions not inserted in menu order')
+        for call in insert.call_args_list:
+            season, event, category, session, results = call[0]
+            self.assertTrue(results[0].endswith(f'/{event}/{category}/{session}'), msg='Results mismatched')
+
+        update_data = UpdateData.objects.get()
+        self.assertEqual(year, update_data.most_recent_scraped_season)
+        self.assertEqual('CCC', update_data.most_recent_scraped_event)
+
+    def test_failed_insert_cancels_downloads(self):
+        """=> A failing insert should surface at once, cancelling the downloads queued behind it"""
+        fetched = []
+
+        def slow_results(source_url, conditional=False):
+            time.sleep(0.05)
+            fetched.append(source_url)
+            return (source_url, '')
+
+        with mock.patch('motogp.scraper.get_options', side_effect=self.fake_options), \
+                mock.patch('motogp.scraper.get_results_from', side_effect=slow_results), \
+                mock.patch('motogp.scraper.insert_in_database', side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                scrape_data(start_season=timezone.now().year, workers=2)
+        # 12 sessions queued, only those already started by the 2 workers are fetched
+        self.assertLess(len(fetched), 6)
+
+    def test_token_bucket_rate(self):
+        """=> Token bucket should space out requests according to its rate"""
+        bucket = TokenBucket(rate=100)
+        start = time.monotonic()
+        for _ in range(5):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+
+    def test_invalid_rate_and_workers(self):
+        """=> A rate or a number of workers which is not above 0 should be rejected before scraping"""
+        with mock.patch('motogp.management.commands.updatescrapeddata.scrape_data') as scrape:
+            for option in (['--rate', '0'], ['--workers', '0'], ['--workers', '-2'], ['--rate', 'fast']):
+                with self.assertRaises(CommandError, msg=option):
+                    call_command('updatescrapeddata', *option)
+            scrape.assert_not_called()
+        with self.assertRaises(ValueError):
+            TokenBucket(rate=0)
+
+    def test_connection_pools_sized_from_workers(self):
+        """=> Each scraping thread should keep its connection alive"""
+        with mock.patch('motogp.scraper.get_options', side_effect=self.fake_options), \
+                mock.patch('motogp.scraper.get_results_from', side_effect=self.fake_results), \
+                mock.patch('motogp.scraper.insert_in_database'):
+            scrape_data(start_season=timezone.now().year, workers=6)
+        self.assertEqual(6, scraper.http_session.get_adapter('http://www.motogp.com/')._pool_maxsize)
+
+
+class ConditionalRequestTests(TestCase):
+    url = 'http://example.com/2018'
+    menu_page = '<select id="event"><option value="QAT">Qatar</option><option value="ARG">Argentina</option></select>'
+
+    def setUp(self):
+        validators.load()
+        self.cache_dir = tempfile.TemporaryDirectory()
+        patcher = mock.patch('motogp.scraper.page_cache', PageCache(self.cache_dir.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.cache_dir.cleanup)
+
+    @staticmethod
+    def response(status=200, text='', headers=None):
+        return mock.Mock(status_code=status, text=text, headers=headers or {})
+
+    def test_unchanged_menu_reuses_options(self):
+        """=> A 304 menu page should reuse the options remembered from the previous run"""
+        first = self.response(text=self.menu_page, headers={'ETag': '"v1"'})
+        with mock.patch('motogp.scraper.download', return_value=first):
+            self.assertEqual(['QAT', 'ARG'], list(get_options(self.url, 'event')))
+        validators.flush()
+        self.assertEqual('"v1"', PageValidator.objects.get(url=self.url).etag)
+
+        validators.load()
+        with mock.patch('motogp.scraper.download', return_value=self.response(304)) as download:
+            self.assertEqual(['QAT', 'ARG'], list(get_options(self.url, 'event', conditional=True)))
+        self.assertEqual({'If-None-Match': '"v1"'}, download.call_args[1]['headers'])
+
+    def test_unchanged_results_skipped(self):
+        """=> A 304 results page should not be parsed again"""
+        with mock.patch('motogp.scraper.download', return_value=self.response(304)):
+            self.assertIsNone(get_results_from(self.url, conditional=True))
+
+
+class PageCacheTests(TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        self.cache = PageCache(self.cache_dir.name)
+
+    def test_identical_pages_stored_once(self):
+        """=> Pages with the same content should share one compressed body"""
+        self.cache.set('http://example.com/a', '<html>same</html>')
+        self.cache.set('http://example.com/b', '<html>same</html>')
+        self.assertEqual('<html>same</html>', self.cache.get('http://example.com/b'))
+        bodies = [name for _, _, files in os.walk(os.path.join(self.cache_dir.name, 'pages')) for name in files]
+        self.assertEqual(1, len(bodies))
+
+    def test_expired_and_evicted_entries_miss(self):
+        """=> Entries older than the TTL or evicted for size should not be served"""
+        self.cache.set('http://example.com/old', 'old page')
+        os.utime(self.cache.url_path('http://example.com/old'), (0, 0))
+        self.assertIsNone(self.cache.get('http://example.com/old', max_age=60))
+        self.assertEqual('old page', self.cache.get('http://example.com/old'))
+
+        self.cache.max_size = 0
+        self.assertEqual(1, self.cache.evict())
+        self.assertIsNone(self.cache.get('http://example.com/old'))
+
+    def test_replay_never_downloads(self):
+        """=> Replay mode should only read from the cache"""
+        self.cache.set('http://example.com/2018', '<select id="event"><option value="QAT">Qatar</option></select>')
+        self.cache.offline = True
+        with mock.patch('motogp.scraper.page_cache', self.cache), \
+                mock.patch('motogp.scraper.download') as download:
+            self.assertEqual(['QAT'], list(get_options('http://example.com/2018', 'event')))
+            self.assertEqual([], list(get_options('http://example.com/2019', 'event')))
+            self.assertIsNone(get_results_from('http://example.com/2018/QAT/MotoGP/RAC'))
+        download.assert_not_called()
+
+
+class ChartCacheTests(TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        self.cache = ChartCache(self.cache_dir.name)
+
+    @staticmethod
+    def spec(title):
+        return ChartSpec(None, {'title': title, 'columns': ['A'], 'rider': [1]}, {})
+
+    def test_tiers(self):
+        """=> Charts should be rendered once, then served from memory or disk until evicted"""
+        with mock.patch.object(ChartCache, 'render', side_effect=lambda spec: spec.data['title'].encode()):
+            self.assertEqual(b'one', self.cache.get_or_render(self.spec('one')))
+            self.assertEqual(b'one', self.cache.get_or_render(self.spec('one')))
+            self.cache.memory_size = 3
+            self.cache.get_or_render(self.spec('two'))
+            self.assertEqual(['two'], [chart.decode() for chart in self.cache.memory.values()])
+            # Dropped from memory, still on disk
+            self.assertEqual(b'one', self.cache.get_or_render(self.spec('one')))
+            self.assertEqual(2, self.cache.renders)
+
+            os.utime(self.cache.path(self.cache.key(self.spec('two'))), (0, 0))
+            self.cache.max_size = 3
+            self.cache.memory.clear()
+            self.assertEqual(1, self.cache.evict())
+            self.assertEqual(b'one', self.cache.get_or_render(self.spec('one')))
+            self.assertEqual(b'two', self.cache.get_or_render(self.spec('two')))
+            self.assertEqual(3, self.cache.renders)
+
+    def test_concurrent_requests_render_once(self):
+        """=> Concurrent requests for the same chart should wait for a single render"""
+        def slow_render(spec):
+            time.sleep(0.05)
+            return b'chart'
+
+        with mock.patch.object(ChartCache, 'render', side_effect=slow_render):
+            threads = [threading.Thread(target=self.cache.get_or_render, args=(self.spec('one'), )) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(1, self.cache.renders)
+
+    def test_chart_view(self):
+        """=> Chart views should render from the database on first request"""
+        insert_in_database('2015', 'XXXX', '1cc', 'RAC', scraped_page(test_scraped_race_data[2:], point_event=True))
+        bump_data_version()
+        with mock.patch('motogp.views.chart_cache', self.cache), \
+                mock.patch('motogp.svg.publish_stylesheet', side_effect=AssertionError) as publish:
+            response = self.client.get(reverse('motogp:season_chart', args=[2015, '1cc']))
+            self.assertEqual('image/svg+xml', response['Content-Type'])
+            self.assertIn(b'2015 1cc Championship', response.content)
+            # The stylesheet is served from the chart cache, not published to static files
+            publish.assert_not_called()
+            href = re.search(rb'<\?xml-stylesheet type="text/css" href="([^"]*)"', response.content).group(1)
+            stylesheet = self.client.get(href.decode())
+            self.assertEqual('text/css', stylesheet['Content-Type'])
+            self.assertIn(b'.graph', stylesheet.content)
+            self.assertEqual(404, self.client.get(reverse('motogp:chart_stylesheet', args=['chart.css'])).status_code)
+            identity_etag = response['ETag']
+            with self.assertNumQueries(0):
+                response = self.client.get(reverse('motogp:season_chart', args=[2015, '1cc']),
+                                           HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual('gzip', response['Content-Encoding'])
+            self.assertIn(b'2015 1cc Championship', gzip.decompress(response.content))
+            # Different bodies, different strong validators
+            self.assertEqual(identity_etag[:-1] + '-gz"', response['ETag'])
+            self.assertEqual(304, self.client.get(reverse('motogp:season_chart', args=[2015, '1cc']),
+                                                  HTTP_ACCEPT_ENCODING='gzip',
+                                                  HTTP_IF_NONE_MATCH=response['ETag']).status_code)
+            self.assertEqual(200, self.client.get(reverse('motogp:season_chart', args=[2015, '1cc']),
+                                                  HTTP_IF_NONE_MATCH=response['ETag']).status_code)
+            self.client.get(reverse('motogp:track_chart', args=['XXXX', '1cc']))
+            self.assertEqual(2, self.cache.renders)
+            self.assertEqual(404, self.client.get(reverse('motogp:season_chart', args=[2015, '2cc'])).status_code)
+
+
+class SvgTests(TestCase):
+
+    def setUp(self):
+        self.charts_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.charts_dir.cleanup)
+
+    def test_optimize(self):
+        """=> Charts should share one stylesheet and lose comments and excess precision"""
+        charts = [create_chart({'title': title, 'columns': ['A', 'B'], 'rider': [1, 2]}) for title in ('one', 'two')]
+        optimized = [optimize(chart, static_stylesheet(self.charts_dir.name)) for chart in charts]
+        self.assertLess(len(optimized[0]), len(charts[0]) * 0.8)
+        self.assertNotIn(b'<style', optimized[0])
+        self.assertNotIn(b'<!--', optimized[0])
+        self.assertNotIn(b'13.492307', optimized[0])
+        stylesheets = [name for name in os.listdir(self.charts_dir.name) if name.endswith('.css')]
+        self.assertEqual(1, len(stylesheets))
+        self.assertIn(stylesheets[0].encode(), optimized[1])
+
+    def test_shared_stylesheet(self):
+        """=> Charts with any number of series up to shared_series should link the same stylesheet"""
+        def chart(riders, **options):
+            data = {'title': 'title', 'columns': ['A', 'B']}
+            data.update((f'rider {index}', [1, 2]) for index in range(riders))
+            return optimize(create_chart(data, **options), static_stylesheet(self.charts_dir.name), shared_stylesheet())
+
+        optimized = [chart(2), chart(17, high_score_first=True), chart(shared_series)]
+        stylesheets = [name for name in os.listdir(self.charts_dir.name) if name.endswith('.css')]
+        self.assertEqual(1, len(stylesheets))
+        for svg in optimized:
+            self.assertIn(stylesheets[0].encode(), svg)
+        # Larger charts keep a stylesheet of their own, so all their series are styled
+        self.assertNotIn(stylesheets[0].encode(), chart(shared_series + 1))
+
+    def test_hashed_names(self):
+        """=> Charts should be written under content-hashed names, replacing their previous versions"""
+        path = os.path.join(self.charts_dir.name, '2015-1cc.svg')
+        first = write_hashed(path, b'<svg>one</svg>')
+        second = write_hashed(path, b'<svg>two</svg>')
+        self.assertNotEqual(first, second)
+        self.assertTrue(second.startswith('2015-1cc.'))
+        self.assertEqual(b'<svg>two</svg>', gzip.decompress(open(path.replace('2015-1cc.svg', second + '.gz'), 'rb').read()))
+        self.assertEqual([second, second + '.gz'], sorted(name for name in os.listdir(self.charts_dir.name)
+                                                         if not name.endswith('.br')))
+
+
+class ExtractionTests(TestCase):
+
+    def get_results(self, backend):
+        with override_settings(SCRAPER_PARSER=backend), \
+                mock.patch('motogp.scraper.fetch_page', return_value=test_results_page):
+            return get_results_from('http://example.com/results')
+
+    def test_backends_agree(self):
+        """=> Every extraction backend should produce the rows and options BeautifulSoup does"""
+        expected = self.get_results('bs4')
+        self.assertEqual('Grand Prix of Qatar & moreLosail', expected[1])
+        self.assertEqual(['Pos.', 'Points', 'Num.', 'Rider', 'Nation', 'Team', 'Bike', 'Km/h', 'Time/Gap'], expected[2])
+        self.assertEqual(('2', '20', '93', 'Marc MARQUEZ', 'SPA', 'Repsol Honda Team', 'Honda', '342.6', '+0.027'),
+                         expected[4])
+        self.assertEqual(6, len(expected))
+        self.assertEqual(('', '', '46', 'Valentino ROSSI'), expected[5][:4])
+
+        backends = ['stream'] + (['lxml'] if extract.lxml is not None else [])
+        for backend in backends:
+            self.assertEqual(expected, self.get_results(backend), msg=backend)
+            for tag in ('season', 'session', 'missing'):
+                self.assertEqual(extract.get_backend('bs4').options(test_results_page, tag),
+                                 extract.get_backend(backend).options(test_results_page, tag), msg=backend)
+        self.assertEqual(['FP1', 'RAC'], extract.get_backend('stream').options(test_results_page, 'session'))
+
+    def test_unclosed_elements(self):
+        """=> Unclosed cells should nest like in BeautifulSoup, in document order"""
+        page = '<table><tr><td>a<td>b<b>c</tr><tr><td>\xa0</td><td><i>\xa0</i></td></table><div class="padbot5">x'
+        self.assertEqual(extract.get_backend('bs4').results(page), extract.get_backend('stream').results(page))
+        self.assertEqual([('abc', False), ('bc', False), ('\xa0', True), ('\xa0', False)],
+                         extract.get_backend('stream').results(page).cells)
+
+
+class BenchmarkTests(TestCase):
+
+    def test_corpus_benchmark(self):
+        """=> The scraper benchmark should parse and ingest every corpus page, leaving the database untouched"""
+        report = run_benchmark(repeat=1)
+        self.assertEqual(9, report['parse']['pages'])
+        self.assertEqual(135, report['parse']['rows'])
+        self.assertEqual(6, report['ingest']['sessions'])
+        self.assertEqual(135, report['ingest']['rows'])
+        self.assertEqual(0, Result.objects.count())
+
+
+class ChartBenchmarkTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.created = generate_history(first_season=2003, seasons=4, events=3, categories=('MotoGP', 'Moto2'), riders=14)
+
+    def test_generated_history(self):
+        """=> The generator should create every session of each season's weekend format"""
+        self.assertEqual(4, Season.objects.count())
+        self.assertEqual(12, Event.objects.count())
+        # 2003 and 2004: race only, 2005: 9 sessions, 2006: 7 sessions
+        self.assertEqual(2 * 3 * (1 + 1 + 9 + 7), Session.objects.count())
+        self.assertEqual(self.created, Result.objects.count())
+        self.assertEqual(25, Result.objects.filter(session__event__season__year=2006, position=1,
+                                                   session__point_event=True).values_list('points', flat=True)[0])
+
+    def test_query_budgets(self):
+        """=> Chart builders should stay within their query budget whatever the length of the history"""
+        for name, objects, build in chart_builders():
+            for obj in objects:
+                with self.assertNumQueries(query_budgets[name], msg=f'{name} {obj}'):
+                    specs = build(obj)
+                self.assertTrue(specs, msg=f'{name} {obj}')
+        report = benchmark_charts()
+        self.assertEqual(4, report['season']['builds'])
+        self.assertEqual(24, report['session_history']['charts'])
+        report = benchmark_charts(store=True)
+        self.assertEqual([0, 0, 0], [measures['max_queries'] for measures in report.values()])
+
+    def test_results_store(self):
+        """=> The results store should hold every result, grouped by session and indexed by season, location, event"""
+        with self.assertNumQueries(2):
+            store = ResultsStore.load()
+        self.assertEqual(Result.objects.count(), len(store))
+        self.assertEqual([2003, 2004, 2005, 2006], sorted(store.by_season))
+        self.assertEqual(Session.objects.filter(event__season__year=2005).count(), len(store.by_season[2005]))
+
+        session = Session.objects.filter(event__season__year=2006, point_event=True).order_by('pk').last()
+        position = next(position for position in store.by_event[session.event_id]
+                        if store.session_id[position] == session.pk)
+        self.assertEqual(session.session_type, store.session_type[position])
+        self.assertIn(position, store.by_location[session.event.event_location_id])
+        expected = [(result.rider.__str__(), result.position, result.points, result.time_ms)
+                    for result in session.result_set.select_related('rider').order_by('pk')]
+        self.assertEqual(expected, [(store.riders[store.rider[result]], store.position[result], store.points[result],
+                                     store.time(result)) for result in store.results(position)])
+
+    def test_store_builds(self):
+        """=> Charts built from a store of the whole history should match charts loading only their own results"""
+        store = ResultsStore.load()
+        for name, objects, build in chart_builders():
+            for obj in objects:
+                with self.assertNumQueries(0, msg=f'{name} {obj}'):
+                    specs = build(obj, store=store)
+                self.assertEqual(build(obj), specs, msg=f'{name} {obj}')
+
+
+@skipIf(export.pyarrow is None, 'needs the pyarrow package')
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        generate_history(first_season=2010, seasons=2, events=2, categories=('MotoGP', 'Moto2'), riders=6)
+
+    def read(self):
+        import pyarrow.dataset
+        return pyarrow.dataset.dataset(self.directory.name, format='parquet', partitioning='hive').to_table()
+
+    def test_export(self):
+        """=> Every result should be exported once, partitioned by season and category, reading in small batches"""
+        self.assertEqual((4, Result.objects.count()), export.export_results(self.directory.name, batch_size=7))
+        table = self.read()
+        self.assertEqual(Result.objects.count(), table.num_rows)
+        rows = {row['result_id']: row for row in table.to_pylist()}
+        self.assertEqual(set(Result.objects.values_list('pk', flat=True)), set(rows))
+        self.assertEqual({2010, 2011}, {row['season'] for row in rows.values()})
+        winner = Result.objects.filter(session__point_event=True, position=1).select_related('rider').first()
+        row = rows[winner.pk]
+        self.assertEqual((winner.rider.full_name, winner.points, winner.time_ms, 'RAC'),
+                         (row['rider'], row['points'], row['time_ms'], row['session']))
+
+    def test_incremental_export(self):
+        """=> Only the partitions holding results stored since the last export should be exported again"""
+        export.export_results(self.directory.name)
+        self.assertEqual((0, 0), export.export_results(self.directory.name))
+        insert_in_database('2011', 'S09', 'MotoGP', 'WUP', scraped_page(test_scraped_timed_data[2:]))
+        partition = Result.objects.filter(session__event__season__year=2011, session__category__class_name='MotoGP')
+        self.assertEqual((1, partition.count()), export.export_results(self.directory.name))
+        self.assertEqual(Result.objects.count(), self.read().num_rows)
+        # Scraped again with fewer results: the previous rows of the session are dropped
+        insert_in_database('2011', 'S09', 'MotoGP', 'WUP', scraped_page(test_scraped_timed_data[2:6]))
+        self.assertEqual((1, partition.count()), export.export_results(self.directory.name))
+        self.assertEqual(set(Result.objects.values_list('pk', flat=True)),
+                         set(self.read().column('result_id').to_pylist()))
+        # A full export replaces the previous files
+        export.export_results(self.directory.name, full=True)
+        self.assertEqual(Result.objects.count(), self.read().num_rows)
+
+    def test_missing_pyarrow(self):
+        """=> The export command should fail cleanly without pyarrow"""
+        with mock.patch.object(export, 'pyarrow', None), self.assertRaises(CommandError):
+            call_command('exportresults', output=self.directory.name)
+
+
 from django.contrib.staticfiles import finders
 from django.contrib.staticfiles.storage import staticfiles_storage
 
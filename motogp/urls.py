@@ -13,4 +13,12 @@ urlpatterns = [
     path('season/<int:year>/', views.season_view, name='season'),
     path('track/<str:track>', views.track_view, name='track'),
     path('event/<int:season>/<str:event_name>/', views.event_view, name='event'),
+    path('data/season/<int:year>/', views.season_data, name='season_data'),
+    path('data/event/<int:season>/<str:event_name>/', views.event_data, name='event_data'),
+    path('data/track/<str:track>/', views.track_data, name='track_data'),
+    path('charts/season/<int:year>/<str:category>.svg', views.season_chart, name='season_chart'),
+    path('charts/event/<int:season>/<str:event_name>/<str:category>.svg', views.event_chart, name='event_chart'),
+    path('charts/track/<str:track>/<str:category>.svg', views.track_chart, name='track_chart'),
+    path('charts/styles/<str:name>', views.chart_stylesheet, name='chart_stylesheet'),
+    path('charts/files/<str:name>', views.chart_file, name='chart_file'),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
@@ -1,61 +1,257 @@
+import gzip
 import json
+import os
 
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404, render
+from django.urls import reverse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
 
-from .models import Season, EventLocation, Event, MenuOptions
+from .cache import cache_per_version, cached_per_version, data_version, data_version_etag, data_version_modified
+from .chart_cache import ChartCache
+from .charts import ChartSpec
+from .models import Season, EventLocation, Event, MenuOptions, charts_directory
+from .svg import read_manifest, served_file
 
 categories_order = ['MotoGP', '500cc', 'Moto2', '250cc', 'Moto3', '125cc', '80cc', '50cc']
 
+chart_cache = ChartCache(settings.CHART_CACHE_DIR, settings.CHART_CACHE_MEMORY_SIZE, settings.CHART_CACHE_MAX_SIZE)
 
+
+@cache_per_version
 def index(request):
     """ Home page view """
     season = get_object_or_404(Season, year=Season.objects.all().latest().year)
     return season_view(request, season.year)
 
 
+@cache_per_version
 def event_view(request, season, event_name):
     """ Results for a given event """
     y = Season.objects.get(year=int(season))
     e_loc = EventLocation.objects.get(location=event_name)
     event = get_object_or_404(Event, season=y, event_location=e_loc)
     categories = [cat.__str__() for cat in y.categories.all()]
-    charts = [f'motogp/charts/{y.__str__()}-{event.__str__()}-{cat}.svg' for cat in categories_order if cat in categories]
+    manifest = read_manifest(charts_directory())
+    charts = [chart_url(manifest, f'{y.year}-{event.__str__()}-{cat}', 'motogp:event_chart', y.year, event.__str__(),
+                        cat) for cat in categories_order if cat in categories]
     return render(request, 'motogp/event.html', {**{'charts': charts}, **menu_context()})
 
 
+@cache_per_version
 def track_view(request, track):
     """ History of results at a track """
     e_loc = EventLocation.objects.get(location=track)
     latest_season = Event.objects.filter(event_location=e_loc).latest().season
     categories = [cat.__str__() for cat in latest_season.categories.all()]
-    charts = [f'motogp/charts/{e_loc.__str__()}-{cat}.svg' for cat in categories_order if cat in categories]
+    manifest = read_manifest(charts_directory())
+    charts = [chart_url(manifest, f'{e_loc.__str__()}-{cat}', 'motogp:track_chart', e_loc.__str__(), cat)
+              for cat in categories_order if cat in categories]
     return render(request, 'motogp/event.html', {**{'charts': charts}, **menu_context()})
 
 
+@cache_per_version
 def season_view(request, year):
     """ Championship results for given season """
     season = get_object_or_404(Season, year=year)
     categories = [cat.__str__() for cat in season.categories.all()]
-    charts = [f'motogp/charts/{season.__str__()}-{cat}.svg' for cat in categories_order if cat in categories]
+    manifest = read_manifest(charts_directory())
+    charts = [chart_url(manifest, f'{season.year}-{cat}', 'motogp:season_chart', season.year, cat)
+              for cat in categories_order if cat in categories]
     return render(request, 'motogp/season.html', {**{'charts': charts}, **menu_context()})
 
 
+@cache_per_version
 def seasons_view(request):
     """ List of available seasons """
     return render(request, 'motogp/seasons.html', {**menu_context()})
 
 
+@cache_per_version
 def events_view(request):
     """ List of available tracks """
     return render(request, 'motogp/events.html', {**menu_context()})
 
 
+@condition(etag_func=data_version_etag, last_modified_func=data_version_modified)
+@cache_per_version
+def season_data(request, year):
+    """ Series of the championship charts of a season, as JSON """
+    season = get_object_or_404(Season, year=year)
+    return chart_json(season.season_chart_data())
+
+
+@condition(etag_func=data_version_etag, last_modified_func=data_version_modified)
+@cache_per_version
+def event_data(request, season, event_name):
+    """ Series of the session charts of an event, as JSON """
+    event = get_object_or_404(Event.objects.select_related('season', 'event_location'),
+                              season__year=season, event_location__location=event_name)
+    return chart_json(event.session_history_chart_data())
+
+
+@condition(etag_func=data_version_etag, last_modified_func=data_version_modified)
+@cache_per_version
+def track_data(request, track):
+    """ Series of the history charts of a track, as JSON """
+    return chart_json(latest_event(track).event_history_chart_data())
+
+
+def chart_url(manifest, name, view, *args):
+    """
+    :param manifest: Chart manifest, see read_manifest
+    :param name: Chart name, without extension
+    :param view: View rendering the chart on demand
+    :param args: Arguments of the view
+    :return: URL of the chart file written by the update commands, or of the view when there is none yet
+    """
+    written = manifest.get(f'{name}.svg')
+    if written is not None:
+        return reverse('motogp:chart_file', args=[written])
+    return reverse(view, args=args)
+
+
+def chart_file(request, name):
+    """ Chart or stylesheet written by the update commands, named after its content so it can be cached for good """
+    if not served_file.fullmatch(name):
+        raise Http404(f'No chart file {name}')
+    path = os.path.join(charts_directory(), name)
+    accepted = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    for encoding, extension in (('br', '.br'), ('gzip', '.gz'), (None, '')):
+        if encoding is not None and encoding not in accepted:
+            continue
+        try:
+            with open(path + extension, 'rb') as file:
+                content = file.read()
+        except OSError:
+            continue
+        response = HttpResponse(content, content_type='text/css' if name.endswith('.css') else 'image/svg+xml')
+        if encoding is not None:
+            response['Content-Encoding'] = encoding
+        patch_vary_headers(response, ['Accept-Encoding'])
+        patch_cache_control(response, public=True, max_age=365 * 24 * 3600, immutable=True)
+        return response
+    raise Http404(f'No chart file {name}')
+
+
+def accepts_gzip(request):
+    return 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+
+
+def chart_etag(request, *args, **kwargs):
+    """ Strong ETag of a chart, told apart for the gzipped body, for the condition decorator """
+    etag = data_version_etag(request)
+    return etag[:-1] + '-gz"' if accepts_gzip(request) else etag
+
+
+@condition(etag_func=chart_etag, last_modified_func=data_version_modified)
+def season_chart(request, year, category):
+    """ Championship chart of a season, rendered on first request """
+    charts = cached_per_version(f'season_chart:{year}',
+                                lambda: get_object_or_404(Season, year=year).season_chart_data())
+    return chart_response(request, charts, category, Season.chart_options)
+
+
+@condition(etag_func=chart_etag, last_modified_func=data_version_modified)
+def event_chart(request, season, event_name, category):
+    """ Session chart of an event, rendered on first request """
+    def build():
+        event = get_object_or_404(Event.objects.select_related('season', 'event_location'),
+                                  season__year=season, event_location__location=event_name)
+        return event.session_history_chart_data()
+
+    charts = cached_per_version(f'event_chart:{season}:{event_name}', build)
+    return chart_response(request, charts, category, Event.chart_options)
+
+
+@condition(etag_func=chart_etag, last_modified_func=data_version_modified)
+def track_chart(request, track, category):
+    """ History chart of a track, rendered on first request """
+    charts = cached_per_version(f'track_chart:{track}', lambda: latest_event(track).event_history_chart_data())
+    return chart_response(request, charts, category, Event.chart_options)
+
+
+def chart_stylesheet(request, name):
+    """ Stylesheet shared by the charts rendered on first request, named after its content """
+    css = chart_cache.stylesheet(name)
+    if css is None:
+        raise Http404(f'No stylesheet {name}')
+    response = HttpResponse(css, content_type='text/css')
+    patch_cache_control(response, public=True, max_age=365 * 24 * 3600)
+    return response
+
+
+def latest_event(track):
+    """
+    :param track: Event location
+    :return: Most recent event held there, the one history charts are built from
+    """
+    events = Event.objects.filter(event_location__location=track).select_related('season', 'event_location')
+    event = events.order_by('-season__year').first()
+    if event is None:
+        raise Http404(f'No event at {track}')
+    return event
+
+
+def chart_response(request, charts, category, options):
+    """
+    :param request: Request for the chart, gzipped charts are sent as is if the client accepts them
+    :param charts: Dictionary of category: chart data as expected by create_chart
+    :param category: Category of the chart to serve
+    :param options: Options passed to create_chart
+    :return: SVG response, from the chart cache when the data did not change
+    """
+    if category not in charts:
+        raise Http404(f'No {category} chart')
+    chart = chart_cache.get_or_render(ChartSpec(None, charts[category], options))
+    if accepts_gzip(request):
+        response = HttpResponse(chart, content_type='image/svg+xml')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(gzip.decompress(chart), content_type='image/svg+xml')
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
+
+
+def chart_json(charts):
+    """
+    Compact JSON form of chart data, much smaller than the rendered charts.
+
+    :param charts: Dictionary of category: chart data as expected by create_chart
+    :return: JsonResponse of {'charts': [{'category', 'title', 'columns', 'riders', 'values'}, ..]}, where values holds
+    one row per rider, in the order of riders
+    """
+    ordered = [cat for cat in categories_order if cat in charts] + [cat for cat in charts if cat not in categories_order]
+    series = []
+    for cat in ordered:
+        data = charts[cat]
+        riders = [rider for rider in data if rider not in ('title', 'columns')]
+        series.append({
+            'category': cat,
+            'title': data['title'],
+            'columns': list(data['columns']),
+            'riders': riders,
+            'values': [list(data[rider]) for rider in riders],
+        })
+    return JsonResponse({'charts': series}, json_dumps_params={'separators': (',', ':')})
+
+
 def menu_context():
     """
     Helper function for navigation.
 
     :return: dictionary object containing available charts
     """
-    menu, created = MenuOptions.objects.get_or_create()  # Safe: only one object
-    menu_data = {'menu_data': json.loads(menu.JSON_menu)}
+    key = f'motogp:menu:{data_version()}'
+    menu_data = cache.get(key)
+    if menu_data is None:
+        try:
+            menu = MenuOptions.objects.get()  # Safe: only one object
+        except MenuOptions.DoesNotExist:
+            menu = MenuOptions.rebuild()
+        menu_data = {'menu_data': json.loads(menu.JSON_menu)}
+        cache.set(key, menu_data)
     return menu_data